@@ -0,0 +1,213 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+
+# ANSWER_CACHE_PATH, ANSWER_CACHE_THRESHOLD and ANSWER_CACHE_MAX_ENTRIES are read when used, so .env values apply
+DEFAULT_ANSWER_CACHE_PATH = "./cache/answers.sqlite3"
+# Minimum cosine similarity between two normalized questions to reuse an answer
+DEFAULT_ANSWER_CACHE_THRESHOLD = 0.95
+# The oldest answers are evicted past this many
+DEFAULT_ANSWER_CACHE_MAX_ENTRIES = 5000
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# How long an answer stays valid, by the agent the router sent the question to.
+# Live data expires in minutes; knowledge base answers last until the collection is re-ingested.
+AGENT_TTLS = {
+    "Web Search Agent": 10 * MINUTE,
+    "Finance Agent": 5 * MINUTE,
+    "Leadership Topics Knowledgebase RAG Agent": 3 * DAY,
+    "Argocd Topics Knowledgebase RAG Agent": 3 * DAY,
+    "Confluence Knowledge Agent": 1 * DAY,
+    "Expert Content Writer Agent": 1 * HOUR,
+}
+# Used when the router answered by itself or the agent is unknown
+DEFAULT_TTL = 10 * MINUTE
+
+
+# Apologies and error reports from agents start like this; they are never cached
+FAILURE_PATTERN = re.compile(
+    r"^\W*(sorry|i apologi[sz]e|unfortunately|i('m| am) (sorry|unable|not able)"
+    r"|i (can't|cannot|couldn't|could not|was unable)|(an )?error( occurred)?\b)",
+    re.IGNORECASE
+)
+
+
+def _cache_path(path=None):
+    return path or os.getenv("ANSWER_CACHE_PATH", DEFAULT_ANSWER_CACHE_PATH)
+
+
+def is_failure_answer(text):
+    """True for answers that apologize or report an error instead of answering."""
+    return not text or not text.strip() or FAILURE_PATTERN.match(text.strip()) is not None
+
+
+def normalize_question(text):
+    """Lowercase, drop Slack mentions and collapse whitespace and trailing punctuation."""
+    text = re.sub(r"<@[A-Z0-9]+>", " ", text)
+    text = re.sub(r"\s+", " ", text).strip().lower()
+    return text.rstrip("?!. ")
+
+
+def _connect(path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS answers ("
+        " id INTEGER PRIMARY KEY, question TEXT NOT NULL, vector BLOB NOT NULL, answer TEXT NOT NULL,"
+        " agent TEXT, collections TEXT NOT NULL, created_at REAL NOT NULL, expires_at REAL NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS answers_expires_at ON answers (expires_at)")
+    return conn
+
+
+def invalidate_collection(collection, path=None):
+    """
+    Drop every cached answer that was built from a collection.
+
+    Called by dataloader.py after it re-ingests a collection. Works across
+    processes because the cache lives in SQLite.
+
+    Returns:
+        int: number of answers removed
+    """
+    conn = _connect(_cache_path(path))
+    try:
+        cursor = conn.execute("DELETE FROM answers WHERE collections LIKE ?", (f"%,{collection},%",))
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+
+class SemanticAnswerCache:
+    """
+    Answer cache keyed by the embedding of the normalized question.
+
+    A lookup returns the closest unexpired answer whose question embedding is
+    at least `threshold` cosine-similar to the new question. Each answer gets the
+    TTL of the agent that produced it and is tagged with the collections it used,
+    so invalidate_collection() can drop it when the collection changes.
+
+    Lookups score against an in-memory matrix of the unexpired answers. It is
+    rebuilt only after a store() or when another process changed the database
+    (e.g. dataloader.py invalidating a collection), which SQLite's data_version
+    reports. Past max_entries the oldest answers are evicted.
+    """
+
+    def __init__(self, embeddings, path=None, threshold=None, ttls=None, default_ttl=DEFAULT_TTL,
+                 max_entries=None):
+        self.embeddings = embeddings
+        self.path = _cache_path(path)
+        if threshold is None:
+            threshold = float(os.getenv("ANSWER_CACHE_THRESHOLD", str(DEFAULT_ANSWER_CACHE_THRESHOLD)))
+        self.threshold = threshold
+        if max_entries is None:
+            max_entries = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", str(DEFAULT_ANSWER_CACHE_MAX_ENTRIES)))
+        self.max_entries = max_entries
+        self.ttls = AGENT_TTLS if ttls is None else ttls
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        # In-memory copy of the unexpired answers: rows, their vectors and expiry times
+        self._rows = []
+        self._matrix = None
+        self._expires = None
+        self._data_version = None
+        self._stale = True
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = _connect(self.path)
+        return self._conn
+
+    def _embed(self, question):
+        vector = np.asarray(self.embeddings.embed_query(normalize_question(question)), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def ttl_for(self, agents):
+        # The most volatile agent involved decides how long the answer lives
+        ttls = [self.ttls.get(agent, self.default_ttl) for agent in agents]
+        return min(ttls) if ttls else self.default_ttl
+
+    def _refresh(self, now):
+        # Called with the lock held; data_version changes when another connection commits
+        conn = self._connection()
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if not self._stale and data_version == self._data_version:
+            return
+
+        rows = conn.execute(
+            "SELECT vector, answer, agent, created_at, expires_at FROM answers WHERE expires_at > ?",
+            (now,)
+        ).fetchall()
+        self._rows = [row[1:4] for row in rows]
+        self._expires = np.asarray([row[4] for row in rows], dtype=np.float64)
+        self._matrix = (np.frombuffer(b"".join(row[0] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+                        if rows else None)
+        self._data_version = data_version
+        self._stale = False
+
+    def lookup(self, question):
+        """
+        Returns:
+            dict with answer, agent, similarity and age_seconds, or None on a miss
+        """
+        vector = self._embed(question)
+        now = time.time()
+        best, best_score = None, self.threshold
+        with self._lock:
+            self._refresh(now)
+            if self._matrix is not None:
+                scores = self._matrix @ vector
+                # Answers that expired since the last rebuild never match
+                scores[self._expires <= now] = -1.0
+                index = int(np.argmax(scores))
+                if scores[index] >= best_score:
+                    best, best_score = self._rows[index], float(scores[index])
+
+        if best is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return {
+            "answer": best[0],
+            "agent": best[1],
+            "similarity": best_score,
+            "age_seconds": now - best[2],
+        }
+
+    def store(self, question, answer, agents=(), collections=()):
+        ttl = self.ttl_for(agents)
+        if ttl <= 0 or is_failure_answer(answer):
+            return
+
+        vector = self._embed(question)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM answers WHERE expires_at <= ?", (now,))
+            conn.execute(
+                "INSERT INTO answers (question, vector, answer, agent, collections, created_at, expires_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (normalize_question(question), vector.tobytes(), answer, ",".join(agents),
+                 "," + ",".join(collections) + ",", now, now + ttl)
+            )
+            conn.execute(
+                "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            conn.commit()
+            self._stale = True
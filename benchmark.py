@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+# The benchmark never calls OpenAI: select the fake embedding backend before dataloader reads it
+os.environ["EMBEDDING_BACKEND"] = "fake"
+
+from langchain_core.language_models import FakeListLLM
+
+import bm25_index
+import quantized_index
+import dataloader
+from embedding_writer import FakeEmbeddings, estimate_tokens
+from rag_validator import create_rag_chain, custom_prompt_template
+from registry import ResourceRegistry
+
+DEFAULT_QUERIES = "./benchmarks/queries_v2.json"
+
+# Chunking configurations compared by each run; "default" is what dataloader.py ships with
+CHUNKING_CONFIGS = {
+    "default": dataloader.CHUNK_SETTINGS,
+    "small": {
+        "pdf": {"chunk_size": 500, "chunk_overlap": 100},
+        "epub": {"chunk_size": 800, "chunk_overlap": 150}
+    }
+}
+
+
+def load_query_set(path):
+    """
+    Returns:
+        tuple: (version, queries)
+
+    Raises:
+        ValueError: if a relevant entry names only a file, without a page or a text snippet
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        query_set = json.load(f)
+    for query in query_set["queries"]:
+        if not query.get("relevant"):
+            raise ValueError(f"Query {query['id']} has no relevant chunks")
+        for entry in query["relevant"]:
+            if "page" not in entry and "contains" not in entry:
+                raise ValueError(f"Query {query['id']}: relevant entries need a 'page' or a 'contains' snippet, "
+                                 f"not only a source file")
+    return query_set["version"], query_set["queries"]
+
+
+def _normalize_text(text):
+    return " ".join(text.split()).casefold()
+
+
+def percentile(values, pct):
+    # Nearest-rank percentile, good enough for a few dozen samples
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))]
+
+
+def is_relevant(doc, relevant):
+    """
+    True if a retrieved chunk matches one of the query's relevant entries: same source
+    file name, and the same page and/or containing the snippet, whichever the entry gives.
+    """
+    source = os.path.basename(doc.metadata.get("source", ""))
+    text = _normalize_text(doc.page_content)
+    for entry in relevant:
+        if entry["source"] != source:
+            continue
+        if "page" in entry and doc.metadata.get("page") != entry["page"]:
+            continue
+        if "contains" in entry and _normalize_text(entry["contains"]) not in text:
+            continue
+        return True
+    return False
+
+
+def score_ranking(docs, relevant):
+    """
+    Args:
+        docs: retrieved Documents, best first
+        relevant: the query's relevant entries
+
+    Returns:
+        tuple: (hit within the ranking, reciprocal rank of the first relevant chunk, precision at k)
+    """
+    matches = [is_relevant(doc, relevant) for doc in docs]
+    if not any(matches):
+        return 0.0, 0.0, 0.0
+    return 1.0, 1.0 / (matches.index(True) + 1), sum(matches) / len(matches)
+
+
+def ingest(collections, docs_dir, persist_dir, embeddings, chunk_settings, modes):
+    """
+    Build throwaway collections (with their BM25 index, and the quantized export when
+    "quantized" is among modes) for one chunking configuration.
+
+    Returns:
+        tuple: (chunks per collection, ingest seconds)
+    """
+    import chromadb
+    chunk_counts = {}
+    started = time.perf_counter()
+    for collection_name in collections:
+        print(f"Ingesting {collection_name}")
+        dataloader.sync_collection(collection_name, os.path.join(docs_dir, collection_name),
+                                   persist_dir=persist_dir, embeddings=embeddings,
+                                   chunk_settings=chunk_settings)
+        collection = chromadb.PersistentClient(path=persist_dir).get_collection(collection_name)
+        chunk_counts[collection_name] = bm25_index.build_index(collection, persist_dir, collection_name)
+        if "quantized" in modes:
+            quantized_index.build_index(collection, persist_dir, collection_name)
+    return chunk_counts, time.perf_counter() - started
+
+
+def summarize(samples):
+    count = len(samples)
+    latencies = [s["retrieval_ms"] for s in samples]
+    return {
+        "queries": count,
+        "recall_at_k": sum(s["hit"] for s in samples) / count,
+        "mrr": sum(s["reciprocal_rank"] for s in samples) / count,
+        "precision_at_k": sum(s["precision"] for s in samples) / count,
+        "retrieval_p50_ms": percentile(latencies, 50),
+        "retrieval_p95_ms": percentile(latencies, 95),
+        "embedding_calls_per_query": sum(s["embedding_calls"] for s in samples) / count,
+        "query_tokens_per_query": sum(s["query_tokens"] for s in samples) / count,
+        "prompt_tokens_per_query": sum(s["prompt_tokens"] for s in samples) / count,
+    }
+
+
+def run_queries(queries, persist_dir, embeddings, mode, k, with_chain):
+    registry = ResourceRegistry(persist_dir=persist_dir, retrieval_mode=mode, embeddings=embeddings)
+
+    # The first query of a collection loads its HNSW index (or maps the exports); run one
+    # untimed so p50/p95 measure steady-state queries only
+    for collection_name in sorted({query["collection"] for query in queries}):
+        warm_up = next(query for query in queries if query["collection"] == collection_name)
+        registry.retriever(collection_name, k=k).invoke(warm_up["question"])
+
+    samples = []
+    for query in queries:
+        retriever = registry.retriever(query["collection"], k=k)
+        calls_before = embeddings.calls
+        started = time.perf_counter()
+        docs = retriever.invoke(query["question"])
+        retrieval_ms = 1000 * (time.perf_counter() - started)
+        embedding_calls = embeddings.calls - calls_before
+
+        sources = [os.path.basename(doc.metadata.get("source", "")) for doc in docs]
+        hit, reciprocal_rank, precision = score_ranking(docs, query["relevant"])
+        context = "\n\n".join(doc.page_content for doc in docs)
+        sample = {
+            "id": query["id"],
+            "collection": query["collection"],
+            "hit": hit,
+            "reciprocal_rank": reciprocal_rank,
+            "precision": precision,
+            "pages": [doc.metadata.get("page") for doc in docs],
+            "retrieval_ms": retrieval_ms,
+            "embedding_calls": embedding_calls,
+            "query_tokens": estimate_tokens(query["question"]),
+            "prompt_tokens": estimate_tokens(custom_prompt_template.format(context=context, question=query["question"])),
+            "sources": sources,
+        }
+
+        if with_chain:
+            # Exercise the full RetrievalQA path with a canned answer instead of GPT-4o-mini
+            chain = registry.chain(query["collection"], lambda name: create_rag_chain(
+                name, retriever=retriever, llm=FakeListLLM(responses=["offline benchmark answer"]), k=k
+            ))
+            started = time.perf_counter()
+            chain.invoke({"query": query["question"]})
+            sample["chain_ms"] = 1000 * (time.perf_counter() - started)
+
+        samples.append(sample)
+    return samples
+
+
+def run_benchmark(query_path, docs_dir, ks, modes, configs, with_chain=True):
+    """
+    Run every query of the query set for each chunking configuration, retrieval mode and k.
+
+    Returns:
+        dict: JSON-serializable report with per-collection and overall metrics for every run
+    """
+    version, queries = load_query_set(query_path)
+    collections = sorted({query["collection"] for query in queries})
+    report = {"query_set": {"path": query_path, "version": version, "queries": len(queries)}, "runs": []}
+
+    for config_name in configs:
+        chunk_settings = CHUNKING_CONFIGS[config_name]
+        persist_dir = tempfile.mkdtemp(prefix=f"agentrag-bench-{config_name}-")
+        try:
+            embeddings = FakeEmbeddings()
+            chunk_counts, ingest_seconds = ingest(collections, docs_dir, persist_dir, embeddings, chunk_settings,
+                                                  modes)
+            for mode in modes:
+                for k in ks:
+                    print(f"Running chunking={config_name} mode={mode} k={k}")
+                    samples = run_queries(queries, persist_dir, embeddings, mode, k, with_chain)
+                    by_collection = {
+                        name: summarize([s for s in samples if s["collection"] == name])
+                        for name in collections
+                    }
+                    report["runs"].append({
+                        "chunking": config_name,
+                        "chunk_settings": chunk_settings,
+                        "mode": mode,
+                        "k": k,
+                        "ingest_seconds": ingest_seconds,
+                        "chunks": chunk_counts,
+                        "overall": summarize(samples),
+                        "collections": by_collection,
+                        "queries": samples,
+                    })
+        finally:
+            shutil.rmtree(persist_dir, ignore_errors=True)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline retrieval benchmark over a versioned query set")
+    parser.add_argument("--queries", default=DEFAULT_QUERIES, help="query set JSON file")
+    parser.add_argument("--docs-dir", default=dataloader.docs_dir, help="directory with one subdirectory per collection")
+    parser.add_argument("--k", type=int, nargs="+", default=[4], help="retrieval depths to evaluate")
+    parser.add_argument("--modes", nargs="+", default=["dense", "hybrid"],
+                        choices=["dense", "hybrid", "quantized"])
+    parser.add_argument("--chunking", nargs="+", default=list(CHUNKING_CONFIGS), choices=list(CHUNKING_CONFIGS))
+    parser.add_argument("--no-chain", action="store_true", help="skip the RetrievalQA pass with the fake LLM")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.queries, args.docs_dir, args.k, args.modes, args.chunking,
+                           with_chain=not args.no_chain)
+
+    # Compact summary on the console, the full report as JSON
+    for run in report["runs"]:
+        overall = run["overall"]
+        print(f"{run['chunking']:>8} {run['mode']:>9} k={run['k']}: recall@k={overall['recall_at_k']:.2f} "
+              f"mrr={overall['mrr']:.3f} precision@k={overall['precision_at_k']:.2f} "
+              f"p50={overall['retrieval_p50_ms']:.1f}ms p95={overall['retrieval_p95_ms']:.1f}ms "
+              f"prompt_tokens={overall['prompt_tokens_per_query']:.0f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,216 @@
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Any
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import index_versions
+import tracing
+
+
+# Indexes live next to the Chroma data, one directory per collection
+BM25_DIRNAME = "bm25"
+
+# Keeps CLI flags, dotted names and hyphenated terms (--sync-policy, argocd.argoproj.io) as single tokens
+TOKEN_PATTERN = re.compile(r"-{0,2}[a-z0-9][a-z0-9_.\-]*")
+
+
+def tokenize(text):
+    """Lowercase tokens, plus the parts of hyphenated or dotted terms so both forms match."""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        token = token.rstrip(".-")
+        if not token:
+            continue
+        tokens.append(token)
+        parts = [part for part in re.split(r"[.\-]+", token) if part]
+        if len(parts) > 1 or token.startswith("-"):
+            tokens.extend(parts)
+    return tokens
+
+
+def index_dir(persist_dir, collection_name):
+    # Holds one directory per built version and the CURRENT pointer (see index_versions)
+    return os.path.join(persist_dir, BM25_DIRNAME, collection_name)
+
+
+def index_exists(persist_dir, collection_name):
+    return index_versions.current_dir(index_dir(persist_dir, collection_name)) is not None
+
+
+def index_generation(persist_dir, collection_name):
+    """Changes every time the index is rebuilt; None when there is no index."""
+    return index_versions.generation(index_dir(persist_dir, collection_name))
+
+
+def iter_collection_documents(collection, page_size=1000):
+    """Yield (id, text) for every chunk of a chromadb collection, one page at a time."""
+    offset = 0
+    while True:
+        page = collection.get(include=["documents"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            return
+        yield from zip(page["ids"], page["documents"])
+        offset += len(page["ids"])
+
+
+def build_index(collection, persist_dir, collection_name):
+    """
+    Build the BM25 index for a collection from the chunks stored in Chroma.
+
+    Postings are written as flat arrays (uint32 doc numbers, uint16 term
+    frequencies) grouped by term, so a term's postings are one contiguous
+    slice of a memory-mapped file at query time.
+
+    Returns:
+        int: number of chunks indexed
+    """
+    doc_ids, doc_lengths = [], []
+    postings = defaultdict(list)
+    for doc_number, (chunk_id, text) in enumerate(iter_collection_documents(collection)):
+        counts = Counter(tokenize(text or ""))
+        doc_ids.append(chunk_id)
+        doc_lengths.append(sum(counts.values()))
+        for term, tf in counts.items():
+            postings[term].append((doc_number, min(tf, 65535)))
+
+    terms = {}
+    docs_array, tf_array = [], []
+    for term in sorted(postings):
+        entries = postings[term]
+        terms[term] = [len(docs_array), len(entries)]
+        docs_array.extend(doc for doc, _ in entries)
+        tf_array.extend(tf for _, tf in entries)
+
+    # Write a new version and switch the pointer to it, so readers never see a half-built or missing index
+    root = index_dir(persist_dir, collection_name)
+    tmp = index_versions.new_version_dir(root)
+    np.asarray(docs_array, dtype=np.uint32).tofile(os.path.join(tmp, "postings_docs.u32"))
+    np.asarray(tf_array, dtype=np.uint16).tofile(os.path.join(tmp, "postings_tf.u16"))
+    np.asarray(doc_lengths, dtype=np.uint32).tofile(os.path.join(tmp, "doc_len.u32"))
+    with open(os.path.join(tmp, "doc_ids.json"), "w", encoding="utf-8") as f:
+        json.dump(doc_ids, f)
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "doc_count": len(doc_ids),
+            "avg_doc_len": (sum(doc_lengths) / len(doc_lengths)) if doc_lengths else 0.0,
+            "terms": terms
+        }, f)
+
+    index_versions.publish(root, tmp)
+    return len(doc_ids)
+
+
+def _memmap(path, dtype):
+    # np.memmap refuses empty files, and an empty collection gives empty arrays
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+class BM25Index:
+    """Read-only BM25 index over memory-mapped postings."""
+
+    def __init__(self, path, k1=1.2, b=0.75):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(path, "doc_ids.json"), "r", encoding="utf-8") as f:
+            self.doc_ids = json.load(f)
+
+        self.k1 = k1
+        self.b = b
+        self.doc_count = meta["doc_count"]
+        self.avg_doc_len = meta["avg_doc_len"] or 1.0
+        self.terms = meta["terms"]
+        self.postings_docs = _memmap(os.path.join(path, "postings_docs.u32"), np.uint32)
+        self.postings_tf = _memmap(os.path.join(path, "postings_tf.u16"), np.uint16)
+        self.doc_len = _memmap(os.path.join(path, "doc_len.u32"), np.uint32)
+
+    @classmethod
+    def load(cls, persist_dir, collection_name, **kwargs):
+        return cls(index_versions.current_dir(index_dir(persist_dir, collection_name)), **kwargs)
+
+    def search(self, query, k=10):
+        """
+        Returns:
+            list of (chunk_id, score), best first
+        """
+        scores = np.zeros(self.doc_count, dtype=np.float32)
+        for term in set(tokenize(query)):
+            entry = self.terms.get(term)
+            if entry is None:
+                continue
+            offset, df = entry
+            docs = self.postings_docs[offset:offset + df]
+            tf = self.postings_tf[offset:offset + df].astype(np.float32)
+            idf = math.log(1.0 + (self.doc_count - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self.doc_len[docs] / self.avg_doc_len)
+            scores[docs] += idf * tf * (self.k1 + 1.0) / (tf + norm)
+
+        matched = np.flatnonzero(scores)
+        if matched.size == 0:
+            return []
+        top = matched[np.argsort(-scores[matched])[:k]]
+        return [(self.doc_ids[i], float(scores[i])) for i in top]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Fuses BM25 and dense vector search over one collection with reciprocal-rank fusion.
+
+    Each side returns fetch_k candidates; a chunk's fused score is the sum of
+    1 / (rrf_k + rank) over the lists it appears in, and the top k are returned.
+    Exact-term matches (CLI flags, resource kinds, error strings) that dense
+    search misses still make it into a small k.
+    """
+
+    collection: Any
+    embeddings: Any
+    index: Any
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        vector = self.embeddings.embed_query(query)
+        with tracing.span("retrieval.dense", n_results=self.fetch_k):
+            dense = self.collection.query(
+                query_embeddings=[vector],
+                n_results=self.fetch_k,
+                include=["documents", "metadatas"]
+            )
+        docs = {
+            chunk_id: (text, metadata)
+            for chunk_id, text, metadata in zip(dense["ids"][0], dense["documents"][0], dense["metadatas"][0])
+        }
+        with tracing.span("retrieval.bm25") as bm25_span:
+            lexical = self.index.search(query, k=self.fetch_k)
+            bm25_span.set(hits=len(lexical))
+        rankings = [dense["ids"][0], [chunk_id for chunk_id, _ in lexical]]
+
+        fused = defaultdict(float)
+        for ranking in rankings:
+            for rank, chunk_id in enumerate(ranking):
+                fused[chunk_id] += 1.0 / (self.rrf_k + rank + 1)
+        top = sorted(fused, key=fused.get, reverse=True)[:self.k]
+
+        # Fetch the text of BM25-only hits
+        missing = [chunk_id for chunk_id in top if chunk_id not in docs]
+        if missing:
+            extra = self.collection.get(ids=missing, include=["documents", "metadatas"])
+            for chunk_id, text, metadata in zip(extra["ids"], extra["documents"], extra["metadatas"]):
+                docs[chunk_id] = (text, metadata)
+
+        results = []
+        for chunk_id in top:
+            if chunk_id in docs:
+                text, metadata = docs[chunk_id]
+                metadata = dict(metadata or {})
+                metadata["rrf_score"] = fused[chunk_id]
+                results.append(Document(page_content=text, metadata=metadata))
+        return results
@@ -0,0 +1,94 @@
+import json
+import logging
+import os
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Per-collection settings; collections without an entry get the defaults.
+# COLLECTIONS_CONFIG overrides the path; it is read on every call, so a value from .env applies.
+DEFAULT_COLLECTIONS_CONFIG = "./collections.json"
+
+# Used when neither the collection's entry nor the config's "defaults" set a value
+DEFAULTS = {
+    "k": 4,
+    "model": "gemini-2.0-flash-lite",
+    "cache_ttl": 3 * 24 * 60 * 60,
+}
+
+# One knowledge base collection and the agent that answers from it.
+# chunking maps file types to splitter settings, like dataloader.CHUNK_SETTINGS (None keeps the loader's defaults).
+# route_samples are example questions the pre-router builds the agent's centroid from.
+CollectionSpec = namedtuple(
+    "CollectionSpec",
+    ["name", "agent_name", "description", "k", "model", "chunking", "cache_ttl", "instructions", "route_samples"]
+)
+
+
+def load_config(path=None):
+    """
+    Args:
+        path: config file (COLLECTIONS_CONFIG by default)
+
+    Returns:
+        dict: {"defaults": {...}, "collections": {name: {...}}}; empty sections when the file does not exist
+    """
+    if path is None:
+        path = os.getenv("COLLECTIONS_CONFIG", DEFAULT_COLLECTIONS_CONFIG)
+    if not path or not os.path.exists(path):
+        return {"defaults": {}, "collections": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    return {"defaults": config.get("defaults", {}), "collections": config.get("collections", {})}
+
+
+def make_spec(name, entry, defaults=None):
+    settings = {**DEFAULTS, **(defaults or {}), **entry}
+    description = settings.get("description") or f"{name} or related topics"
+    return CollectionSpec(
+        name=name,
+        agent_name=settings.get("agent_name") or f"{name} Topics Knowledgebase RAG Agent",
+        description=description,
+        k=int(settings["k"]),
+        model=settings["model"],
+        chunking=settings.get("chunking"),
+        cache_ttl=float(settings["cache_ttl"]),
+        instructions=settings.get("instructions"),
+        # Without configured examples the description stands in as the one sample query
+        route_samples=list(entry.get("route_samples") or [description])
+    )
+
+
+def discover_collections(client, path=None, exclude=()):
+    """
+    Build a spec for every collection in the Chroma client, merged with its config entry.
+
+    Collections listed in exclude (served by a hand-written agent) or with
+    "agent": false in the config get no knowledge base agent.
+
+    Returns:
+        list of CollectionSpec, ordered by collection name
+    """
+    config = load_config(path)
+    # Chroma 0.6 lists names, older versions Collection objects
+    names = sorted(getattr(collection, "name", collection) for collection in client.list_collections())
+
+    specs = []
+    for name in names:
+        entry = config["collections"].get(name, {})
+        if name in exclude or entry.get("agent") is False:
+            continue
+        specs.append(make_spec(name, entry, config["defaults"]))
+
+    unknown = sorted(set(config["collections"]) - set(names))
+    if unknown:
+        logger.info(f"Configured collections not found in Chroma (not ingested yet?): {unknown}")
+    logger.info(f"Discovered {len(specs)} knowledge base collections: {[spec.name for spec in specs]}")
+    return specs
+
+
+def chunk_settings_for(collection, default, path=None):
+    """Splitter settings by file type for a collection: its configured chunking over the default."""
+    config = load_config(path)
+    chunking = config["collections"].get(collection, {}).get("chunking") or config["defaults"].get("chunking") or {}
+    return {file_type: {**settings, **chunking.get(file_type, {})} for file_type, settings in default.items()}
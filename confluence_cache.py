@@ -0,0 +1,155 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# On-disk tier shared across processes; set CONFLUENCE_PAGE_CACHE_PATH to "" to keep pages in memory only
+CONFLUENCE_PAGE_CACHE_PATH = os.getenv("CONFLUENCE_PAGE_CACHE_PATH", "./cache/confluence_pages.sqlite3") or None
+# Pages held in memory, and pages kept on disk
+CONFLUENCE_PAGE_CACHE_ENTRIES = int(os.getenv("CONFLUENCE_PAGE_CACHE_ENTRIES", "256"))
+CONFLUENCE_PAGE_CACHE_DISK_ENTRIES = int(os.getenv("CONFLUENCE_PAGE_CACHE_DISK_ENTRIES", "5000"))
+# A page checked against Confluence more recently than this is served without asking again
+CONFLUENCE_REVALIDATE_SECONDS = float(os.getenv("CONFLUENCE_REVALIDATE_SECONDS", "60"))
+
+
+class PageCache:
+    """
+    Confluence pages keyed by page ID, tagged with the version number they were fetched at.
+
+    Entries are dicts with at least "version" and usually "title", "url",
+    "type", "excerpt" and "markdown" (the page body; missing when the page
+    was only seen in search results). The memory tier is an LRU of max_entries
+    pages; the optional SQLite tier at path holds up to max_disk_entries more
+    and survives restarts.
+
+    The cache never decides freshness by itself: callers compare the cached
+    version with the page's current version (a cheap expand=version request)
+    and call mark_checked() when they match, so is_fresh() can skip that
+    request for revalidate_after seconds.
+    """
+
+    def __init__(self, max_entries=CONFLUENCE_PAGE_CACHE_ENTRIES, path=CONFLUENCE_PAGE_CACHE_PATH,
+                 max_disk_entries=CONFLUENCE_PAGE_CACHE_DISK_ENTRIES,
+                 revalidate_after=CONFLUENCE_REVALIDATE_SECONDS):
+        self.max_entries = max_entries
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.revalidate_after = revalidate_after
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        # Opened lazily so importing the tools never touches the disk
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                " page_id TEXT PRIMARY KEY, version INTEGER NOT NULL, data TEXT NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS pages_last_used ON pages (last_used)")
+            self._conn = conn
+        return self._conn
+
+    def _remember(self, page_id, entry):
+        self._pages[page_id] = entry
+        self._pages.move_to_end(page_id)
+        while len(self._pages) > self.max_entries:
+            self._pages.popitem(last=False)
+
+    def _load(self, page_id):
+        # Memory first, then the disk tier; caller holds the lock
+        entry = self._pages.get(page_id)
+        if entry is None and self.path:
+            row = self._connect().execute("SELECT data FROM pages WHERE page_id = ?", (page_id,)).fetchone()
+            if row:
+                entry = json.loads(row[0])
+                # The check time is not trusted across processes, so disk hits are revalidated on first use
+                entry["checked_at"] = 0.0
+                self._conn.execute("UPDATE pages SET last_used = ? WHERE page_id = ?", (time.time(), page_id))
+                self._conn.commit()
+        return entry
+
+    def get(self, page_id):
+        """Return the cached entry for page_id, or None."""
+        page_id = str(page_id)
+        with self._lock:
+            entry = self._load(page_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(page_id, entry)
+            return entry
+
+    def version(self, page_id):
+        entry = self.get(page_id)
+        return entry["version"] if entry else None
+
+    def put(self, page_id, version, **fields):
+        """
+        Store a page at a version. Fields not given keep their cached value when the version is unchanged.
+
+        Returns:
+            dict: the stored entry
+        """
+        page_id = str(page_id)
+        with self._lock:
+            previous = self._load(page_id)
+            entry = dict(previous) if previous and previous["version"] == version else {}
+            entry.update(fields)
+            entry["version"] = version
+            entry["checked_at"] = time.time()
+            self._remember(page_id, entry)
+
+            if self.path:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO pages (page_id, version, data, last_used) VALUES (?, ?, ?, ?)",
+                    (page_id, version, json.dumps(entry), entry["checked_at"])
+                )
+                self._evict(conn)
+                conn.commit()
+            return entry
+
+    def _evict(self, conn):
+        count = conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+        if count <= self.max_disk_entries:
+            return
+        # Evict down to 90% of the cap so we do not evict on every insert
+        conn.execute(
+            "DELETE FROM pages WHERE rowid IN (SELECT rowid FROM pages ORDER BY last_used ASC LIMIT ?)",
+            (count - int(self.max_disk_entries * 0.9),)
+        )
+
+    def is_fresh(self, entry):
+        return time.time() - entry.get("checked_at", 0.0) < self.revalidate_after
+
+    def mark_checked(self, page_id):
+        """Record that the cached version was just confirmed as current."""
+        with self._lock:
+            self.revalidations += 1
+            entry = self._pages.get(str(page_id))
+            if entry is not None:
+                entry["checked_at"] = time.time()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "pages": len(self._pages),
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,203 @@
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import chromadb
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+from ingest_manifest import Manifest, text_sha256, make_chunk_id
+from embedding_writer import EmbeddingWriter, ChromaSink
+from answer_cache import invalidate_collection
+from html_text import html_to_markdown
+import bm25_index
+import quantized_index
+import dataloader
+from confluence_tool import (
+    CONFLUENCE_URL, CONFLUENCE_SPACE_KEY, CONFLUENCE_COLLECTION,
+    confluence_get, iter_result_pages, close_client, config_error
+)
+
+# Pages per listing request, and how many page bodies are downloaded at once
+CONFLUENCE_CRAWL_PAGE_SIZE = int(os.getenv("CONFLUENCE_CRAWL_PAGE_SIZE", "100"))
+CONFLUENCE_FETCH_WORKERS = int(os.getenv("CONFLUENCE_FETCH_WORKERS", "8"))
+# Page bodies downloaded or waiting to be split at any time, so memory does not grow with the space
+CONFLUENCE_FETCH_WINDOW = int(os.getenv("CONFLUENCE_FETCH_WINDOW", str(4 * CONFLUENCE_FETCH_WORKERS)))
+
+# Pages are split like the PDFs in ./docs
+CONFLUENCE_CHUNK_SETTINGS = {"chunk_size": 1000, "chunk_overlap": 200}
+
+
+def list_space_pages(space_key, page_size=CONFLUENCE_CRAWL_PAGE_SIZE):
+    """
+    List every current page of a space with its version, without bodies.
+
+    Returns:
+        dict: {page_id: page JSON (id, title, version, _links)}
+    """
+    params = {"spaceKey": space_key, "type": "page", "status": "current", "limit": page_size, "expand": "version"}
+    pages = {}
+    for results, _ in iter_result_pages("/rest/api/content", params):
+        for page in results:
+            pages[page["id"]] = page
+    return pages
+
+
+def fetch_page(page_id):
+    return confluence_get(f"/rest/api/content/{page_id}", {"expand": "body.storage,version,space"})
+
+
+def page_to_documents(page, splitter):
+    """Split one page into chunks that carry its title, URL and version."""
+    # Markdown keeps headings, lists, tables and code blocks readable in the chunks, without macro markup
+    text = html_to_markdown(page.get("body", {}).get("storage", {}).get("value", ""))
+    title = page.get("title", "Untitled")
+    version = page.get("version", {})
+    metadata = {
+        "source": f"{CONFLUENCE_URL}{page.get('_links', {}).get('webui', '')}",
+        "title": title,
+        "page_id": page["id"],
+        "space": page.get("space", {}).get("key", ""),
+        "version": version.get("number", 0),
+        "updated": version.get("when", ""),
+    }
+    # The title goes into the text so every chunk of a short page still says what it is about
+    return splitter.split_documents([Document(page_content=f"{title}\n\n{text}", metadata=metadata)])
+
+
+def sync_space(space_key, collection_name=CONFLUENCE_COLLECTION, persist_dir=dataloader.persist_dir,
+               embeddings=dataloader.embeddings, chunk_settings=CONFLUENCE_CHUNK_SETTINGS):
+    """
+    Bring a Chroma collection in line with the pages of a Confluence space.
+
+    The space is listed with version info only; bodies are downloaded just
+    for pages that are new or whose version.when changed since the last sync.
+    Chunks of deleted and changed pages are removed by the IDs recorded in the
+    manifest, exactly like dataloader.sync_collection does for files.
+
+    Returns:
+        bool: True if the collection was modified
+    """
+    manifest = Manifest.load(persist_dir, collection_name)
+    # Confluence collections always had a manifest, so there are no legacy chunks to clear
+    manifest.legacy_cleanup_pending = False
+    started = time.perf_counter()
+    pages = list_space_pages(space_key)
+    current = {page_id: page.get("version", {}).get("when", "") for page_id, page in pages.items()}
+    # Pages synced before chunk settings were recorded were split with the built-in settings
+    manifest.assume_chunking({page_id: CONFLUENCE_CHUNK_SETTINGS for page_id in manifest.files})
+    added, modified, removed, unchanged = manifest.diff(current, {page_id: chunk_settings for page_id in current})
+
+    print(f"  {len(pages)} pages listed in {time.perf_counter() - started:.1f}s: "
+          f"{len(added)} new, {len(modified)} changed, {len(removed)} removed, {len(unchanged)} unchanged")
+    if not (added or modified or removed):
+        print(f"  Collection '{collection_name}' is up to date")
+        return False
+
+    client = chromadb.PersistentClient(path=persist_dir)
+    collection = client.get_or_create_collection(name=collection_name, embedding_function=None)
+
+    # Drop the chunks of removed and changed pages
+    for page_id in removed + modified:
+        stale_ids = manifest.chunk_ids(page_id)
+        if stale_ids:
+            collection.delete(ids=stale_ids)
+        manifest.remove(page_id)
+    manifest.save()
+
+    in_flight = {}
+
+    def on_page_committed(page_id):
+        # Record the page only after all its chunks are written, so a crash re-fetches it next run
+        chunk_ids, chunk_hashes = in_flight.pop(page_id)
+        manifest.record(page_id, current[page_id], chunk_ids, chunk_hashes, chunking=chunk_settings)
+        manifest.save()
+
+    writer = EmbeddingWriter(
+        ChromaSink(collection),
+        embeddings,
+        batch_size=dataloader.EMBED_BATCH_SIZE,
+        max_concurrency=dataloader.EMBED_CONCURRENCY,
+        requests_per_minute=dataloader.EMBED_REQUESTS_PER_MINUTE,
+        tokens_per_minute=dataloader.EMBED_TOKENS_PER_MINUTE,
+        checkpoint_path=manifest.path + ".writer.log",
+        on_source_committed=on_page_committed
+    )
+    splitter = RecursiveCharacterTextSplitter(**chunk_settings)
+
+    # Page bodies are fetched concurrently over the shared keep-alive client, at most
+    # CONFLUENCE_FETCH_WINDOW ahead of the page being split and queued for embedding
+    started = time.perf_counter()
+    total_chunks = 0
+    pending = iter(added + modified)
+    with writer, ThreadPoolExecutor(max_workers=CONFLUENCE_FETCH_WORKERS) as executor:
+        window = deque((page_id, executor.submit(fetch_page, page_id))
+                       for page_id in islice(pending, max(1, CONFLUENCE_FETCH_WINDOW)))
+        while window:
+            page_id, future = window.popleft()
+            next_id = next(pending, None)
+            if next_id is not None:
+                window.append((next_id, executor.submit(fetch_page, next_id)))
+            try:
+                page = future.result()
+            except Exception as e:
+                print(f"  Failed to fetch page {page_id}: {str(e)}")
+                continue
+
+            split_docs = page_to_documents(page, splitter)
+            chunk_hashes = [text_sha256(doc.page_content) for doc in split_docs]
+            chunk_ids = [make_chunk_id(collection_name, page_id, i, h) for i, h in enumerate(chunk_hashes)]
+            in_flight[page_id] = (chunk_ids, chunk_hashes)
+            writer.add_source(page_id, chunk_ids, split_docs)
+            total_chunks += len(split_docs)
+
+    print(f"  Embedded {writer.stats['chunks']} chunks in {writer.stats['batches']} batches "
+          f"({writer.stats['skipped']} resumed from checkpoint, {writer.stats['retries']} rate-limit retries)")
+    print(f"  Updated collection '{collection_name}' with {total_chunks} new chunks in {time.perf_counter() - started:.1f}s")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync a Confluence space into a Chroma collection")
+    parser.add_argument("--space", default=CONFLUENCE_SPACE_KEY, help="space key (defaults to CONFLUENCE_SPACE_KEY)")
+    parser.add_argument("--collection", default=CONFLUENCE_COLLECTION, help="Chroma collection to sync into")
+    args = parser.parse_args()
+
+    error = config_error()
+    if error or not args.space:
+        raise SystemExit(error or "No Confluence space given (--space or CONFLUENCE_SPACE_KEY)")
+
+    print(f"Processing Confluence space {args.space} into collection: {args.collection}")
+    try:
+        changed = sync_space(args.space, args.collection)
+    finally:
+        close_client()
+
+    if changed:
+        # Cached Slack answers built from the old pages are stale now
+        removed_answers = invalidate_collection(args.collection)
+        print(f"  Invalidated {removed_answers} cached answers")
+
+    # Rebuild the BM25 index used for hybrid retrieval when the collection changed
+    if changed or not bm25_index.index_exists(dataloader.persist_dir, args.collection):
+        try:
+            collection = chromadb.PersistentClient(path=dataloader.persist_dir).get_collection(args.collection)
+        except Exception:
+            collection = None
+        if collection is not None:
+            indexed = bm25_index.build_index(collection, dataloader.persist_dir, args.collection)
+            print(f"  Built BM25 index over {indexed} chunks")
+
+    if quantized_index.export_enabled() and (
+            changed or not quantized_index.index_exists(dataloader.persist_dir, args.collection)):
+        try:
+            collection = chromadb.PersistentClient(path=dataloader.persist_dir).get_collection(args.collection)
+        except Exception:
+            collection = None
+        if collection is not None:
+            exported = quantized_index.build_index(collection, dataloader.persist_dir, args.collection)
+            print(f"  Exported {exported} chunks to the {quantized_index.quantized_dtype()} quantized index")
+    print("Processing complete.")
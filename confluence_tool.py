@@ -1,81 +1,286 @@
 import json
 import httpx
 from typing import Optional
+import importlib.util
 import os
+import threading
 from dotenv import load_dotenv
 
+# Load environment variables once, when the tools are imported (before confluence_cache reads its settings)
+load_dotenv()
+
+from rate_limit import retry_with_backoff, is_transient_error
+from embedding_writer import estimate_tokens
+from confluence_cache import PageCache
+from html_text import html_to_markdown, html_excerpt
+import tracing
+
+# Confluence credentials
+CONFLUENCE_URL = (os.getenv("CONFLUENCE_URL") or "").rstrip("/")
+CONFLUENCE_USERNAME = os.getenv("CONFLUENCE_USERNAME")
+CONFLUENCE_API_TOKEN = os.getenv("CONFLUENCE_API_TOKEN")
+CONFLUENCE_SPACE_KEY = os.getenv("CONFLUENCE_SPACE_KEY")
+
+# HTTP client settings
+CONFLUENCE_TIMEOUT = float(os.getenv("CONFLUENCE_TIMEOUT", "30"))
+CONFLUENCE_CONNECT_TIMEOUT = float(os.getenv("CONFLUENCE_CONNECT_TIMEOUT", "5"))
+CONFLUENCE_MAX_CONNECTIONS = int(os.getenv("CONFLUENCE_MAX_CONNECTIONS", "20"))
+CONFLUENCE_MAX_RETRIES = int(os.getenv("CONFLUENCE_MAX_RETRIES", "3"))
+CONFLUENCE_RETRY_BASE_DELAY = float(os.getenv("CONFLUENCE_RETRY_BASE_DELAY", "0.5"))
+# HTTP/2 needs the optional h2 package (pip install httpx[http2])
+CONFLUENCE_HTTP2 = os.getenv("CONFLUENCE_HTTP2", "true").lower() == "true" and importlib.util.find_spec("h2") is not None
+
+# Search paging: results per request, and the most results a tool call returns
+CONFLUENCE_PAGE_SIZE = int(os.getenv("CONFLUENCE_PAGE_SIZE", "25"))
+CONFLUENCE_MAX_RESULTS = int(os.getenv("CONFLUENCE_MAX_RESULTS", "10"))
+
+# Searches leave out page bodies, and fetch only the ones not cached at their current version,
+# while at least this share of recent search hits was already cached (0 to always, above 1 to never)
+CONFLUENCE_LEAN_SEARCH_HIT_RATE = float(os.getenv("CONFLUENCE_LEAN_SEARCH_HIT_RATE", "0.5"))
+# Weight of the latest search in the moving hit rate
+SEARCH_HIT_RATE_WEIGHT = 0.3
+
+# Longest page body, in characters of markdown, handed to the agent (0 for no limit)
+CONFLUENCE_PAGE_MAX_CHARS = int(os.getenv("CONFLUENCE_PAGE_MAX_CHARS", "20000"))
+# Appended to a page body cut at CONFLUENCE_PAGE_MAX_CHARS, so the agent knows the page goes on
+TRUNCATION_MARKER = "[truncated]"
+
+# Chroma collection that confluence_loader.py syncs the space into
+CONFLUENCE_COLLECTION = os.getenv("CONFLUENCE_COLLECTION", "Confluence")
+
+_client = None
+_client_lock = threading.Lock()
+
+# Moving share of search hits found in the page cache; starts cold, so the first searches expand bodies
+_search_hit_rate = 0.0
+_search_hit_rate_lock = threading.Lock()
+
+# Pages by ID and version, shared by search and retrieval
+page_cache = PageCache()
+
+
+def get_client():
+    """
+    Return the shared Confluence HTTP client.
+
+    One keep-alive connection pool (HTTP/2 when h2 is installed) is shared by
+    every tool call, so a search followed by several page retrievals pays for
+    a single TLS handshake.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = httpx.Client(
+                base_url=CONFLUENCE_URL,
+                auth=(CONFLUENCE_USERNAME, CONFLUENCE_API_TOKEN),
+                http2=CONFLUENCE_HTTP2,
+                timeout=httpx.Timeout(CONFLUENCE_TIMEOUT, connect=CONFLUENCE_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=CONFLUENCE_MAX_CONNECTIONS,
+                                    max_keepalive_connections=CONFLUENCE_MAX_CONNECTIONS),
+                headers={"Accept": "application/json"}
+            )
+        return _client
+
+
+def close_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def config_error():
+    if all([CONFLUENCE_URL, CONFLUENCE_USERNAME, CONFLUENCE_API_TOKEN]):
+        return None
+    return json.dumps({
+        "error": "Missing Confluence configuration",
+        "status": "error",
+        "message": "Confluence URL, username, or API token not provided"
+    })
+
+
+def confluence_get(path, params=None):
+    """
+    GET a Confluence REST path on the shared client, retrying 429s, 5xx and timeouts with backoff.
+
+    Returns:
+        dict: the decoded JSON response
+    """
+    attempts = []
+
+    def send():
+        attempts.append(1)
+        response = get_client().get(path, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    with tracing.span("confluence.http", path=path.split("?")[0]) as http_span:
+        try:
+            return retry_with_backoff(send, max_retries=CONFLUENCE_MAX_RETRIES,
+                                      base_delay=CONFLUENCE_RETRY_BASE_DELAY, retry_on=is_transient_error)
+        finally:
+            http_span.set(attempts=len(attempts))
+
+
+def build_cql(query, space_key=None):
+    # Quotes inside the query would end the CQL string early
+    escaped = query.replace("\\", "\\\\").replace('"', '\\"')
+    cql = f'text ~ "{escaped}"'
+    space = space_key or CONFLUENCE_SPACE_KEY
+    if space:
+        cql += f' AND space = "{space}"'
+    return cql
+
+
+def iter_result_pages(path, params):
+    """
+    Yield the results of a paginated Confluence REST listing one page at a time.
+
+    Follows the _links.next cursor the API returns, so the caller can stop
+    as soon as it has enough results without fetching the remaining pages.
+
+    Returns:
+        generator of (results, total_size) per page
+    """
+    while path:
+        page = confluence_get(path, params)
+        results = page.get("results", [])
+        yield results, page.get("totalSize", page.get("size", len(results)))
+
+        # The next link already carries the cursor, limit and expand parameters
+        next_link = page.get("_links", {}).get("next")
+        if not results or not next_link:
+            return
+        path, params = next_link, None
+
+
+def iter_search_pages(cql, expand="metadata.labels,body.view.value", page_size=CONFLUENCE_PAGE_SIZE):
+    """Yield CQL search results one page at a time, as (results, total_size)."""
+    return iter_result_pages("/rest/api/content/search", {"cql": cql, "limit": page_size, "expand": expand})
+
+
+def _page_version(page):
+    return page.get("version", {}).get("number")
+
+
+def _cache_search_hit(result):
+    # Remember the excerpt of a search hit that came back with its body
+    body_content = result.get("body", {}).get("view", {}).get("value", "")
+    return page_cache.put(
+        result.get("id"),
+        _page_version(result),
+        title=result.get("title", "Untitled"),
+        url=f"{CONFLUENCE_URL}{result.get('_links', {}).get('webui', '')}",
+        type=result.get("type"),
+        excerpt=html_excerpt(body_content)
+    )
+
+
+def _cached_hit(result):
+    # The cached entry of a search hit, if it holds an excerpt of the hit's current version
+    entry = page_cache.get(result.get("id"))
+    if entry and entry["version"] == _page_version(result) and entry.get("excerpt") is not None:
+        return entry
+    return None
+
+
+def _record_search_hits(cached, hits):
+    global _search_hit_rate
+    if not hits:
+        return
+    with _search_hit_rate_lock:
+        _search_hit_rate += SEARCH_HIT_RATE_WEIGHT * (cached / hits - _search_hit_rate)
+
+
+def _lean_search():
+    """
+    Whether the next search should leave out page bodies.
+
+    A lean search costs a second request for the hits that are not cached, so
+    it only pays off while most hits are; the choice follows the hit rate of
+    recent searches instead of whether anything at all is cached.
+    """
+    with _search_hit_rate_lock:
+        return _search_hit_rate >= CONFLUENCE_LEAN_SEARCH_HIT_RATE
+
+
+def _fetch_excerpts(page_ids):
+    """Fetch the bodies of several pages in one search call and cache their excerpts."""
+    entries = {}
+    cql = f"id in ({','.join(page_ids)})"
+    for results, _ in iter_search_pages(cql, expand="version,body.view.value", page_size=len(page_ids)):
+        for result in results:
+            entries[result.get("id")] = _cache_search_hit(result)
+    return entries
+
 
 # Simple function to search Confluence
-def search_confluence_docs(query: str, space_key: Optional[str] = None) -> str:
+def search_confluence_docs(query: str, space_key: Optional[str] = None, max_results: Optional[int] = None) -> str:
     """
     Search Confluence for documents related to the query.
 
     Args:
         query: The search query for finding relevant Confluence pages
         space_key: Optional space key to limit search to a specific space
+        max_results: Optional number of results to return (defaults to 10)
 
     Returns:
         str: JSON string with search results containing titles, URLs, and excerpts
     """
-    # Load environment variables
-    load_dotenv()
+    error = config_error()
+    if error:
+        return error
 
-    # Get Confluence credentials
-    confluence_url = os.getenv("CONFLUENCE_URL")
-    confluence_username = os.getenv("CONFLUENCE_USERNAME")
-    confluence_api_token = os.getenv("CONFLUENCE_API_TOKEN")
-    default_space_key = os.getenv("CONFLUENCE_SPACE_KEY")
+    max_results = max_results or CONFLUENCE_MAX_RESULTS
+    # While recent hits were mostly cached, search without bodies and only fetch the ones we do not have
+    lean = _lean_search()
+    expand = "version" if lean else "version,body.view.value"
+    try:
+        with tracing.span("confluence.search", lean=lean) as search_span:
+            # Fetch further pages only while more results are needed
+            hits = []
+            total = 0
+            for results, total in iter_search_pages(build_cql(query, space_key), expand=expand,
+                                                    page_size=min(CONFLUENCE_PAGE_SIZE, max_results)):
+                hits.extend(results)
+                if len(hits) >= max_results:
+                    break
+            hits = hits[:max_results]
 
-    if not all([confluence_url, confluence_username, confluence_api_token]):
-        return json.dumps({
-            "error": "Missing Confluence configuration",
-            "status": "error",
-            "message": "Confluence URL, username, or API token not provided"
-        })
+            # Cached hits are counted in both modes, so a full search can switch the next one to lean
+            entries = {}
+            cached = 0
+            for result in hits:
+                entry = _cached_hit(result)
+                cached += entry is not None
+                if not lean:
+                    entries[result.get("id")] = _cache_search_hit(result)
+                elif entry is not None:
+                    entries[result.get("id")] = entry
+            _record_search_hits(cached, len(hits))
 
-    try:
-        # Construct CQL query
-        cql = f'text ~ "{query}"'
-        if space_key or default_space_key:
-            space = space_key or default_space_key
-            cql += f' AND space = "{space}"'
-
-        # Make the search request directly
-        response = httpx.get(
-            f"{confluence_url.rstrip('/')}/rest/api/content/search",
-            params={
-                "cql": cql,
-                "limit": 10,
-                "expand": "metadata.labels,body.view.value"
-            },
-            auth=(confluence_username, confluence_api_token),
-            timeout=30.0
-        )
-
-        # Check response status
-        response.raise_for_status()
-        results = response.json()
-
-        # Format results for readability
-        formatted_results = []
-        for result in results.get("results", []):
-            # Extract content excerpt
-            body_content = result.get("body", {}).get("view", {}).get("value", "")
-            # Basic HTML to text conversion for excerpt
-            excerpt = _extract_excerpt(body_content)
-
-            formatted_results.append({
-                "title": result.get("title", "Untitled"),
-                "url": f"{confluence_url.rstrip('/')}{result.get('_links', {}).get('webui', '')}",
-                "excerpt": excerpt,
-                "id": result.get("id"),
-                "type": result.get("type")
-            })
+            missing = [result.get("id") for result in hits if result.get("id") not in entries]
+            search_span.set(hits=len(hits), cached=cached)
+            if missing and lean:
+                entries.update(_fetch_excerpts(missing))
 
-        return json.dumps({
-            "total": results.get("size", 0),
-            "results": formatted_results
-        }, indent=2)
+            # Format results for readability
+            formatted_results = []
+            for result in hits:
+                entry = entries.get(result.get("id"), {})
+                formatted_results.append({
+                    "title": result.get("title", "Untitled"),
+                    "url": f"{CONFLUENCE_URL}{result.get('_links', {}).get('webui', '')}",
+                    "excerpt": entry.get("excerpt", ""),
+                    "id": result.get("id"),
+                    "type": result.get("type")
+                })
+
+            return json.dumps({
+                "total": max(total, len(formatted_results)),
+                "results": formatted_results
+            }, indent=2)
 
     except Exception as e:
         return json.dumps({
@@ -96,41 +301,51 @@ def retrieve_confluence_page(page_id: str) -> str:
     Returns:
         str: JSON string with page title, URL, and full content
     """
-    # Load environment variables
-    load_dotenv()
-
-    # Get Confluence credentials
-    confluence_url = os.getenv("CONFLUENCE_URL")
-    confluence_username = os.getenv("CONFLUENCE_USERNAME")
-    confluence_api_token = os.getenv("CONFLUENCE_API_TOKEN")
-
-    if not all([confluence_url, confluence_username, confluence_api_token]):
-        return json.dumps({
-            "error": "Missing Confluence configuration",
-            "status": "error",
-            "message": "Confluence URL, username, or API token not provided"
-        })
+    error = config_error()
+    if error:
+        return error
 
     try:
-        response = httpx.get(
-            f"{confluence_url.rstrip('/')}/rest/api/content/{page_id}",
-            params={"expand": "body.storage,metadata.labels"},
-            auth=(confluence_username, confluence_api_token),
-            timeout=30.0
-        )
+        with tracing.span("confluence.retrieve_page") as page_span:
+            entry = page_cache.get(page_id)
+            page_span.set(cache="fresh" if entry and entry.get("markdown") is not None else "miss")
+            if entry and entry.get("markdown") is not None and not page_cache.is_fresh(entry):
+                # Ask only for the version number; the body is re-downloaded only if the page changed
+                current = confluence_get(f"/rest/api/content/{page_id}", {"expand": "version"})
+                if _page_version(current) == entry["version"]:
+                    page_cache.mark_checked(page_id)
+                    page_span.set(cache="revalidated")
+                else:
+                    entry = None
+                    page_span.set(cache="stale")
 
-        response.raise_for_status()
-        page = response.json()
+            if not entry or entry.get("markdown") is None:
+                page = confluence_get(f"/rest/api/content/{page_id}", {"expand": "body.storage,version"})
+                storage = page.get("body", {}).get("storage", {}).get("value", "")
+                # Markdown without macros and markup, so the agent's prompt only carries the page text.
+                # One character past the limit tells a page that was cut from one that fits exactly.
+                limit = CONFLUENCE_PAGE_MAX_CHARS
+                content = html_to_markdown(storage, max_chars=limit + 1 if limit else None)
+                if limit and len(content) > limit:
+                    content = content[:limit].rstrip() + f"\n\n{TRUNCATION_MARKER}"
+                entry = page_cache.put(
+                    page.get("id", page_id),
+                    _page_version(page),
+                    title=page.get("title", "Untitled"),
+                    url=f"{CONFLUENCE_URL}{page.get('_links', {}).get('webui', '')}",
+                    type=page.get("type"),
+                    markdown=content,
+                    excerpt=html_excerpt(storage)
+                )
 
-        content = page.get("body", {}).get("storage", {}).get("value", "")
-
-        return json.dumps({
-            "title": page.get("title", "Untitled"),
-            "url": f"{confluence_url.rstrip('/')}{page.get('_links', {}).get('webui', '')}",
-            "content": content,
-            "id": page.get("id"),
-            "type": page.get("type")
-        }, indent=2)
+            page_span.set(content_tokens=estimate_tokens(entry["markdown"] or ""))
+            return json.dumps({
+                "title": entry.get("title", "Untitled"),
+                "url": entry.get("url", ""),
+                "content": entry["markdown"],
+                "id": str(page_id),
+                "type": entry.get("type")
+            }, indent=2)
 
     except Exception as e:
         return json.dumps({
@@ -138,15 +353,3 @@ def retrieve_confluence_page(page_id: str) -> str:
             "status": "error",
             "message": f"Failed to retrieve page content: {str(e)}"
         })
-
-
-# Helper function for extracting text from HTML
-def _extract_excerpt(html_content: str, max_length: int = 200) -> str:
-    """Extract a plain text excerpt from HTML content"""
-    import re
-    text = re.sub(r'<[^>]+>', ' ', html_content)
-    text = re.sub(r'\s+', ' ', text).strip()
-
-    if len(text) > max_length:
-        return text[:max_length] + "..."
-    return text
\ No newline at end of file
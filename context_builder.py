@@ -0,0 +1,231 @@
+import hashlib
+import os
+from typing import Any, Optional
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from embedding_writer import estimate_tokens
+from federated_retriever import word_shingles
+from session_memory import truncate_to_tokens
+import tracing
+
+# Prompt budget for retrieved context is CONTEXT_TOKEN_BUDGET when set (0 keeps every merged block).
+# It is read on every call, so a value from .env applies. Unset, the budget holds k chunks of
+# DEFAULT_CHUNK_SIZE characters, as much as the raw top-k chunks used to take.
+DEFAULT_CONTEXT_K = 4
+# The largest chunk_size dataloader.py ships with (EPUB)
+DEFAULT_CHUNK_SIZE = 1500
+# Room for each block's "[n] source, pp. x-y" citation line in the default budget
+CITATION_HEADER_TOKENS = 16
+# Candidates fetched per query are k times this, so the budget is filled with the best distinct text
+CONTEXT_FETCH_FACTOR = int(os.getenv("CONTEXT_FETCH_FACTOR", "2"))
+# Shortest shared text that counts as the splitter's chunk_overlap, and the share of a
+# block's word 3-grams already in the context above which it is dropped as a near-duplicate
+MIN_OVERLAP_CHARS = 20
+DEDUPE_THRESHOLD = 0.8
+# A block that does not fit is cut to the remaining budget only when at least this much is left
+MIN_BLOCK_TOKENS = 64
+
+
+def context_token_budget(k=DEFAULT_CONTEXT_K, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Token budget for the context of k retrieved chunks: CONTEXT_TOKEN_BUDGET, or k chunks' worth."""
+    budget = os.getenv("CONTEXT_TOKEN_BUDGET")
+    if budget:
+        return int(budget)
+    return estimate_tokens("x" * (k * chunk_size)) + k * CITATION_HEADER_TOKENS
+
+
+def join_overlapping(first, second, min_overlap=MIN_OVERLAP_CHARS):
+    """
+    Join two chunks when the end of first repeats the start of second (or one contains the other).
+
+    Returns:
+        str: the joined text, or None if the chunks do not overlap
+    """
+    if second in first:
+        return first
+    if first in second:
+        return second
+
+    head = second[:min_overlap]
+    if len(head) < min_overlap:
+        return None
+    # The overlap is a suffix of first, so only its last len(second) characters can hold it
+    start = first.find(head, max(0, len(first) - len(second)))
+    while start != -1:
+        if second.startswith(first[start:]):
+            return first + second[len(first) - start:]
+        start = first.find(head, start + 1)
+    return None
+
+
+def _source_key(metadata):
+    # Chunks are only merged within one file of one collection
+    return metadata.get("collection"), metadata.get("source")
+
+
+def merge_chunks(docs, min_overlap=MIN_OVERLAP_CHARS):
+    """
+    Merge overlapping chunks of the same source into blocks.
+
+    Neighbouring chunks from the splitter share chunk_overlap characters, so
+    they are joined at the shared text. Each block keeps the rank of its best
+    chunk, the metadata of that chunk, and the pages it spans.
+
+    Returns:
+        list of dicts {"text", "metadata", "rank", "chunks", "pages"}, in rank order
+    """
+    blocks = []
+    for rank, doc in enumerate(docs):
+        page = doc.metadata.get("page")
+        block = {
+            "text": doc.page_content.strip(),
+            "metadata": dict(doc.metadata),
+            "rank": rank,
+            "chunks": 1,
+            "pages": {page} if page is not None else set(),
+        }
+
+        # A new chunk can bridge two blocks, so keep absorbing until nothing else joins
+        merged = True
+        while merged:
+            merged = False
+            for other in blocks:
+                if _source_key(other["metadata"]) != _source_key(doc.metadata):
+                    continue
+                text = (join_overlapping(other["text"], block["text"], min_overlap)
+                        or join_overlapping(block["text"], other["text"], min_overlap))
+                if text is None:
+                    continue
+                blocks.remove(other)
+                block = {
+                    "text": text,
+                    "metadata": other["metadata"] if other["rank"] < block["rank"] else block["metadata"],
+                    "rank": min(other["rank"], block["rank"]),
+                    "chunks": other["chunks"] + block["chunks"],
+                    "pages": other["pages"] | block["pages"],
+                }
+                merged = True
+                break
+        blocks.append(block)
+    return sorted(blocks, key=lambda b: b["rank"])
+
+
+def drop_near_duplicates(blocks, threshold=DEDUPE_THRESHOLD):
+    """Drop blocks whose text is (nearly) contained in a better-ranked block, e.g. the same passage in two files."""
+    kept, seen_hashes, seen_shingles = [], set(), set()
+    for block in blocks:
+        digest = hashlib.sha256(" ".join(block["text"].split()).encode("utf-8")).hexdigest()
+        if digest in seen_hashes:
+            continue
+        shingles = word_shingles(block["text"])
+        if shingles and len(shingles & seen_shingles) / len(shingles) >= threshold:
+            continue
+        seen_hashes.add(digest)
+        seen_shingles |= shingles
+        kept.append(block)
+    return kept
+
+
+def citation_label(metadata, pages=()):
+    """Human-readable source for a citation: the page title or file name, with PDF page numbers."""
+    source = metadata.get("source", "Unknown")
+    label = metadata.get("title") or os.path.basename(str(source).rstrip("/")) or str(source)
+    # PyPDFLoader numbers pages from 0
+    numbers = sorted(page + 1 for page in pages if isinstance(page, int))
+    if len(numbers) == 1:
+        label += f", p. {numbers[0]}"
+    elif numbers:
+        label += f", pp. {numbers[0]}-{numbers[-1]}"
+    if metadata.get("collection"):
+        label = f"{metadata['collection']}: {label}"
+    return label
+
+
+def build_context(docs, token_budget=None, min_overlap=MIN_OVERLAP_CHARS,
+                  dedupe_threshold=DEDUPE_THRESHOLD):
+    """
+    Turn ranked retrieval hits into a compact, cited context.
+
+    Overlapping chunks of one source are merged, near-duplicates dropped, and
+    the blocks packed best-first into token_budget tokens. The block that
+    crosses the budget is cut to fit when enough room is left; the rest are
+    left out.
+
+    Args:
+        docs: retrieved Documents, best first
+        token_budget: maximum estimated tokens for all blocks together (0 for no limit,
+            None for context_token_budget())
+        min_overlap: shortest shared text that joins two chunks
+        dedupe_threshold: share of a block's word 3-grams already used above which it is dropped
+
+    Returns:
+        list of Documents, one per block, whose text starts with "[n] source" and whose
+        metadata holds "citation" (n), "chunks" and the best chunk's metadata
+    """
+    if token_budget is None:
+        token_budget = context_token_budget()
+    blocks = drop_near_duplicates(merge_chunks(docs, min_overlap), dedupe_threshold)
+
+    context, used, citations = [], 0, {}
+    for block in blocks:
+        # Blocks from the same source share one citation number
+        source = _source_key(block["metadata"])
+        number = citations.get(source, len(citations) + 1)
+        header = f"[{number}] {citation_label(block['metadata'], block['pages'])}\n"
+        text = block["text"]
+        tokens = estimate_tokens(header + text)
+        truncated = False
+
+        if token_budget and used + tokens > token_budget:
+            remaining = token_budget - used - estimate_tokens(header)
+            if remaining < MIN_BLOCK_TOKENS:
+                if not context:
+                    # Never return an empty context just because the best block is long
+                    remaining = max(token_budget - estimate_tokens(header), 1)
+                else:
+                    break
+            text = truncate_to_tokens(text, remaining)
+            tokens = estimate_tokens(header + text)
+            truncated = True
+
+        citations[source] = number
+        metadata = {**block["metadata"], "citation": number, "chunks": block["chunks"]}
+        context.append(Document(page_content=header + text, metadata=metadata))
+        used += tokens
+        if truncated:
+            break
+    return context
+
+
+class ContextBuilderRetriever(BaseRetriever):
+    """
+    Wraps a retriever so chains and agents get merged, deduplicated and budgeted context.
+
+    Give the inner retriever a larger k than the prompt needs
+    (k * CONTEXT_FETCH_FACTOR); build_context keeps the best distinct text
+    within token_budget, which defaults to context_token_budget(k, chunk_size)
+    resolved on every query.
+    """
+
+    retriever: Any
+    k: int = DEFAULT_CONTEXT_K
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+    token_budget: Optional[int] = None
+    min_overlap: int = MIN_OVERLAP_CHARS
+    dedupe_threshold: float = DEDUPE_THRESHOLD
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        docs = self.retriever.invoke(query)
+        token_budget = self.token_budget
+        if token_budget is None:
+            token_budget = context_token_budget(self.k, self.chunk_size)
+        with tracing.span("context.build", chunks=len(docs), token_budget=token_budget) as build_span:
+            context = build_context(docs, token_budget, self.min_overlap, self.dedupe_threshold)
+            build_span.set(
+                blocks=len(context),
+                tokens_in=sum(estimate_tokens(doc.page_content) for doc in docs),
+                tokens_out=sum(estimate_tokens(doc.page_content) for doc in context)
+            )
+        return context
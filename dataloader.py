@@ -1,23 +1,43 @@
 import os
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
+import time
+import chromadb
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_community.document_loaders import UnstructuredEPubLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from dotenv import load_dotenv
 
-# Load environment variables from .env file
+# Load environment variables from .env file before the modules below read their settings
 load_dotenv()
 
+from ingest_manifest import Manifest, file_sha256, text_sha256, make_chunk_id
+from ingest_pipeline import ChunkStream, FileJob
+from embedding_writer import EmbeddingWriter, ChromaSink, FakeEmbeddings
+from embedding_cache import get_cached_embeddings
+from answer_cache import invalidate_collection
+from collection_registry import chunk_settings_for
+import bm25_index
+import quantized_index
+
+# Embedding backend: "openai" for real runs, "fake" for a deterministic offline backend
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+
 # Get API key from environment
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
+if EMBEDDING_BACKEND == "openai" and not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY environment variable is not set")
 
 # Base directories and embeddings
 docs_dir = "./docs"
 persist_dir = "./chroma_db"
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+if EMBEDDING_BACKEND == "fake":
+    embeddings = FakeEmbeddings()
+else:
+    embeddings = get_cached_embeddings("text-embedding-3-small")
+
+# Embedding writer settings
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_REQUESTS_PER_MINUTE = int(os.getenv("EMBED_REQUESTS_PER_MINUTE", "3000"))
+EMBED_TOKENS_PER_MINUTE = int(os.getenv("EMBED_TOKENS_PER_MINUTE", "1000000"))
 
 # File type configurations
 FILE_LOADERS = {
@@ -25,50 +45,188 @@ FILE_LOADERS = {
     "epub": UnstructuredEPubLoader
 }
 
-# Process each subdirectory
-for subdir in os.listdir(docs_dir):
-    subdir_path = os.path.join(docs_dir, subdir)
+# Split text based on file type (larger chunks for EPUB)
+CHUNK_SETTINGS = {
+    "pdf": {"chunk_size": 1000, "chunk_overlap": 200},
+    "epub": {"chunk_size": 1500, "chunk_overlap": 250}
+}
+
+# Number of processes used to parse and split files (defaults to all cores)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0")) or os.cpu_count()
+
+
+def file_chunk_settings(file, chunk_settings=CHUNK_SETTINGS):
+    return chunk_settings[file.split('.')[-1].lower()]
+
 
-    # Skip if not a directory
-    if not os.path.isdir(subdir_path):
-        continue
+def make_file_job(file, file_path, chunk_settings=CHUNK_SETTINGS):
+    file_ext = file.split('.')[-1].lower()
+    return FileJob(
+        key=file,
+        path=file_path,
+        loader_cls=FILE_LOADERS[file_ext],
+        **chunk_settings[file_ext]
+    )
 
-    print(f"Processing collection: {subdir}")
-    all_docs = []
 
-    # Process all supported files
-    for file in os.listdir(subdir_path):
+def scan_collection_files(subdir_path, manifest):
+    # Hash every supported file, reusing the manifest hash when size and mtime are unchanged
+    current = {}
+    for file in sorted(os.listdir(subdir_path)):
         file_ext = file.split('.')[-1].lower()
+        file_path = os.path.join(subdir_path, file)
+        if file_ext not in FILE_LOADERS or not os.path.isfile(file_path):
+            continue
 
-        if file_ext in FILE_LOADERS:
-            file_path = os.path.join(subdir_path, file)
-            print(f"  Loading {file_ext.upper()}: {file}")
-
-            # Load document with appropriate loader
-            loader = FILE_LOADERS[file_ext](file_path=file_path)
-            docs = loader.load()
-
-            # Split text based on file type (larger chunks for EPUB)
-            chunk_size = 1500 if file_ext == "epub" else 1000
-            chunk_overlap = 250 if file_ext == "epub" else 200
-
-            splitter = RecursiveCharacterTextSplitter(
-                chunk_size=chunk_size,
-                chunk_overlap=chunk_overlap
-            )
-            split_docs = splitter.split_documents(docs)
-            all_docs.extend(split_docs)
-
-    # Create collection if documents were found
-    if all_docs:
-        Chroma.from_documents(
-            documents=all_docs,
-            embedding=embeddings,
-            persist_directory=persist_dir,
-            collection_name=subdir
-        )
-        print(f"  Created collection '{subdir}' with {len(all_docs)} chunks")
-    else:
+        stat = os.stat(file_path)
+        digest = manifest.cached_hash(file, stat.st_size, stat.st_mtime)
+        current[file] = (digest or file_sha256(file_path), stat.st_size, stat.st_mtime)
+    return current
+
+
+def sync_collection(subdir, subdir_path, persist_dir=persist_dir, embeddings=embeddings,
+                    chunk_settings=CHUNK_SETTINGS):
+    """
+    Bring one Chroma collection in line with the files in its docs subdirectory.
+
+    Only new or changed files are loaded, split and embedded. Chunks of removed
+    or changed files are deleted by the stable IDs recorded in the manifest.
+    Files split with other chunk settings than chunk_settings count as changed.
+    persist_dir, embeddings and chunk_settings default to the module settings;
+    benchmark.py overrides them to build throwaway collections offline.
+
+    Returns:
+        bool: True if the collection was modified
+    """
+    manifest = Manifest.load(persist_dir, subdir)
+    legacy_collection = manifest.legacy_cleanup_pending
+    current = scan_collection_files(subdir_path, manifest)
+    if not current and not manifest.files:
         print(f"  No supported files found in {subdir}")
+        return False
+
+    # Entries from before chunk settings were recorded were split with the built-in settings
+    manifest.assume_chunking({file: file_chunk_settings(file) for file in manifest.files
+                              if file.split('.')[-1].lower() in CHUNK_SETTINGS})
+    chunking = {file: file_chunk_settings(file, chunk_settings) for file in current}
+    added, modified, removed, unchanged = manifest.diff({name: info[0] for name, info in current.items()}, chunking)
+
+    print(f"  {len(added)} new, {len(modified)} changed, {len(removed)} removed, {len(unchanged)} unchanged")
+    if not (added or modified or removed):
+        if legacy_collection:
+            manifest.legacy_cleanup_pending = False
+            manifest.save()
+        print(f"  Collection '{subdir}' is up to date")
+        return False
+
+    client = chromadb.PersistentClient(path=persist_dir)
+    collection = client.get_or_create_collection(name=subdir, embedding_function=None)
+
+    # Drop the chunks of removed and modified files
+    for file in removed + modified:
+        stale_ids = manifest.chunk_ids(file)
+        if stale_ids:
+            collection.delete(ids=stale_ids)
+        manifest.remove(file)
+        print(f"  Deleted {len(stale_ids)} chunks of {file}")
+    manifest.save()
+
+    # Chunk IDs and hashes of files whose chunks are still being embedded
+    in_flight = {}
+
+    def on_file_committed(file):
+        # Record the file only after all its chunks are written, so a crash re-processes it next run
+        chunk_ids, chunk_hashes = in_flight.pop(file)
+        digest, size, mtime = current[file]
+        manifest.record(file, digest, chunk_ids, chunk_hashes, size=size, mtime=mtime, chunking=chunking[file])
+        manifest.save()
+
+    writer = EmbeddingWriter(
+        ChromaSink(collection),
+        embeddings,
+        batch_size=EMBED_BATCH_SIZE,
+        max_concurrency=EMBED_CONCURRENCY,
+        requests_per_minute=EMBED_REQUESTS_PER_MINUTE,
+        tokens_per_minute=EMBED_TOKENS_PER_MINUTE,
+        checkpoint_path=manifest.path + ".writer.log",
+        on_source_committed=on_file_committed
+    )
+
+    # Parse and split changed files in parallel; results arrive as each file finishes
+    started = time.perf_counter()
+    jobs = [make_file_job(file, os.path.join(subdir_path, file), chunk_settings) for file in added + modified]
+    total_chunks = 0
+    with writer:
+        for result in ChunkStream(jobs, max_workers=INGEST_WORKERS):
+            file = result.job.key
+            if result.error:
+                print(f"  Failed to load {file}: {result.error}")
+                continue
+
+            split_docs = result.docs
+            chunk_hashes = [text_sha256(doc.page_content) for doc in split_docs]
+            chunk_ids = [make_chunk_id(subdir, file, i, h) for i, h in enumerate(chunk_hashes)]
+
+            # Collections built before the manifest existed have random chunk IDs, so clear them by source.
+            # The delete also removes chunks a crashed earlier run already wrote, so the writer must not
+            # skip them as checkpointed.
+            if legacy_collection:
+                collection.delete(where={"source": result.job.path})
+                writer.forget(chunk_ids)
+
+            in_flight[file] = (chunk_ids, chunk_hashes)
+            writer.add_source(file, chunk_ids, split_docs)
+            total_chunks += len(split_docs)
+            print(f"  Loaded {file}: {len(split_docs)} chunks "
+                  f"(load {result.load_seconds:.2f}s, split {result.split_seconds:.2f}s)")
+
+    print(f"  Embedded {writer.stats['chunks']} chunks in {writer.stats['batches']} batches "
+          f"({writer.stats['skipped']} resumed from checkpoint, {writer.stats['retries']} rate-limit retries)")
+    print(f"  Updated collection '{subdir}' with {total_chunks} new chunks in {time.perf_counter() - started:.1f}s")
+
+    # Legacy chunks are gone only once every file went through the by-source delete above
+    if legacy_collection and all(file in manifest.files for file in current):
+        manifest.legacy_cleanup_pending = False
+        manifest.save()
+    return True
+
+
+if __name__ == "__main__":
+    # Process each subdirectory
+    for subdir in sorted(os.listdir(docs_dir)):
+        subdir_path = os.path.join(docs_dir, subdir)
+
+        # Skip if not a directory
+        if not os.path.isdir(subdir_path):
+            continue
+
+        print(f"Processing collection: {subdir}")
+        # collections.json can override the splitter settings per collection
+        changed = sync_collection(subdir, subdir_path, chunk_settings=chunk_settings_for(subdir, CHUNK_SETTINGS))
+        if changed:
+            # Cached Slack answers built from the old content are stale now
+            removed_answers = invalidate_collection(subdir)
+            print(f"  Invalidated {removed_answers} cached answers")
+
+        # Rebuild the BM25 index used for hybrid retrieval when the collection changed
+        if changed or not bm25_index.index_exists(persist_dir, subdir):
+            try:
+                collection = chromadb.PersistentClient(path=persist_dir).get_collection(subdir)
+            except Exception:
+                continue
+            indexed = bm25_index.build_index(collection, persist_dir, subdir)
+            print(f"  Built BM25 index over {indexed} chunks")
+
+        # Export the memory-mapped quantized index used by RETRIEVAL_MODE=quantized
+        if quantized_index.export_enabled() and (
+                changed or not quantized_index.index_exists(persist_dir, subdir)):
+            try:
+                collection = chromadb.PersistentClient(path=persist_dir).get_collection(subdir)
+            except Exception:
+                continue
+            exported = quantized_index.build_index(collection, persist_dir, subdir)
+            print(f"  Exported {exported} chunks to the {quantized_index.quantized_dtype()} quantized index")
 
-print("Processing complete.")
\ No newline at end of file
+    if hasattr(embeddings, "stats"):
+        print(f"Embedding cache: {embeddings.stats()}")
+    print("Processing complete.")
@@ -0,0 +1,170 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+import tracing
+from embedding_writer import estimate_tokens
+
+
+# Shared on-disk cache used by dataloader.py, rag_validator.py and slacker.py.
+# EMBEDDING_CACHE_PATH and EMBEDDING_CACHE_MAX_ENTRIES are read when a cache is built, so .env values apply.
+DEFAULT_EMBEDDING_CACHE_PATH = "./cache/embeddings.sqlite3"
+# Size cap in entries; a text-embedding-3-small vector takes about 6 KB
+DEFAULT_EMBEDDING_CACHE_MAX_ENTRIES = 50000
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings object with a persistent cache keyed by (model, sha256(text)).
+
+    Vectors are stored as float32 in SQLite, which lets several processes share
+    the cache. When the cache grows past max_entries the least recently used
+    entries are evicted. hits and misses count cache lookups per text.
+    """
+
+    def __init__(self, underlying, model, path=None, max_entries=None):
+        self.underlying = underlying
+        self.model = model
+        self.path = path or os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_EMBEDDING_CACHE_PATH)
+        if max_entries is None:
+            max_entries = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", str(DEFAULT_EMBEDDING_CACHE_MAX_ENTRIES)))
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        # Opened lazily so building the wrapper never touches the disk
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL, key TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL,"
+                " PRIMARY KEY (model, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _key(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys):
+        found = {}
+        conn = self._connect()
+        unique = list(set(keys))
+        # Stay well under SQLite's bound-parameter limit
+        for start in range(0, len(unique), 500):
+            part = unique[start:start + 500]
+            placeholders = ",".join("?" * len(part))
+            rows = conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE model = ? AND key IN ({placeholders})",
+                [self.model, *part]
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = array("f", blob).tolist()
+
+        if found:
+            now = time.time()
+            conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND key = ?",
+                [(now, self.model, key) for key in found]
+            )
+        return found
+
+    def _store(self, items):
+        conn = self._connect()
+        now = time.time()
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, key, vector, last_used) VALUES (?, ?, ?, ?)",
+            [(self.model, key, array("f", vector).tobytes(), now) for key, vector in items]
+        )
+        self._evict(conn)
+
+    def _evict(self, conn):
+        count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        # Evict down to 90% of the cap so we do not evict on every insert
+        excess = count - int(self.max_entries * 0.9)
+        conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN"
+            " (SELECT rowid FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+            (excess,)
+        )
+
+    def embed_documents(self, texts):
+        with tracing.span("embeddings.documents", texts=len(texts)) as embed_span:
+            vectors, hit_count = self._embed_documents(texts)
+            embed_span.set(cache_hits=hit_count)
+            return vectors
+
+    def _embed_documents(self, texts):
+        keys = [self._key(text) for text in texts]
+        with self._lock:
+            cached = self._lookup(keys)
+            self._conn.commit()
+
+        # Embed each distinct missing text once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        hit_count = sum(1 for key in keys if key in cached)
+        with self._lock:
+            self.hits += hit_count
+            self.misses += len(keys) - hit_count
+
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            with self._lock:
+                self._store(fresh.items())
+                self._conn.commit()
+            cached.update(fresh)
+
+        return [cached[key] for key in keys], hit_count
+
+    def embed_query(self, text):
+        key = self._key(text)
+        with tracing.span("embeddings.query", tokens=estimate_tokens(text)) as embed_span:
+            with self._lock:
+                cached = self._lookup([key])
+                self._conn.commit()
+
+                embed_span.set(cache_hit=key in cached)
+                if key in cached:
+                    self.hits += 1
+                    return cached[key]
+                self.misses += 1
+
+            vector = self.underlying.embed_query(text)
+            with self._lock:
+                self._store([(key, vector)])
+                self._conn.commit()
+            return vector
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def get_cached_embeddings(model="text-embedding-3-small"):
+    """Build the cached OpenAI embeddings object used by the ingestion and query paths."""
+    from langchain_openai import OpenAIEmbeddings
+    return CachedEmbeddings(OpenAIEmbeddings(model=model), model)
@@ -0,0 +1,220 @@
+import hashlib
+import math
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+from rate_limit import TokenBucket, retry_with_backoff, is_rate_limit_error
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic, offline embedding backend.
+
+    Words are hashed into a fixed number of signed buckets and the vector is
+    L2-normalized, so texts sharing words end up close together. Good enough
+    to exercise ingestion and retrieval without calling an API.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self.calls = 0
+
+    def _embed(self, text):
+        vector = [0.0] * self.size
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.size
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        self.calls += 1
+        return self._embed(text)
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text
+    return max(1, len(text) // 4)
+
+
+class ChromaSink:
+    """Writes pre-computed embeddings straight into a chromadb collection, so Chroma does not embed again."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def upsert(self, ids, texts, metadatas, vectors):
+        self.collection.upsert(ids=ids, documents=texts, metadatas=metadatas, embeddings=vectors)
+
+
+class EmbeddingWriter:
+    """
+    Streams chunks into a vector store in fixed-size batches.
+
+    Up to max_concurrency batches are embedded at once, throttled by request and
+    token buckets and retried with backoff on 429s. Each batch is written as soon
+    as it is embedded. At most 2 * max_concurrency batches are buffered, so memory
+    stays flat however big the collection is: add_source() blocks when the writer
+    falls behind.
+
+    Committed chunk IDs are appended to checkpoint_path. After a crash, a new
+    writer with the same checkpoint skips chunks that were already written, so
+    the run resumes from the last committed batch. on_source_committed(key) is
+    called once every chunk of a source has been written.
+    """
+
+    def __init__(self, sink, backend, batch_size=64, max_concurrency=4,
+                 requests_per_minute=None, tokens_per_minute=None,
+                 checkpoint_path=None, max_retries=6, on_source_committed=None):
+        self.sink = sink
+        self.backend = backend
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.checkpoint_path = checkpoint_path
+        self.on_source_committed = on_source_committed
+
+        self.request_bucket = TokenBucket.per_minute(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket.per_minute(tokens_per_minute) if tokens_per_minute else None
+
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embed")
+        self._slots = threading.BoundedSemaphore(max_concurrency * 2)
+        self._lock = threading.Lock()
+        self._checkpoint_lock = threading.Lock()
+        self._buffer = []
+        self._pending = {}
+        self._errors = []
+        self._committed = self._load_checkpoint()
+
+        self.stats = {"batches": 0, "chunks": 0, "skipped": 0, "tokens": 0, "retries": 0}
+
+    def _load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return set()
+        with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+            return {line.strip() for line in f if line.strip()}
+
+    def _append_checkpoint(self, ids):
+        if not self.checkpoint_path:
+            return
+        os.makedirs(os.path.dirname(self.checkpoint_path) or ".", exist_ok=True)
+        with self._checkpoint_lock, open(self.checkpoint_path, "a", encoding="utf-8") as f:
+            f.write("\n".join(ids) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def forget(self, ids):
+        """
+        Treat ids as not written, e.g. after the caller deleted them from the store, so add_source() embeds them again.
+
+        The checkpoint file keeps them until close(); a run that crashes again
+        must call forget() again before re-adding them.
+        """
+        with self._lock:
+            self._committed.difference_update(ids)
+
+    def add_source(self, source_key, ids, docs):
+        """Queue every chunk of one source (file, page, ...) for embedding."""
+        todo = [(chunk_id, doc) for chunk_id, doc in zip(ids, docs) if chunk_id not in self._committed]
+        self.stats["skipped"] += len(ids) - len(todo)
+
+        if not todo:
+            self._source_done(source_key)
+            return
+
+        with self._lock:
+            self._pending[source_key] = len(todo)
+        for chunk_id, doc in todo:
+            self._buffer.append((source_key, chunk_id, doc))
+            if len(self._buffer) >= self.batch_size:
+                self._submit()
+
+    def _submit(self):
+        batch, self._buffer = self._buffer, []
+        # Blocks once enough batches are in flight, which is what keeps memory flat
+        self._slots.acquire()
+        future = self._executor.submit(self._write_batch, batch)
+        future.add_done_callback(lambda _: self._slots.release())
+
+    def _source_done(self, source_key):
+        if self.on_source_committed:
+            with self._lock:
+                self.on_source_committed(source_key)
+
+    def _embed_with_backoff(self, texts):
+        def call():
+            try:
+                return self.backend.embed_documents(texts)
+            except Exception as e:
+                if is_rate_limit_error(e):
+                    with self._lock:
+                        self.stats["retries"] += 1
+                raise
+
+        return retry_with_backoff(call, max_retries=self.max_retries, retry_on=is_rate_limit_error)
+
+    def _write_batch(self, batch):
+        try:
+            ids = [chunk_id for _, chunk_id, _ in batch]
+            texts = [doc.page_content for _, _, doc in batch]
+            metadatas = [doc.metadata or {"source": source_key} for source_key, _, doc in batch]
+            tokens = sum(estimate_tokens(text) for text in texts)
+
+            if self.request_bucket:
+                self.request_bucket.acquire(1)
+            if self.token_bucket:
+                self.token_bucket.acquire(tokens)
+
+            vectors = self._embed_with_backoff(texts)
+            self.sink.upsert(ids, texts, metadatas, vectors)
+            self._append_checkpoint(ids)
+        except Exception as e:
+            with self._lock:
+                self._errors.append(e)
+            return
+
+        finished = []
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["chunks"] += len(batch)
+            self.stats["tokens"] += tokens
+            for source_key, _, _ in batch:
+                self._pending[source_key] -= 1
+                if self._pending[source_key] == 0:
+                    del self._pending[source_key]
+                    finished.append(source_key)
+
+        for source_key in finished:
+            self._source_done(source_key)
+
+    def close(self):
+        """Flush the last partial batch and wait for every write. Raises the first batch error, if any."""
+        if self._buffer:
+            self._submit()
+        self._executor.shutdown(wait=True)
+
+        if self._errors:
+            raise self._errors[0]
+
+        # Everything is committed, the checkpoint is no longer needed
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Keep the checkpoint so the next run can resume
+            self._executor.shutdown(wait=True)
+        return False
@@ -0,0 +1,112 @@
+import hashlib
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import tracing
+
+
+def distance_to_similarity(distance, space):
+    """Map a Chroma distance to a cosine-like similarity so results from different collections compare."""
+    if space == "l2":
+        # Squared L2 between unit vectors is 2 - 2 * cosine
+        return 1.0 - distance / 2.0
+    # "cosine" and "ip" distances are both 1 - similarity
+    return 1.0 - distance
+
+
+def word_shingles(text, size=3):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def is_near_duplicate(shingles, seen, threshold):
+    for other in seen:
+        union = len(shingles | other)
+        if union and len(shingles & other) / union >= threshold:
+            return True
+    return False
+
+
+class FederatedRetriever(BaseRetriever):
+    """
+    Searches several Chroma collections with a single query embedding.
+
+    The query is embedded once, every collection is searched in parallel with
+    that vector, and the hits are merged by similarity. Near-identical chunks
+    (word 3-gram Jaccard >= dedupe_threshold) are dropped, and the global top k
+    come back with "collection" and "score" added to their metadata.
+    """
+
+    client: Any
+    embeddings: Any
+    collections: Optional[List[str]] = None
+    k: int = 4
+    fetch_k: Optional[int] = None
+    max_workers: int = 8
+    dedupe_threshold: float = 0.9
+
+    def _search_collection(self, name, vector, n_results):
+        collection = self.client.get_collection(name)
+        space = (collection.metadata or {}).get("hnsw:space", "l2")
+        with tracing.span("retrieval.dense", collection=name, n_results=n_results):
+            result = collection.query(
+                query_embeddings=[vector],
+                n_results=n_results,
+                include=["documents", "metadatas", "distances"]
+            )
+
+        hits = []
+        for text, metadata, distance in zip(result["documents"][0], result["metadatas"][0], result["distances"][0]):
+            metadata = dict(metadata or {})
+            metadata["collection"] = name
+            metadata["score"] = distance_to_similarity(distance, space)
+            hits.append(Document(page_content=text, metadata=metadata))
+        return hits
+
+    def search(self, query, collections=None, k=None):
+        k = k or self.k
+        # Chroma 0.6 lists names, older versions Collection objects
+        names = collections or self.collections or [getattr(collection, "name", collection)
+                                                    for collection in self.client.list_collections()]
+        if not names:
+            return []
+
+        with tracing.span("retrieval.federated", collections=len(names), k=k):
+            vector = self.embeddings.embed_query(query)
+            n_results = self.fetch_k or k
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(names))) as executor:
+                # Each search runs in a copy of this context so its span nests under this one
+                futures = [tracing.submit_in_context(executor, self._search_collection, name, vector, n_results)
+                           for name in names]
+                per_collection = [future.result() for future in futures]
+
+        merged = sorted(
+            (doc for hits in per_collection for doc in hits),
+            key=lambda doc: doc.metadata["score"],
+            reverse=True
+        )
+
+        results, seen_hashes, seen_shingles = [], set(), []
+        for doc in merged:
+            digest = hashlib.sha256(" ".join(doc.page_content.split()).encode("utf-8")).hexdigest()
+            if digest in seen_hashes:
+                continue
+            shingles = word_shingles(doc.page_content)
+            if is_near_duplicate(shingles, seen_shingles, self.dedupe_threshold):
+                continue
+
+            seen_hashes.add(digest)
+            seen_shingles.append(shingles)
+            results.append(doc)
+            if len(results) == k:
+                break
+        return results
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.search(query)
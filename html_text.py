@@ -0,0 +1,222 @@
+import re
+from html.parser import HTMLParser
+
+
+# Elements whose content never reaches the text: scripts, macro parameters, attachments, emoticons
+# and the IDs and statuses of task list items
+SKIP_TAGS = {
+    "script", "style", "head", "title", "ac:parameter", "ac:placeholder", "ac:image", "ac:emoticon",
+    "ri:attachment", "ri:page", "ri:user", "ri:url", "ri:space", "ri:content-entity",
+    "ac:task-id", "ac:task-status",
+}
+BLOCK_TAGS = {"p", "div", "section", "article", "header", "footer", "blockquote", "dl", "dt", "dd",
+              "table", "ac:rich-text-body"}
+# HTML elements that never have an end tag, so they must not open a skipped element
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source",
+             "track", "wbr"}
+HEADINGS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+
+# Input is parsed in slices of this size, so a converter with max_chars stops without reading the rest
+FEED_SIZE = 8192
+
+
+class _Enough(Exception):
+    pass
+
+
+class _MarkdownParser(HTMLParser):
+    """
+    Turns HTML or Confluence storage-format XHTML into compact markdown (or plain text).
+
+    Headings, lists, tables and code blocks keep their structure; links keep
+    their text; Confluence macros are unwrapped: their rich-text and
+    plain-text bodies are kept, their parameters dropped.
+    """
+
+    def __init__(self, markdown=True, max_chars=None):
+        super().__init__(convert_charrefs=True)
+        self.markdown = markdown
+        self.max_chars = max_chars
+        self.parts = []
+        self.length = 0
+        self.skip = 0
+        self.pre = 0
+        self.lists = []
+        self.row = None
+        self.cell = None
+        self.row_is_header = False
+        self.table_rows = 0
+        self.breaks = 0
+        self.line_start = True
+
+    # Output helpers
+
+    def _break(self, count=1):
+        # Ask for line breaks before the next text; never more than a blank line. Table cells stay on one line.
+        if self.cell is not None:
+            self.cell.append(" ")
+        elif self.parts:
+            self.breaks = max(self.breaks, min(count, 2))
+
+    def _write(self, text, counts=True):
+        if self.cell is not None:
+            self.cell.append(text)
+            return
+        if self.breaks:
+            self.parts.append("\n" * self.breaks)
+            self.breaks = 0
+            self.line_start = True
+        self.parts.append(text)
+        self.line_start = text.endswith("\n")
+        if counts:
+            self.length += len(text)
+            if self.max_chars is not None and self.length >= self.max_chars:
+                raise _Enough()
+
+    def _marker(self, text):
+        # Markdown syntax is left out of the plain-text output and of the max_chars count
+        if self.markdown:
+            self._write(text, counts=False)
+
+    # Parser callbacks
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            self.handle_startendtag(tag, attrs)
+            return
+        if self.skip or tag in SKIP_TAGS:
+            self.skip += 1
+            return
+
+        if tag in HEADINGS:
+            self._break(2)
+            self._marker("#" * HEADINGS[tag] + " ")
+        elif tag in BLOCK_TAGS:
+            self._break(2 if tag in ("p", "table", "blockquote") else 1)
+            if tag == "blockquote":
+                self._marker("> ")
+        elif tag in ("ul", "ol", "ac:task-list"):
+            self.lists.append([tag, 0])
+            self._break(1)
+        elif tag in ("li", "ac:task"):
+            self._break(1)
+            if self.lists:
+                kind, count = self.lists[-1]
+                self.lists[-1][1] = count + 1
+                indent = "  " * (len(self.lists) - 1)
+                self._marker(indent + (f"{count + 1}. " if kind == "ol" else "- "))
+            else:
+                self._marker("- ")
+        elif tag in ("pre", "ac:plain-text-body"):
+            self._break(1)
+            self._marker("```\n")
+            self.pre += 1
+        elif tag == "code" and not self.pre:
+            self._marker("`")
+        elif tag == "tr":
+            self.row = []
+            self.row_is_header = False
+        elif tag in ("td", "th") and self.row is not None:
+            self.cell = []
+            self.row_is_header = self.row_is_header or tag == "th"
+
+    def handle_startendtag(self, tag, attrs):
+        if tag == "br" and not self.skip:
+            self._break(1)
+        elif tag == "hr" and not self.skip:
+            self._break(2)
+
+    def handle_endtag(self, tag):
+        if tag in VOID_TAGS:
+            return
+        if self.skip:
+            self.skip -= 1
+            return
+
+        if tag in HEADINGS or tag in BLOCK_TAGS:
+            self._break(2 if tag in HEADINGS or tag in ("p", "table", "blockquote") else 1)
+            if tag == "table":
+                self.table_rows = 0
+        elif tag in ("ul", "ol", "ac:task-list"):
+            if self.lists:
+                self.lists.pop()
+            self._break(1)
+        elif tag in ("pre", "ac:plain-text-body"):
+            self.pre = max(0, self.pre - 1)
+            if not self.line_start:
+                self._write("\n", counts=False)
+            self._marker("```")
+            self._break(1)
+        elif tag == "code" and not self.pre:
+            self._marker("`")
+        elif tag in ("td", "th") and self.cell is not None:
+            cell, self.cell = self.cell, None
+            self.row.append(" ".join("".join(cell).split()))
+        elif tag == "tr" and self.row is not None:
+            self._end_row()
+
+    def _end_row(self):
+        row, self.row = self.row, None
+        if not any(row):
+            return
+        self._break(1)
+        if self.markdown:
+            self._write("| " + " | ".join(row) + " |")
+            if self.row_is_header and self.table_rows == 0:
+                self._write("\n|" + "---|" * len(row), counts=False)
+        else:
+            self._write(" ".join(row))
+        self.table_rows += 1
+
+    def handle_data(self, data):
+        if self.skip or not data:
+            return
+        if self.pre:
+            self._write(data)
+            return
+
+        text = re.sub(r"\s+", " ", data)
+        if (self.line_start or self.breaks) and self.cell is None:
+            text = text.lstrip()
+        if text:
+            self._write(text)
+
+    def unknown_decl(self, data):
+        # Confluence wraps code and link bodies in CDATA sections
+        if data.startswith("CDATA["):
+            self.handle_data(data[6:])
+
+    def text(self):
+        text = "".join(self.parts)
+        text = re.sub(r"[ \t]+\n", "\n", text)
+        return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+def html_to_markdown(html, max_chars=None, markdown=True):
+    """
+    Convert HTML or Confluence storage-format XHTML to compact markdown.
+
+    Args:
+        html: the markup to convert
+        max_chars: stop parsing once this much text has been produced
+        markdown: False drops the markdown syntax and returns plain text
+
+    Returns:
+        str: the converted text
+    """
+    parser = _MarkdownParser(markdown=markdown, max_chars=max_chars)
+    try:
+        for start in range(0, len(html or ""), FEED_SIZE):
+            parser.feed(html[start:start + FEED_SIZE])
+        parser.close()
+    except _Enough:
+        pass
+    return parser.text()
+
+
+def html_excerpt(html, max_length=200):
+    """Plain-text excerpt of at most max_length characters (plus "..."), parsing only as much HTML as needed."""
+    text = " ".join(html_to_markdown(html, max_chars=max_length + 1, markdown=False).split())
+    if len(text) > max_length:
+        return text[:max_length] + "..."
+    return text
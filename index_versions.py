@@ -0,0 +1,90 @@
+import os
+import shutil
+import time
+import uuid
+
+# Names the live version directory of an index; replaced atomically on publish
+POINTER_FILENAME = "CURRENT"
+# Published versions kept on disk: the live one plus the previous, for readers still opening it
+KEEP_VERSIONS = 2
+# Unfinished builds older than this were abandoned by a crash
+STALE_BUILD_SECONDS = 3600
+
+
+def current_dir(root):
+    """
+    Directory of the live version of the index at root, or None if it was never built.
+
+    Indexes built before versioning have their files directly in root.
+    """
+    pointer = os.path.join(root, POINTER_FILENAME)
+    try:
+        with open(pointer, "r", encoding="utf-8") as f:
+            return os.path.join(root, f.read().strip())
+    except FileNotFoundError:
+        pass
+    if os.path.exists(os.path.join(root, "meta.json")):
+        return root
+    return None
+
+
+def generation(root):
+    """
+    Changes whenever a new version is published, so readers can tell their copy is stale.
+
+    Returns:
+        str, or None when the index does not exist
+    """
+    path = current_dir(root)
+    if path is None:
+        return None
+    if path == root:
+        # Unversioned index: its meta.json modification time stands in for a version
+        return str(os.stat(os.path.join(root, "meta.json")).st_mtime_ns)
+    return os.path.basename(path)
+
+
+def new_version_dir(root):
+    """Create an empty directory to build the next version in; pass it to publish() when complete."""
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, f"v{time.time_ns()}-{uuid.uuid4().hex[:8]}.tmp")
+    os.makedirs(path)
+    return path
+
+
+def publish(root, build_path):
+    """
+    Make a fully written version directory the live one.
+
+    The pointer file is swapped with os.replace, so readers see either the old
+    or the new version and the index never disappears. Older versions beyond
+    KEEP_VERSIONS are removed; processes that memory-mapped them keep their
+    mappings until they reload.
+
+    Returns:
+        str: the new version's directory
+    """
+    version = os.path.basename(build_path)[:-len(".tmp")]
+    path = os.path.join(root, version)
+    os.replace(build_path, path)
+
+    tmp_pointer = os.path.join(root, POINTER_FILENAME + ".tmp")
+    with open(tmp_pointer, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_pointer, os.path.join(root, POINTER_FILENAME))
+
+    # Versions are named by creation time, so sorting puts the newest last
+    versions = sorted(name for name in os.listdir(root)
+                      if name.startswith("v") and not name.endswith(".tmp") and os.path.isdir(os.path.join(root, name)))
+    for name in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    # Files of an unversioned index from before, and builds abandoned by a crash
+    for name in os.listdir(root):
+        entry = os.path.join(root, name)
+        if name == POINTER_FILENAME:
+            continue
+        if not os.path.isdir(entry):
+            os.remove(entry)
+        elif name.endswith(".tmp") and time.time() - os.path.getmtime(entry) > STALE_BUILD_SECONDS:
+            shutil.rmtree(entry, ignore_errors=True)
+    return path
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+
+
+# Manifests live next to the Chroma data, one JSON file per collection
+MANIFEST_DIRNAME = "manifests"
+
+
+def file_sha256(path, block_size=1 << 20):
+    """Return the hex sha256 of a file's bytes, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_sha256(text):
+    """Return the hex sha256 of a chunk of text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_chunk_id(collection, source_key, index, chunk_hash):
+    """
+    Build a stable Chroma ID for a chunk.
+
+    The same chunk text at the same position of the same source always gets
+    the same ID, so re-ingesting a file overwrites instead of duplicating, and
+    the IDs recorded in the manifest can be used to delete stale chunks.
+    """
+    raw = f"{collection}\0{source_key}\0{index}\0{chunk_hash}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+class Manifest:
+    """
+    Per-collection record of which sources were ingested and which chunks they produced.
+
+    Layout of the JSON file:
+        {"collection": name,
+         "files": {source_key: {"sha256": ..., "size": ..., "mtime": ...,
+                                "chunk_ids": [...], "chunk_hashes": [...],
+                                "chunking": {"chunk_size": ..., "chunk_overlap": ...}}},
+         "legacy_cleanup_pending": true}  (only while set)
+    """
+
+    def __init__(self, path, collection, files=None, exists=False, legacy_cleanup_pending=None):
+        self.path = path
+        self.collection = collection
+        self.files = files or {}
+        # False when no manifest was found, e.g. a collection built by an older dataloader
+        self.exists = exists
+        # Chunks written before the manifest existed have random IDs and are cleared by source.
+        # This stays set (and saved) until one sync has recorded every file, so a crash
+        # half-way through the first sync does not leave legacy chunks behind.
+        self.legacy_cleanup_pending = (not exists) if legacy_cleanup_pending is None else legacy_cleanup_pending
+
+    @classmethod
+    def load(cls, persist_dir, collection):
+        path = os.path.join(persist_dir, MANIFEST_DIRNAME, f"{collection}.json")
+        if not os.path.exists(path):
+            return cls(path, collection)
+
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(path, collection, files=data.get("files", {}), exists=True,
+                   legacy_cleanup_pending=data.get("legacy_cleanup_pending", False))
+
+    def save(self):
+        # Write to a temp file and rename so a crash never leaves a half-written manifest
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        data = {"collection": self.collection, "files": self.files}
+        if self.legacy_cleanup_pending:
+            data["legacy_cleanup_pending"] = True
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp_path, self.path)
+        self.exists = True
+
+    def cached_hash(self, source_key, size, mtime):
+        """Return the recorded hash if size and mtime are unchanged, so unchanged files are not re-read."""
+        entry = self.files.get(source_key)
+        if entry and entry.get("size") == size and entry.get("mtime") == mtime:
+            return entry.get("sha256")
+        return None
+
+    def diff(self, current, chunking=None):
+        """
+        Compare current {source_key: sha256} against the manifest.
+
+        Args:
+            current: {source_key: sha256} of the sources as they are now
+            chunking: optional {source_key: splitter settings}; a source whose recorded
+                settings differ counts as modified, so it is split again
+
+        Returns:
+            tuple: (added, modified, removed, unchanged) lists of source keys
+        """
+        added, modified, unchanged = [], [], []
+        for key, digest in sorted(current.items()):
+            entry = self.files.get(key)
+            if entry is None:
+                added.append(key)
+            elif entry.get("sha256") != digest or (chunking and entry.get("chunking") != chunking.get(key)):
+                modified.append(key)
+            else:
+                unchanged.append(key)
+
+        removed = sorted(key for key in self.files if key not in current)
+        return added, modified, removed, unchanged
+
+    def chunk_ids(self, source_key):
+        return list(self.files.get(source_key, {}).get("chunk_ids", []))
+
+    def assume_chunking(self, chunking):
+        """
+        Record {source_key: splitter settings} on entries written before the settings were recorded.
+
+        Those sources were split with the loader's built-in settings, so passing them here
+        keeps an upgrade from re-embedding everything while a later override still applies.
+        """
+        for key, entry in self.files.items():
+            if "chunking" not in entry and key in chunking:
+                entry["chunking"] = dict(chunking[key])
+
+    def record(self, source_key, digest, chunk_ids, chunk_hashes, size=None, mtime=None, chunking=None):
+        self.files[source_key] = {
+            "sha256": digest,
+            "size": size,
+            "mtime": mtime,
+            "chunk_ids": list(chunk_ids),
+            "chunk_hashes": list(chunk_hashes),
+        }
+        if chunking is not None:
+            self.files[source_key]["chunking"] = dict(chunking)
+
+    def remove(self, source_key):
+        self.files.pop(source_key, None)
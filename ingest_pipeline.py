@@ -0,0 +1,114 @@
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+
+# One file to parse and split. loader_cls is an entry of the dataloader FILE_LOADERS registry.
+FileJob = namedtuple("FileJob", ["key", "path", "loader_cls", "chunk_size", "chunk_overlap"])
+
+# Chunks produced from one file, with how long loading and splitting took in the worker
+FileResult = namedtuple("FileResult", ["job", "docs", "load_seconds", "split_seconds", "error"])
+
+
+def load_and_split_file(job):
+    """Load and split one file. Runs inside a worker process, so it must stay importable and picklable."""
+    start = time.perf_counter()
+    try:
+        docs = job.loader_cls(file_path=job.path).load()
+        loaded = time.perf_counter()
+
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=job.chunk_size,
+            chunk_overlap=job.chunk_overlap
+        )
+        split_docs = splitter.split_documents(docs)
+        return FileResult(job, split_docs, loaded - start, time.perf_counter() - loaded, None)
+
+    except Exception as e:
+        return FileResult(job, [], time.perf_counter() - start, 0.0, f"{type(e).__name__}: {e}")
+
+
+class ChunkStream:
+    """
+    Parse and split files across a process pool and stream the results through a bounded queue.
+
+    Iterating yields one FileResult per file in completion order. A producer thread
+    keeps at most max_workers files in flight and blocks when queue_size results are
+    waiting, so a slow consumer (the embedding stage) holds back parsing instead of
+    letting chunks pile up in memory.
+    """
+
+    _DONE = object()
+
+    def __init__(self, jobs, max_workers=None, queue_size=8):
+        self.jobs = list(jobs)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+
+    def _put(self, item):
+        # Retry so the producer notices when the consumer went away
+        while not self._stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce_inline(self):
+        for job in self.jobs:
+            if not self._put(load_and_split_file(job)):
+                return
+
+    def _produce_pool(self):
+        jobs = iter(self.jobs)
+        pending = set()
+        with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+            while True:
+                while len(pending) < self.max_workers:
+                    job = next(jobs, None)
+                    if job is None:
+                        break
+                    pending.add(pool.submit(load_and_split_file, job))
+
+                if not pending:
+                    break
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if not self._put(future.result()):
+                        for future in pending:
+                            future.cancel()
+                        return
+
+    def _produce(self):
+        try:
+            if self.max_workers <= 1 or len(self.jobs) <= 1:
+                self._produce_inline()
+            else:
+                self._produce_pool()
+        except Exception as e:
+            self._put(e)
+        finally:
+            self._put(self._DONE)
+
+    def __iter__(self):
+        producer = threading.Thread(target=self._produce, name="ingest-producer", daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is self._DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self._stop.set()
+            producer.join()
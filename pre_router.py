@@ -0,0 +1,104 @@
+import logging
+import threading
+from collections import Counter, deque
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class PreRouter:
+    """
+    Routes a query to an agent locally, by cosine similarity to per-agent centroids.
+
+    Every centroid is the mean of a handful of sample queries, knowledge base
+    agents included: document chunks and questions score differently against
+    a query, so centroids built from both kinds could not share one threshold.
+    A query is routed only when its best match is at least min_similarity and
+    beats the runner-up by min_margin; otherwise route() returns None and the
+    caller falls back to the LLM router.
+
+    Centroids are built on the first route() call. metrics() reports how many
+    queries were routed directly (per agent) and how many fell through.
+    """
+
+    def __init__(self, embeddings, min_similarity=0.35, min_margin=0.08):
+        self.embeddings = embeddings
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self._sample_sources = {}
+        self._names = []
+        self._matrix = None
+        self._lock = threading.Lock()
+        self._direct = Counter()
+        self._fallback = 0
+        self._margins = deque(maxlen=1000)
+
+    def add_samples(self, agent_name, sample_queries):
+        """Register an agent described by example queries."""
+        with self._lock:
+            self._sample_sources[agent_name] = list(sample_queries)
+            # Rebuilt on the next route() with the new agent
+            self._matrix = None
+
+    def _build(self):
+        names, centroids = [], []
+        for agent_name, samples in self._sample_sources.items():
+            if samples:
+                vectors = self.embeddings.embed_documents(samples)
+                names.append(agent_name)
+                # Average unit vectors so long and short queries weigh the same
+                centroids.append(_unit(np.mean([_unit(v) for v in vectors], axis=0)))
+
+        self._names = names
+        self._matrix = np.vstack(centroids) if centroids else np.zeros((0, 1), dtype=np.float32)
+        logger.info(f"Pre-router ready with {len(names)} agent centroids")
+
+    def scores(self, query):
+        with self._lock:
+            if self._matrix is None:
+                self._build()
+            names, matrix = self._names, self._matrix
+        if not names:
+            return {}
+        similarities = matrix @ _unit(self.embeddings.embed_query(query))
+        return dict(zip(names, (float(s) for s in similarities)))
+
+    def route(self, query):
+        """
+        Returns:
+            str: the agent to dispatch to, or None when the LLM router should decide
+        """
+        ranked = sorted(self.scores(query).items(), key=lambda item: item[1], reverse=True)
+        best_name, best = ranked[0] if ranked else (None, 0.0)
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        margin = best - runner_up
+
+        with self._lock:
+            if best_name and best >= self.min_similarity and margin >= self.min_margin:
+                self._direct[best_name] += 1
+                self._margins.append(margin)
+                decision = best_name
+            else:
+                self._fallback += 1
+                decision = None
+
+        logger.info(f"Pre-router: best={best_name} ({best:.3f}), margin={margin:.3f} -> {decision or 'LLM router'}")
+        return decision
+
+    def metrics(self):
+        with self._lock:
+            direct = sum(self._direct.values())
+            total = direct + self._fallback
+            return {
+                "direct": dict(self._direct),
+                "fallback": self._fallback,
+                "direct_rate": direct / total if total else 0.0,
+                "mean_margin": float(np.mean(self._margins)) if self._margins else None,
+            }
@@ -0,0 +1,295 @@
+import argparse
+import json
+import os
+from typing import Any, List
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import index_versions
+import tracing
+
+# Exports live next to the Chroma data, one directory per collection
+QUANTIZED_DIRNAME = "quantized"
+
+# QUANTIZED_DTYPE is "int8" (one byte per dimension, a per-row scale) or "float16"
+DEFAULT_QUANTIZED_DTYPE = "int8"
+
+# Candidates per result re-scored with the float32 vectors
+RESCORE_FACTOR = 4
+# Rows scored per step, bounding the float32 copy of the quantized block
+BLOCK_ROWS = 65536
+
+_QUANTIZED_FILES = {"int8": ("vectors.i8", np.int8), "float16": ("vectors.f16", np.float16)}
+
+
+def quantized_dtype():
+    return os.getenv("QUANTIZED_DTYPE", DEFAULT_QUANTIZED_DTYPE)
+
+
+def export_enabled():
+    """
+    Loaders export collections when QUANTIZED_INDEX_ENABLED is on, or when the bot retrieves from the exports.
+
+    Read on every call rather than at import, so values from .env apply.
+    """
+    return (os.getenv("QUANTIZED_INDEX_ENABLED", "false").lower() == "true"
+            or os.getenv("RETRIEVAL_MODE", "hybrid") == "quantized")
+
+
+def index_dir(persist_dir, collection_name):
+    # Holds one directory per exported version and the CURRENT pointer (see index_versions)
+    return os.path.join(persist_dir, QUANTIZED_DIRNAME, collection_name)
+
+
+def index_exists(persist_dir, collection_name):
+    return index_versions.current_dir(index_dir(persist_dir, collection_name)) is not None
+
+
+def index_generation(persist_dir, collection_name):
+    """Changes every time the collection is exported again; None when there is no export."""
+    return index_versions.generation(index_dir(persist_dir, collection_name))
+
+
+def iter_collection_records(collection, page_size=1000):
+    """Yield (id, embedding, text, metadata) for every chunk of a chromadb collection, one page at a time."""
+    offset = 0
+    while True:
+        page = collection.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+        if not len(page["ids"]):
+            return
+        yield from zip(page["ids"], page["embeddings"], page["documents"], page["metadatas"])
+        offset += len(page["ids"])
+
+
+def quantize(rows, dtype):
+    """
+    Quantize unit-length float32 rows.
+
+    Returns:
+        tuple: (quantized rows, per-row scales; None for float16)
+    """
+    if dtype == "float16":
+        return rows.astype(np.float16), None
+    # Symmetric per-row int8: row ~= quantized * scale
+    scales = np.abs(rows).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return np.round(rows / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def build_index(collection, persist_dir, collection_name, dtype=None, page_size=1000):
+    """
+    Export a collection's embeddings, texts and metadata into flat files for QuantizedIndex.
+
+    Vectors are normalized, so dot products are cosine similarities. The
+    quantized matrix is what every query scans; the float32 copy is only read
+    for the few candidate rows being re-scored. Texts and metadata are one
+    JSON line per chunk with byte offsets, so a hit reads just its own line.
+
+    The export is written into a new version directory and published with
+    index_versions, so readers never see a half-written or missing export.
+
+    Args:
+        dtype: "int8" or "float16" (QUANTIZED_DTYPE by default)
+
+    Returns:
+        int: number of chunks exported
+    """
+    dtype = dtype or quantized_dtype()
+    if dtype not in _QUANTIZED_FILES:
+        raise ValueError(f"Unsupported quantized dtype: {dtype}")
+
+    root = index_dir(persist_dir, collection_name)
+    tmp = index_versions.new_version_dir(root)
+
+    quantized_name = _QUANTIZED_FILES[dtype][0]
+    doc_ids, offsets, dim = [], [0], None
+    with open(os.path.join(tmp, "vectors.f32"), "wb") as vectors_file, \
+            open(os.path.join(tmp, quantized_name), "wb") as quantized_file, \
+            open(os.path.join(tmp, "scales.f32"), "wb") as scales_file, \
+            open(os.path.join(tmp, "chunks.jsonl"), "wb") as chunks_file:
+        batch = []
+
+        def flush():
+            rows = np.asarray([embedding for _, embedding, _, _ in batch], dtype=np.float32)
+            norms = np.linalg.norm(rows, axis=1)
+            norms[norms == 0] = 1.0
+            rows /= norms[:, None]
+            quantized, scales = quantize(rows, dtype)
+            rows.tofile(vectors_file)
+            quantized.tofile(quantized_file)
+            if scales is not None:
+                scales.tofile(scales_file)
+            for chunk_id, _, text, metadata in batch:
+                line = json.dumps({"text": text or "", "metadata": metadata or {}}).encode("utf-8") + b"\n"
+                chunks_file.write(line)
+                offsets.append(offsets[-1] + len(line))
+                doc_ids.append(chunk_id)
+            batch.clear()
+
+        for record in iter_collection_records(collection, page_size):
+            dim = dim or len(record[1])
+            batch.append(record)
+            if len(batch) >= page_size:
+                flush()
+        if batch:
+            flush()
+
+    np.asarray(offsets, dtype=np.uint64).tofile(os.path.join(tmp, "offsets.u64"))
+    with open(os.path.join(tmp, "doc_ids.json"), "w", encoding="utf-8") as f:
+        json.dump(doc_ids, f)
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"count": len(doc_ids), "dim": dim or 0, "dtype": dtype}, f)
+
+    index_versions.publish(root, tmp)
+    return len(doc_ids)
+
+
+def _memmap(path, dtype, shape=None):
+    # np.memmap refuses empty files, and an empty collection gives empty arrays
+    if os.path.getsize(path) == 0:
+        return np.zeros(shape or 0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+class QuantizedIndex:
+    """
+    Read-only cosine index over a memory-mapped int8 or float16 matrix.
+
+    Opening it maps the files and reads only meta.json and the ID list, so it
+    loads in milliseconds, and every bot process that opens the same export
+    shares one copy of it through the OS page cache.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(path, "doc_ids.json"), "r", encoding="utf-8") as f:
+            self.doc_ids = json.load(f)
+
+        self.count = meta["count"]
+        self.dim = meta["dim"]
+        self.dtype = meta["dtype"]
+        quantized_name, quantized_dtype = _QUANTIZED_FILES[self.dtype]
+        shape = (self.count, self.dim)
+        self.quantized = _memmap(os.path.join(path, quantized_name), quantized_dtype, shape)
+        self.vectors = _memmap(os.path.join(path, "vectors.f32"), np.float32, shape)
+        self.scales = _memmap(os.path.join(path, "scales.f32"), np.float32) if self.dtype == "int8" else None
+        self.offsets = _memmap(os.path.join(path, "offsets.u64"), np.uint64)
+        self.chunks = _memmap(os.path.join(path, "chunks.jsonl"), np.uint8)
+
+    @classmethod
+    def load(cls, persist_dir, collection_name):
+        return cls(index_versions.current_dir(index_dir(persist_dir, collection_name)))
+
+    def search(self, vectors, k=4, rescore_factor=RESCORE_FACTOR):
+        """
+        Top k rows for each query vector.
+
+        All queries are scored together against the quantized matrix, block by
+        block; the best k * rescore_factor candidates of each query are then
+        re-scored exactly with the float32 vectors.
+
+        Args:
+            vectors: one query embedding or a list of them
+
+        Returns:
+            list (one per query) of lists of (row, cosine similarity), best first
+        """
+        queries = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1)
+        norms[norms == 0] = 1.0
+        queries = queries / norms[:, None]
+        if self.count == 0:
+            return [[] for _ in queries]
+
+        fetch = min(self.count, max(k, k * rescore_factor))
+        candidate_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        candidate_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, self.count, BLOCK_ROWS):
+            block = np.asarray(self.quantized[start:start + BLOCK_ROWS], dtype=np.float32)
+            scores = queries @ block.T
+            if self.scales is not None:
+                scores *= self.scales[start:start + len(block)]
+
+            # Keep the running best candidates of every query
+            rows = np.broadcast_to(np.arange(start, start + len(block)), scores.shape)
+            candidate_rows = np.concatenate([candidate_rows, rows], axis=1)
+            candidate_scores = np.concatenate([candidate_scores, scores], axis=1)
+            if candidate_scores.shape[1] > fetch:
+                keep = np.argpartition(-candidate_scores, fetch - 1, axis=1)[:, :fetch]
+                candidate_rows = np.take_along_axis(candidate_rows, keep, axis=1)
+                candidate_scores = np.take_along_axis(candidate_scores, keep, axis=1)
+
+        results = []
+        for query, rows in zip(queries, candidate_rows):
+            # Sorted rows read the float32 file front to back
+            rows = np.sort(rows)
+            exact = np.asarray(self.vectors[rows]) @ query
+            order = np.argsort(-exact)[:k]
+            results.append([(int(rows[i]), float(exact[i])) for i in order])
+        return results
+
+    def chunk(self, row):
+        """
+        Returns:
+            tuple: (chunk_id, text, metadata) of one row
+        """
+        line = bytes(self.chunks[int(self.offsets[row]):int(self.offsets[row + 1])])
+        record = json.loads(line.decode("utf-8"))
+        return self.doc_ids[row], record["text"], record["metadata"]
+
+
+class QuantizedRetriever(BaseRetriever):
+    """
+    Dense retrieval from a QuantizedIndex instead of Chroma.
+
+    Hits carry their cosine similarity as "score" in the metadata.
+    search_many() answers several questions with one pass over the matrix.
+    """
+
+    index: Any
+    embeddings: Any
+    k: int = 4
+    rescore_factor: int = RESCORE_FACTOR
+
+    def _to_documents(self, hits):
+        docs = []
+        for row, score in hits:
+            _, text, metadata = self.index.chunk(row)
+            metadata = dict(metadata)
+            metadata["score"] = score
+            docs.append(Document(page_content=text, metadata=metadata))
+        return docs
+
+    def search_many(self, queries: List[str], k=None):
+        """
+        Returns:
+            list of Document lists, one per query
+        """
+        k = k or self.k
+        vectors = [self.embeddings.embed_query(query) for query in queries]
+        with tracing.span("retrieval.quantized", queries=len(queries), n_results=k, rows=self.index.count):
+            results = self.index.search(vectors, k=k, rescore_factor=self.rescore_factor)
+        return [self._to_documents(hits) for hits in results]
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.search_many([query])[0]
+
+
+if __name__ == "__main__":
+    import chromadb
+
+    parser = argparse.ArgumentParser(description="Export Chroma collections into memory-mapped quantized indexes")
+    parser.add_argument("collections", nargs="*", help="collections to export (all by default)")
+    parser.add_argument("--persist-dir", default="./chroma_db")
+    parser.add_argument("--dtype", default=None, choices=sorted(_QUANTIZED_FILES),
+                        help="defaults to QUANTIZED_DTYPE")
+    args = parser.parse_args()
+
+    client = chromadb.PersistentClient(path=args.persist_dir)
+    names = args.collections or sorted(getattr(c, "name", c) for c in client.list_collections())
+    for name in names:
+        exported = build_index(client.get_collection(name), args.persist_dir, name, dtype=args.dtype)
+        print(f"Exported {exported} chunks of '{name}' as {args.dtype or quantized_dtype()}")
@@ -1,21 +1,38 @@
 import os
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from langchain_openai import ChatOpenAI
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
 from dotenv import load_dotenv
 
-# Load environment variables
+# Load environment variables before the modules below read their settings
 load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-# Initialize embeddings and LLM
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+from registry import ResourceRegistry
+from context_builder import ContextBuilderRetriever, CONTEXT_FETCH_FACTOR
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 # Base directory
 persist_dir = "./chroma_db"
 
+# Fan-out settings for query_all_collections
+QUERY_CONCURRENCY = int(os.getenv("RAG_QUERY_CONCURRENCY", "4"))
+QUERY_TIMEOUT = float(os.getenv("RAG_QUERY_TIMEOUT", "60"))
+
+# Shared embeddings, Chroma client and per-collection chains, built on first use
+registry = ResourceRegistry(persist_dir=persist_dir, embedding_model="text-embedding-3-small")
+
+
+# Initialize LLM on first use. The client timeout is what actually bounds a slow collection:
+# query_all_collections can stop waiting for a thread, but not stop the thread itself.
+def get_llm():
+    return registry.get("llm", lambda: ChatOpenAI(model="gpt-4o-mini", temperature=0,
+                                                  timeout=QUERY_TIMEOUT, max_retries=1))
+
+
 # Custom prompt template for RAG
 custom_prompt_template = """
 You are an expert assistant with deep knowledge about the content in the provided context.
@@ -26,21 +43,17 @@ Context:
 
 Question: {question}
 
-Your answer (be specific and cite sources when possible):
+Your answer (be specific and cite sources by their [n] numbers when possible):
 """
 
 
 # Function to create a RAG chain for a specific collection
-def create_rag_chain(collection_name):
-    # Initialize the collection
-    db = Chroma(
-        collection_name=collection_name,
-        embedding_function=embeddings,
-        persist_directory=persist_dir
-    )
-
-    # Set up the retriever
-    retriever = db.as_retriever(search_kwargs={"k": 4})
+def create_rag_chain(collection_name, retriever=None, llm=None, k=4):
+    # Set up the retriever (shares the Chroma client and embeddings; looked up per query,
+    # so a rebuilt index is picked up without rebuilding the chain)
+    retriever = retriever or registry.lazy_retriever(collection_name, k=k * CONTEXT_FETCH_FACTOR)
+    # Overlapping chunks are merged and the context packed into k chunks' worth of tokens, with citations
+    retriever = ContextBuilderRetriever(retriever=retriever, k=k)
 
     # Create the prompt
     PROMPT = PromptTemplate(
@@ -50,7 +63,7 @@ def create_rag_chain(collection_name):
 
     # Create the chain
     chain = RetrievalQA.from_chain_type(
-        llm=llm,
+        llm=llm or get_llm(),
         chain_type="stuff",
         retriever=retriever,
         return_source_documents=True,
@@ -60,35 +73,116 @@ def create_rag_chain(collection_name):
     return chain
 
 
-# Function to query across all collections and combine results
-def query_all_collections(query):
-    # Get list of collections - updated for Chroma v0.6.0
-    import chromadb
-    client = chromadb.PersistentClient(path=persist_dir)
-    collection_names = client.list_collections()
+# Function to query one collection
+def query_collection(collection_name, query):
+    # Chains are built once per collection and reused for later questions
+    chain = registry.chain(collection_name, create_rag_chain)
+
+    # Use .invoke() instead of calling the chain directly
+    response = chain.invoke({"query": query})
+
+    return {
+        "answer": response["result"],
+        "sources": [doc.metadata.get('source', 'Unknown') for doc in response["source_documents"]]
+    }
 
-    print(f"Found collections: {collection_names}")
 
-    all_responses = {}
+def print_response(collection_name, response):
+    print(f"Answer from {collection_name}:")
+    print(response["answer"])
+    print("Sources:", response["sources"])
 
-    # Query each collection
-    for collection_name in collection_names:
-        print(f"\nQuerying '{collection_name}' for: {query}")
-        chain = create_rag_chain(collection_name)
 
-        # Use .invoke() instead of calling the chain directly
-        response = chain.invoke({"query": query})
+# Function to query across all collections and combine results
+def query_all_collections(query, concurrent=True, max_concurrency=QUERY_CONCURRENCY, timeout=QUERY_TIMEOUT):
+    """
+    Ask every collection the same question.
+
+    With concurrent=True the collections are queried in parallel, at most
+    max_concurrency at a time. A collection that runs longer than timeout
+    seconds is given up on, and its entry is {"answer": None, "sources": [],
+    "error": ...}, so the other answers still come back.
+
+    Giving up does not free the worker: Python threads cannot be interrupted,
+    so a hung query keeps its thread until the LLM client's own timeout
+    (RAG_QUERY_TIMEOUT, see get_llm) ends it, and collections queued behind it
+    start later. Their timeout counts from when they start, not when queued.
+
+    Returns:
+        dict: {collection: {"answer": ..., "sources": [...]}}
+    """
+    # Get list of collections - updated for Chroma v0.6.0
+    client = registry.chroma_client()
+    collection_names = client.list_collections()
 
-        all_responses[collection_name] = {
-            "answer": response["result"],
-            "sources": [doc.metadata.get('source', 'Unknown') for doc in response["source_documents"]]
-        }
+    print(f"Found collections: {collection_names}")
 
-        print(f"Answer from {collection_name}:")
-        print(response["result"])
-        print("Sources:", [doc.metadata.get('source', 'Unknown') for doc in response["source_documents"]])
+    if not concurrent or len(collection_names) <= 1:
+        all_responses = {}
+
+        # Query each collection
+        for collection_name in collection_names:
+            print(f"\nQuerying '{collection_name}' for: {query}")
+            all_responses[collection_name] = query_collection(collection_name, query)
+            print_response(collection_name, all_responses[collection_name])
+
+        return all_responses
+
+    print(f"\nQuerying {len(collection_names)} collections concurrently for: {query}")
+    results = {}
+    started = {}
+
+    def run(collection_name):
+        # The timeout counts from when the query starts, not from when it was queued
+        started[collection_name] = time.monotonic()
+        return query_collection(collection_name, query)
+
+    executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="rag-query")
+    pending = {executor.submit(run, name): name for name in collection_names}
+    try:
+        while pending:
+            done, _ = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+            for future in done:
+                collection_name = pending.pop(future)
+                try:
+                    results[collection_name] = future.result()
+                except Exception as e:
+                    results[collection_name] = {"answer": None, "sources": [], "error": str(e)}
+                print_response(collection_name, results[collection_name])
+
+            now = time.monotonic()
+            for future, collection_name in list(pending.items()):
+                if collection_name in started and now - started[collection_name] > timeout:
+                    # Threads cannot be killed; the late answer is simply discarded
+                    future.cancel()
+                    del pending[future]
+                    results[collection_name] = {"answer": None, "sources": [],
+                                                "error": f"timed out after {timeout:.0f}s"}
+                    print(f"Query on '{collection_name}' timed out after {timeout:.0f}s")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    # Keep the collection order stable regardless of completion order
+    return {name: results[name] for name in collection_names}
+
+
+# Function to answer from the best chunks across all (or selected) collections in one pass
+def query_federated(query, collections=None, k=4):
+    # One query embedding, one merged top-k, one LLM call
+    retriever = registry.federated_retriever(collections=collections, k=k * CONTEXT_FETCH_FACTOR)
+    chain = registry.get(
+        f"federated_chain:{','.join(collections) if collections else '*'}:{k}",
+        lambda: create_rag_chain(None, retriever=retriever, k=k)
+    )
+    response = chain.invoke({"query": query})
 
-    return all_responses
+    return {
+        "answer": response["result"],
+        "sources": [
+            f"{doc.metadata.get('collection')}: {doc.metadata.get('source', 'Unknown')}"
+            for doc in response["source_documents"]
+        ]
+    }
 
 
 # Demo usage
@@ -104,4 +198,14 @@ if __name__ == "__main__":
         print("\n" + "=" * 80)
         print(f"QUESTION: {question}")
         print("=" * 80)
-        results = query_all_collections(question)
\ No newline at end of file
+        started = time.perf_counter()
+        if "--federated" in sys.argv:
+            results = query_federated(question)
+            print_response("all collections", results)
+        else:
+            results = query_all_collections(question)
+        print(f"\nAnswered in {time.perf_counter() - started:.2f}s")
+
+    print("\nResource timings:")
+    for name, stats in registry.timings().items():
+        print(f"  {name}: {stats}")
\ No newline at end of file
@@ -0,0 +1,99 @@
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+
+    rate is the number of tokens added per second, capacity the burst size.
+    acquire() blocks until the requested amount is available.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, amount, burst=None):
+        return cls(amount / 60.0, capacity=burst if burst is not None else amount)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount=1):
+        # A request bigger than the bucket could never be satisfied, so cap it at the capacity
+        amount = min(float(amount), self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait_seconds = (amount - self._tokens) / self.rate
+            time.sleep(wait_seconds)
+
+    def try_acquire(self, amount=1):
+        with self._lock:
+            self._refill()
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return True
+            return False
+
+
+def _status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def is_rate_limit_error(error):
+    """True for HTTP 429s and the client-specific RateLimitError exceptions."""
+    return _status_code(error) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def is_transient_error(error):
+    """True for rate limits, 5xx responses, timeouts and dropped connections."""
+    status = _status_code(error)
+    if is_rate_limit_error(error) or (status is not None and status >= 500):
+        return True
+    name = type(error).__name__
+    return "Timeout" in name or name in ("ConnectError", "RemoteProtocolError", "APIConnectionError")
+
+
+def _retry_after(error):
+    # Honor the server's Retry-After header when it gives one in seconds
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_with_backoff(fn, max_retries=5, base_delay=1.0, max_delay=60.0, retry_on=is_rate_limit_error):
+    """
+    Call fn(), retrying with exponential backoff and full jitter while retry_on(error) is True.
+
+    Returns:
+        Whatever fn() returns. The last error is re-raised once retries are exhausted.
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= max_retries or not retry_on(e):
+                raise
+            delay = _retry_after(e)
+            if delay is None:
+                delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            attempt += 1
+            time.sleep(delay)
@@ -0,0 +1,238 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any
+
+from langchain_core.retrievers import BaseRetriever
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def _clear_memory(agent):
+    # Pooled agents are reused across requests, so drop what the last run left in memory
+    for member in [agent, *(getattr(agent, "team", None) or [])]:
+        memory = getattr(member, "memory", None)
+        if memory is not None and hasattr(memory, "clear"):
+            memory.clear()
+
+
+class LazyRetriever(BaseRetriever):
+    """Stands in for a collection's retriever and builds the real one on the first query."""
+
+    registry: Any
+    collection_name: str
+    k: int = 4
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        with tracing.span("retrieval", collection=self.collection_name, k=self.k,
+                          mode=self.registry.retrieval_mode) as retrieval_span:
+            docs = self.registry.retriever(self.collection_name, k=self.k).invoke(query)
+            retrieval_span.set(docs=len(docs))
+            return docs
+
+
+class ResourceRegistry:
+    """
+    Lazily built, shared resources for the Slack bot and the RAG validator.
+
+    One embeddings object and one Chroma PersistentClient are shared by every
+    vector store, retriever and chain, and each of those is built on first use
+    and then reused. Agents are pooled: acquire_agent() hands out an idle
+    instance or builds a new one, so concurrent requests never share an Agent.
+
+    timings() reports how long each resource took to build (cold start) and how
+    often and how fast it was served from the registry afterwards (warm path).
+    """
+
+    def __init__(self, persist_dir="./chroma_db", embedding_model="text-embedding-3-small",
+                 retrieval_mode=None, embeddings=None):
+        self.persist_dir = persist_dir
+        self.embedding_model = embedding_model
+        # Optional embeddings object to use instead of the cached OpenAI one (e.g. FakeEmbeddings offline)
+        self._embeddings_override = embeddings
+        # "hybrid" fuses BM25 and vector search where dataloader.py built a BM25 index, "dense" is vector only,
+        # "quantized" searches the memory-mapped export of the collection instead of Chroma
+        # RETRIEVAL_MODE is read here rather than at import, so a value from .env applies
+        self.retrieval_mode = retrieval_mode or os.getenv("RETRIEVAL_MODE", "hybrid")
+        self._resources = {}
+        self._building = {}
+        self._timings = {}
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._agent_factories = {}
+        self._idle_agents = {}
+
+    def _record(self, name, phase, seconds):
+        with self._lock:
+            stats = self._timings.setdefault(name, {"cold_seconds": None, "warm_hits": 0, "warm_seconds": 0.0})
+            if phase == "cold":
+                stats["cold_seconds"] = seconds
+            else:
+                stats["warm_hits"] += 1
+                stats["warm_seconds"] += seconds
+
+    def get(self, name, builder):
+        """Return the resource called name, building it with builder() the first time."""
+        start = time.perf_counter()
+        with self._lock:
+            resource = self._resources.get(name, _MISSING)
+            # One lock per resource so a slow build does not block unrelated lookups
+            build_lock = self._building.setdefault(name, threading.Lock()) if resource is _MISSING else None
+
+        if build_lock is None:
+            self._record(name, "warm", time.perf_counter() - start)
+            return resource
+
+        with build_lock:
+            with self._lock:
+                resource = self._resources.get(name, _MISSING)
+            if resource is _MISSING:
+                resource = builder()
+                with self._lock:
+                    self._resources[name] = resource
+                elapsed = time.perf_counter() - start
+                self._record(name, "cold", elapsed)
+                logger.info(f"Built {name} in {elapsed:.2f}s")
+            return resource
+
+    def get_current(self, name, version, builder):
+        """
+        Like get(), but builds a new resource whenever version changes, e.g. after an index was rebuilt.
+
+        The copy built for the previous version is dropped from the registry.
+        """
+        key = f"{name}@{version}" if version is not None else name
+        resource = self.get(key, builder)
+        with self._lock:
+            previous = self._versions.get(name)
+            self._versions[name] = key
+            if previous is not None and previous != key:
+                self._resources.pop(previous, None)
+                self._building.pop(previous, None)
+                logger.info(f"Reloaded {name} for version {version}")
+        return resource
+
+    def embeddings(self):
+        from embedding_cache import get_cached_embeddings
+        return self.get("embeddings", lambda: self._embeddings_override or get_cached_embeddings(self.embedding_model))
+
+    def chroma_client(self):
+        import chromadb
+        return self.get("chroma_client", lambda: chromadb.PersistentClient(path=self.persist_dir))
+
+    def collection_exists(self, collection_name):
+        """True if the collection was ingested; unlike vector_store(), never creates it."""
+        names = self.chroma_client().list_collections()
+        # Chroma 0.6 lists names, older versions Collection objects
+        return collection_name in {getattr(collection, "name", collection) for collection in names}
+
+    def vector_store(self, collection_name):
+        from langchain_chroma import Chroma
+        return self.get(f"vector_store:{collection_name}", lambda: Chroma(
+            client=self.chroma_client(),
+            collection_name=collection_name,
+            embedding_function=self.embeddings()
+        ))
+
+    def retriever(self, collection_name, k=4):
+        # Rebuilt when the collection's index is republished, so a running bot serves re-ingested data
+        return self.get_current(f"retriever:{collection_name}:{k}", self._index_generation(collection_name),
+                                lambda: self._build_retriever(collection_name, k))
+
+    def _index_generation(self, collection_name):
+        import bm25_index
+        import quantized_index
+        if self.retrieval_mode == "hybrid":
+            return bm25_index.index_generation(self.persist_dir, collection_name)
+        if self.retrieval_mode == "quantized":
+            return quantized_index.index_generation(self.persist_dir, collection_name)
+        return None
+
+    def quantized_index(self, collection_name):
+        import quantized_index
+        # Remapped when the collection is exported again; the old version's files stay until pruned
+        return self.get_current(f"quantized_index:{collection_name}",
+                                quantized_index.index_generation(self.persist_dir, collection_name),
+                                lambda: quantized_index.QuantizedIndex.load(self.persist_dir, collection_name))
+
+    def _build_retriever(self, collection_name, k):
+        import bm25_index
+        import quantized_index
+        if self.retrieval_mode == "quantized":
+            if quantized_index.index_exists(self.persist_dir, collection_name):
+                return quantized_index.QuantizedRetriever(
+                    index=self.quantized_index(collection_name),
+                    embeddings=self.embeddings(),
+                    k=k
+                )
+            logger.warning(f"No quantized index for {collection_name}, falling back to Chroma")
+        if self.retrieval_mode == "hybrid" and bm25_index.index_exists(self.persist_dir, collection_name):
+            return bm25_index.HybridRetriever(
+                collection=self.chroma_client().get_collection(collection_name),
+                embeddings=self.embeddings(),
+                index=bm25_index.BM25Index.load(self.persist_dir, collection_name),
+                k=k
+            )
+        return self.vector_store(collection_name).as_retriever(search_kwargs={"k": k})
+
+    def federated_retriever(self, collections=None, k=4):
+        """One retriever over several collections (all of them by default) that embeds the query once."""
+        from federated_retriever import FederatedRetriever
+        key = ",".join(collections) if collections else "*"
+        return self.get(f"federated_retriever:{key}:{k}", lambda: FederatedRetriever(
+            client=self.chroma_client(),
+            embeddings=self.embeddings(),
+            collections=collections,
+            k=k
+        ))
+
+    def lazy_retriever(self, collection_name, k=4):
+        return LazyRetriever(registry=self, collection_name=collection_name, k=k)
+
+    def chain(self, collection_name, builder):
+        """Return the chain for a collection, building it with builder(collection_name) once."""
+        return self.get(f"chain:{collection_name}", lambda: builder(collection_name))
+
+    def register_agent(self, name, factory):
+        with self._lock:
+            self._agent_factories[name] = factory
+            self._idle_agents.setdefault(name, [])
+
+    @contextmanager
+    def acquire_agent(self, name):
+        """Borrow an agent instance for one request and return it to the pool afterwards."""
+        start = time.perf_counter()
+        with self._lock:
+            idle = self._idle_agents[name]
+            agent = idle.pop() if idle else None
+
+        if agent is None:
+            agent = self._agent_factories[name]()
+            self._record(f"agent:{name}", "cold", time.perf_counter() - start)
+        else:
+            self._record(f"agent:{name}", "warm", time.perf_counter() - start)
+
+        try:
+            yield agent
+        finally:
+            _clear_memory(agent)
+            with self._lock:
+                self._idle_agents[name].append(agent)
+
+    def timings(self):
+        with self._lock:
+            report = {}
+            for name, stats in self._timings.items():
+                warm_hits = stats["warm_hits"]
+                report[name] = {
+                    "cold_seconds": stats["cold_seconds"],
+                    "warm_hits": warm_hits,
+                    "warm_avg_ms": 1000 * stats["warm_seconds"] / warm_hits if warm_hits else None,
+                }
+            return report
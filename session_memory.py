@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+from embedding_writer import estimate_tokens
+
+
+def truncate_to_tokens(text, max_tokens):
+    # Inverse of estimate_tokens: about four characters per token
+    max_chars = max_tokens * 4
+    return text if len(text) <= max_chars else text[:max_chars].rstrip() + "..."
+
+
+def compact_summary(summary, question, answer, max_tokens):
+    """
+    Default summarizer: fold one turn into a running list of one-line notes.
+
+    Keeps the question and the start of the answer, and drops the oldest notes
+    once the summary is over max_tokens. Swap in an LLM-backed summarizer with
+    the same signature for better recall.
+    """
+    note = f"- Asked: {truncate_to_tokens(question, 40)} -> {truncate_to_tokens(' '.join(answer.split()), 60)}"
+    lines = (summary.splitlines() if summary else []) + [note]
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+class ConversationSession:
+    """Recent turns of one Slack thread plus a compact summary of older ones."""
+
+    def __init__(self, key):
+        self.key = key
+        self.summary = ""
+        self.turns = deque()
+        self.last_used = time.time()
+        self.lock = threading.Lock()
+
+    def tokens(self):
+        turn_tokens = sum(estimate_tokens(q) + estimate_tokens(a) for q, a in self.turns)
+        return estimate_tokens(self.summary) + turn_tokens if self.summary else turn_tokens
+
+    def render(self, question):
+        """Build the router input: the thread's history followed by the new question."""
+        if not self.summary and not self.turns:
+            return question
+
+        parts = ["Conversation so far in this Slack thread:"]
+        if self.summary:
+            parts.append(f"Summary of earlier turns:\n{self.summary}")
+        for q, a in self.turns:
+            parts.append(f"User: {q}\nAssistant: {a}")
+        parts.append(f"Current question: {question}")
+        return "\n\n".join(parts)
+
+
+class SessionStore:
+    """
+    Conversation memory keyed by Slack thread.
+
+    Each session keeps its recent turns within token_budget; older turns are
+    folded into a summary of at most summary_budget tokens by summarizer. Sessions
+    idle for longer than idle_ttl are dropped, and past max_sessions the least
+    recently used ones are evicted.
+    """
+
+    def __init__(self, max_sessions=500, idle_ttl=6 * 60 * 60, token_budget=2000,
+                 summary_budget=400, summarizer=compact_summary):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.summarizer = summarizer
+        # Guards the session table only; each session has its own lock
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - session.last_used < self.idle_ttl:
+                break
+            del self._sessions[key]
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None or now - session.last_used >= self.idle_ttl:
+                session = ConversationSession(key)
+                self._sessions[key] = session
+            session.last_used = now
+            self._sessions.move_to_end(key)
+            self._evict(now)
+            return session
+
+    def render(self, key, question):
+        session = self.get(key)
+        with session.lock:
+            return session.render(question)
+
+    def add_turn(self, key, question, answer):
+        # Only the session's own lock is held while summarizing, so other threads are never blocked
+        session = self.get(key)
+        with session.lock:
+            # A single turn never takes more than half the budget
+            half = self.token_budget // 2
+            session.turns.append((truncate_to_tokens(question, half // 4), truncate_to_tokens(answer, half)))
+
+            while len(session.turns) > 1 and session.tokens() > self.token_budget:
+                old_question, old_answer = session.turns.popleft()
+                session.summary = self.summarizer(session.summary, old_question, old_answer, self.summary_budget)
+
+    def __len__(self):
+        return len(self._sessions)
@@ -0,0 +1,89 @@
+import logging
+import threading
+import traceback
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedDispatcher:
+    """
+    Runs Slack agent work on a bounded thread pool so event listeners return immediately.
+
+    - At most max_workers jobs run at once across all channels.
+    - At most per_channel_limit jobs run at once per channel; the rest wait
+      in that channel's queue without holding a worker.
+    - At most max_queue_depth jobs are accepted (running plus waiting).
+      submit() returns False beyond that so the caller can reply "busy".
+    - shutdown() stops accepting work and waits for accepted jobs to drain.
+    """
+
+    def __init__(self, max_workers=8, per_channel_limit=2, max_queue_depth=32):
+        self.per_channel_limit = per_channel_limit
+        self.max_queue_depth = max_queue_depth
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="slack-worker")
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._running = defaultdict(int)
+        self._waiting = defaultdict(deque)
+        self._depth = 0
+        self._closed = False
+
+    @property
+    def depth(self):
+        return self._depth
+
+    def submit(self, channel, fn, *args, **kwargs):
+        """Accept a job for a channel. Returns False if the dispatcher is full or shutting down."""
+        with self._lock:
+            if self._closed or self._depth >= self.max_queue_depth:
+                return False
+            self._depth += 1
+
+            job = (fn, args, kwargs)
+            if self._running[channel] < self.per_channel_limit:
+                self._running[channel] += 1
+                self._executor.submit(self._run, channel, job)
+            else:
+                self._waiting[channel].append(job)
+            return True
+
+    def _run(self, channel, job):
+        fn, args, kwargs = job
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Unhandled error in dispatched job for channel {channel}: {str(e)}")
+            logger.error(traceback.format_exc())
+        finally:
+            self._finish(channel)
+
+    def _finish(self, channel):
+        with self._lock:
+            self._depth -= 1
+            waiting = self._waiting.get(channel)
+            if waiting:
+                # Hand this channel's slot straight to its next waiting job
+                self._executor.submit(self._run, channel, waiting.popleft())
+            else:
+                self._running[channel] -= 1
+                if not self._running[channel]:
+                    del self._running[channel]
+                self._waiting.pop(channel, None)
+
+            if self._depth == 0:
+                self._idle.notify_all()
+
+    def shutdown(self, timeout=None):
+        """
+        Stop accepting work and wait for accepted jobs to finish.
+
+        Returns:
+            bool: True if every job finished before the timeout
+        """
+        with self._lock:
+            self._closed = True
+            drained = self._idle.wait_for(lambda: self._depth == 0, timeout=timeout)
+        self._executor.shutdown(wait=drained)
+        return drained
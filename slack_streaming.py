@@ -0,0 +1,154 @@
+import logging
+import threading
+import time
+
+from rate_limit import retry_with_backoff, is_rate_limit_error
+
+logger = logging.getLogger(__name__)
+
+# Slack truncates long messages; stay under its 4000 character guideline
+SLACK_MESSAGE_LIMIT = 3900
+
+# Shown instead of an answer that came back empty, so the "processing" notice does not stay up forever
+EMPTY_ANSWER_TEXT = "Sorry, I could not come up with an answer to that. Please try rephrasing your question."
+
+
+def split_message(text, limit=SLACK_MESSAGE_LIMIT):
+    """
+    Split text into Slack-sized messages, preferring paragraph, line and word boundaries.
+
+    A code block cut in two is closed at the end of one part and reopened at
+    the start of the next, so both render as code.
+
+    Returns:
+        list of str
+    """
+    parts = []
+    carry = ""
+    text = text or ""
+    while text:
+        text = carry + text
+        carry = ""
+        if len(text) <= limit:
+            parts.append(text)
+            break
+
+        # Leave room for a closing fence
+        window = text[:limit - 4]
+        cut = window.rfind("\n\n")
+        if cut < limit // 2:
+            cut = window.rfind("\n")
+        if cut < limit // 2:
+            cut = window.rfind(" ")
+        if cut <= 0:
+            cut = len(window)
+
+        part, text = text[:cut].rstrip(), text[cut:].lstrip("\n ")
+        if part.count("```") % 2:
+            part += "\n```"
+            carry = "```\n"
+        parts.append(part)
+    return parts
+
+
+class StreamingMessage:
+    """
+    Shows an answer in Slack while it is being generated by editing one message in place.
+
+    append() buffers text; the message is edited with chat_update at most once
+    every min_interval seconds and only when at least min_chars arrived.
+    Slack limits chat.update per workspace, not per message, so every stream
+    of the bot takes its intermediate edits from one shared edit_bucket; when
+    the bucket is empty the edit is skipped and the next append tries again.
+    Past max_chars the current message is frozen and the text continues in a
+    new message. finish() writes the final answer, split across as many
+    messages as it needs, without waiting for the bucket.
+
+    on_post(ts) is called for every message posted, e.g. to track thread participation.
+    """
+
+    def __init__(self, client, channel, thread_ts, min_interval=1.0, min_chars=40,
+                 max_chars=SLACK_MESSAGE_LIMIT, on_post=None, edit_bucket=None):
+        self.client = client
+        self.channel = channel
+        self.thread_ts = thread_ts
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.on_post = on_post
+        # Optional rate_limit.TokenBucket shared by all streams
+        self.edit_bucket = edit_bucket
+        self.text = ""
+        # Messages already posted for this answer, oldest first, and the text each one shows
+        self.messages = []
+        self.updates = 0
+        self.first_update_at = None
+        self._started_at = time.monotonic()
+        self._last_flush = 0.0
+        self._flushed_len = 0
+        self._lock = threading.Lock()
+
+    def start(self, text):
+        """Post the message that will be edited (e.g. a "processing" notice)."""
+        with self._lock:
+            self._post(text)
+
+    def _post(self, text):
+        response = self.client.chat_postMessage(channel=self.channel, thread_ts=self.thread_ts, text=text)
+        self.messages.append([response["ts"], text])
+        if self.on_post:
+            self.on_post(response["ts"])
+
+    def _update(self, index, text, retry=False):
+        ts, shown = self.messages[index]
+        if text == shown:
+            return
+
+        def send():
+            return self.client.chat_update(channel=self.channel, ts=ts, text=text)
+
+        if retry:
+            retry_with_backoff(send, max_retries=3, retry_on=is_rate_limit_error)
+        else:
+            try:
+                send()
+            except Exception as e:
+                # A skipped intermediate edit is harmless, the next flush or finish() catches up
+                logger.warning(f"Skipped streaming update: {str(e)}")
+                return
+        self.messages[index][1] = text
+        self.updates += 1
+
+    def _render(self, final=False):
+        # Frozen messages keep their text; the rest of the answer goes to the last message and new ones
+        parts = split_message(self.text, self.max_chars)
+        for index, part in enumerate(parts):
+            if index < len(self.messages):
+                self._update(index, part, retry=final)
+            else:
+                self._post(part)
+        if self.first_update_at is None and self.text:
+            self.first_update_at = time.monotonic() - self._started_at
+
+    def append(self, delta):
+        with self._lock:
+            self.text += delta
+            now = time.monotonic()
+            if now - self._last_flush < self.min_interval or len(self.text) - self._flushed_len < self.min_chars:
+                return
+            if self.edit_bucket is not None and not self.edit_bucket.try_acquire():
+                return
+            self._last_flush = now
+            self._flushed_len = len(self.text)
+            self._render()
+
+    def finish(self, text=None):
+        """Write the complete answer (the streamed text unless text is given)."""
+        with self._lock:
+            if text is not None:
+                self.text = text
+            if not self.text.strip():
+                self.text = EMPTY_ANSWER_TEXT
+            self._render(final=True)
+            logger.info(f"Streamed answer in {len(self.messages)} message(s) with {self.updates} updates, "
+                        f"first content after {self.first_update_at or 0.0:.2f}s")
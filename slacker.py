@@ -1,6 +1,5 @@
 from phi.agent import Agent
 from phi.knowledge.langchain import LangChainKnowledgeBase
-from langchain_openai import OpenAIEmbeddings
 from phi.tools.duckduckgo import DuckDuckGo
 from phi.tools.yfinance import YFinanceTools
 import os
@@ -11,19 +10,39 @@ from phi.model.google import Gemini
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 
-from langchain_chroma import Chroma
+# Load environment variables before the modules below read their settings
+load_dotenv()
 
-from confluence_tool import search_confluence_docs, retrieve_confluence_page
+from confluence_tool import (
+    search_confluence_docs, retrieve_confluence_page, close_client, page_cache, CONFLUENCE_COLLECTION
+)
+from registry import ResourceRegistry
+from context_builder import ContextBuilderRetriever, CONTEXT_FETCH_FACTOR
+from answer_cache import SemanticAnswerCache
+from slack_dispatcher import BoundedDispatcher
+from thread_tracker import ThreadParticipationCache
+from session_memory import SessionStore
+from pre_router import PreRouter
+from collection_registry import discover_collections
+from slack_streaming import StreamingMessage, split_message
+from rate_limit import TokenBucket
+from tool_cache import ToolResultCache
+from embedding_writer import estimate_tokens
+import tracing
+import signal
+import sys
+import time
 import traceback
 
+STARTED_AT = time.perf_counter()
+
 ####################
 # Setup logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
 #####################
-# Load environment variables
-load_dotenv()
+# Environment variables (.env was loaded above)
 SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN")
 SLACK_SIGNING_SECRET = os.getenv("SLACK_SIGNING_SECRET")
 SLACK_APP_LEVEL_TOKEN = os.getenv("SLACK_APP_LEVEL_TOKEN")
@@ -33,157 +52,428 @@ MODEL = "text-embedding-3-small"
 
 # Chroma settings
 CHROMA_PERSIST_DIR = "./chroma_db"
+
+# Answer cache settings
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+
+# Worker pool settings
+SLACK_MAX_WORKERS = int(os.getenv("SLACK_MAX_WORKERS", "8"))
+SLACK_PER_CHANNEL_LIMIT = int(os.getenv("SLACK_PER_CHANNEL_LIMIT", "2"))
+SLACK_MAX_QUEUE_DEPTH = int(os.getenv("SLACK_MAX_QUEUE_DEPTH", "32"))
+SLACK_DRAIN_TIMEOUT = float(os.getenv("SLACK_DRAIN_TIMEOUT", "120"))
+BUSY_MESSAGE = "I'm handling a lot of requests right now. Please try again in a minute."
+
+# Thread participation cache settings (set SLACK_THREAD_CACHE_PATH to "" to keep it in memory only)
+SLACK_THREAD_CACHE_PATH = os.getenv("SLACK_THREAD_CACHE_PATH", "./cache/slack_threads.json") or None
+SLACK_THREAD_CACHE_TTL = float(os.getenv("SLACK_THREAD_CACHE_TTL", str(7 * 24 * 3600)))
+SLACK_THREAD_CACHE_MAX_ENTRIES = int(os.getenv("SLACK_THREAD_CACHE_MAX_ENTRIES", "10000"))
+
+# Conversation memory settings
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "500"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", str(6 * 3600)))
+SESSION_TOKEN_BUDGET = int(os.getenv("SESSION_TOKEN_BUDGET", "2000"))
+
+# Pre-router settings: queries that clearly match one agent skip the GPT-4o routing call
+PRE_ROUTER_ENABLED = os.getenv("PRE_ROUTER_ENABLED", "true").lower() == "true"
+PRE_ROUTER_MIN_SIMILARITY = float(os.getenv("PRE_ROUTER_MIN_SIMILARITY", "0.35"))
+PRE_ROUTER_MIN_MARGIN = float(os.getenv("PRE_ROUTER_MIN_MARGIN", "0.08"))
+
+# Streaming settings: answers are shown while they are generated by editing one Slack message
+SLACK_STREAMING = os.getenv("SLACK_STREAMING", "true").lower() == "true"
+SLACK_STREAM_INTERVAL = float(os.getenv("SLACK_STREAM_INTERVAL", "1.0"))
+SLACK_STREAM_MIN_CHARS = int(os.getenv("SLACK_STREAM_MIN_CHARS", "40"))
+# Intermediate edits per minute across all streams; Slack allows about 50 chat.update calls a minute
+SLACK_STREAM_UPDATES_PER_MINUTE = int(os.getenv("SLACK_STREAM_UPDATES_PER_MINUTE", "40"))
+
+# Tool result cache settings: web and finance lookups are shared across requests and rate-limited per backend
+TOOL_CACHE_ENABLED = os.getenv("TOOL_CACHE_ENABLED", "true").lower() == "true"
 #####################
 
-# Setup Slack app
-app = App(token=SLACK_BOT_TOKEN, signing_secret=SLACK_SIGNING_SECRET)
-bot_user_id = app.client.auth_test()["user_id"]
+# Shared, lazily built embeddings, Chroma client, retrievers and agents
+registry = ResourceRegistry(persist_dir=CHROMA_PERSIST_DIR, embedding_model=MODEL)
 
+# Setup Slack app (the token is verified on the first event instead of at import)
+app = App(token=SLACK_BOT_TOKEN, signing_secret=SLACK_SIGNING_SECRET, token_verification_enabled=False)
 
-# Create knowledge retrievers for Chroma collections
-def create_chroma_retriever(collection_name):
-    # Initialize embeddings
-    embeddings = OpenAIEmbeddings(model=MODEL)
 
-    try:
-        # Create Chroma retriever
-        chroma_db = Chroma(
-            collection_name=collection_name,
-            embedding_function=embeddings,
-            persist_directory=CHROMA_PERSIST_DIR
-        )
+def get_bot_user_id():
+    return registry.get("bot_user_id", lambda: app.client.auth_test()["user_id"])
 
-        # Set up the retriever with more results to compensate for no reranking
-        retriever = chroma_db.as_retriever(search_kwargs={"k": 4})
+# Agent runs happen here, never in the Bolt listener
+dispatcher = BoundedDispatcher(
+    max_workers=SLACK_MAX_WORKERS,
+    per_channel_limit=SLACK_PER_CHANNEL_LIMIT,
+    max_queue_depth=SLACK_MAX_QUEUE_DEPTH
+)
 
-        logger.info(f"Successfully created retriever for collection: {collection_name}")
-        return retriever
+# One cache for every pooled web and finance agent, so identical concurrent lookups become one call
+tool_cache = ToolResultCache()
 
-    except Exception as e:
-        logger.error(f"Error creating retriever for collection '{collection_name}': {str(e)}")
-        return None
 
+def cache_tools(toolkit):
+    return tool_cache.wrap_toolkit(toolkit) if TOOL_CACHE_ENABLED else toolkit
 
-######setup retriever for first KB collection - Leadership #######
-leadership_retriever = create_chroma_retriever("Leadership")
-leadership_knowledge_base = LangChainKnowledgeBase(retriever=leadership_retriever)
+# Threads the bot has replied in, so thread messages rarely need a conversations_replies call
+participation = ThreadParticipationCache(
+    ttl=SLACK_THREAD_CACHE_TTL,
+    max_entries=SLACK_THREAD_CACHE_MAX_ENTRIES,
+    path=SLACK_THREAD_CACHE_PATH
+)
+
+# Intermediate streaming edits of every answer in flight draw from this one bucket, in short bursts
+stream_edit_bucket = TokenBucket.per_minute(SLACK_STREAM_UPDATES_PER_MINUTE,
+                                            burst=max(1, SLACK_STREAM_UPDATES_PER_MINUTE // 6))
+
+
+# Create knowledge retrievers for Chroma collections
+def create_chroma_retriever(collection_name, k=4):
+    # The Chroma handle is opened on the first query, through the shared client and embeddings.
+    # Extra candidates are merged, deduplicated and packed into k chunks' worth of tokens with citations.
+    candidates = registry.lazy_retriever(collection_name, k=k * CONTEXT_FETCH_FACTOR)
+    retriever = ContextBuilderRetriever(retriever=candidates, k=k)
+    logger.info(f"Registered lazy retriever for collection: {collection_name}")
+    return retriever
 
-######setup retriever for first KB collection - ArgoCD #######
-argocd_retriever = create_chroma_retriever("ArgoCD")
-argocd_knowledge_base = LangChainKnowledgeBase(retriever=argocd_retriever)
 
 ##########################################
-leadership_knowledge_agent = Agent(
-    name="Leadership Topics Knowledgebase RAG Agent",
-    role="""You are an experienced knowledge finder with a true passionate for finding the answers to questions from users.
-    As somebody with a data science background you are also very familiar with how vector databases are setup and how best to 
-    retrieved answers from those data sources. You will always work to ensure that the best and most accurate answer is 
-    found and wherever possible will include any citations or references included with those stored knowledge chunks. """,
-    instructions="""Use the Leadership knowledge base to answer questions from the user about leadership. Use any tools or 
-    methods that will retrieve the most accurate answer to the question generated from the Leadership Knowledgebase. Return 
-    the output in a markdown format and structured in well written english. Treat this output professionally and with the utmost care.""",
-    model=Gemini(id="gemini-2.0-flash-lite"),
-    knowledge=leadership_knowledge_base,
-    add_context=True,
-    search_knowledge=True,
-    markdown=True,
-    debug_mode=True,
-)
+def make_model(model_id):
+    # Collections pick their model by id in collections.json
+    if model_id.startswith(("gpt-", "o1", "o3", "o4")):
+        return OpenAIChat(id=model_id)
+    return Gemini(id=model_id)
+
+
+def make_knowledge_agent(spec):
+    """Knowledge base agent for one collection; it holds no Chroma handle until its first query."""
+    return Agent(
+        name=spec.agent_name,
+        role="""You are an experienced knowledge finder with a true passionate for finding the answers to questions from users.
+        As somebody with a data science background you are also very familiar with how vector databases are setup and how best to 
+        retrieved answers from those data sources. You will always work to ensure that the best and most accurate answer is 
+        found and wherever possible will include any citations or references included with those stored knowledge chunks. """,
+        instructions=spec.instructions or f"""Use the {spec.name} knowledge base to answer questions from the user about {spec.description}. Use any tools or 
+        methods that will retrieve the most accurate answer to the question generated from the {spec.name} Knowledgebase. Return 
+        the output in a markdown format and structured in well written english. Treat this output professionally and with the utmost care.""",
+        model=make_model(spec.model),
+        knowledge=LangChainKnowledgeBase(retriever=create_chroma_retriever(spec.name, k=spec.k)),
+        add_context=True,
+        search_knowledge=True,
+        markdown=True,
+        debug_mode=True,
+    )
+
+
+def load_knowledge_specs():
+    """
+    Discover the knowledge base collections and register their agents, cache TTLs and pre-router routes.
+
+    Only lists the collections; their retrievers open on the first query. This
+    runs once per process, so a collection ingested while the bot runs (or a
+    collections.json change) needs a restart. Re-ingesting an existing
+    collection does not: its retrievers reload the republished index.
+    """
+    # Every Chroma collection except the ones with a hand-written agent gets a generated knowledge base agent
+    specs = discover_collections(registry.chroma_client(), exclude=[CONFLUENCE_COLLECTION])
+    for spec in specs:
+        # Pooled on its own, so an agent is only built when the pre-router sends a query to it
+        registry.register_agent(spec.agent_name, lambda spec=spec: make_knowledge_agent(spec))
+        if answer_cache is not None:
+            answer_cache.ttls[spec.agent_name] = spec.cache_ttl
+        if pre_router:
+            pre_router.add_samples(spec.agent_name, spec.route_samples)
+    # The shared delegate may answer from any collection, so its answers live as long as the shortest TTL
+    if answer_cache is not None and specs:
+        answer_cache.ttls[KNOWLEDGE_BASE_AGENT] = min(spec.cache_ttl for spec in specs)
+    return specs
+
+
+def knowledge_specs():
+    # Discovered on the first request rather than at startup, before its answer cache lookup
+    return registry.get("knowledge_specs", load_knowledge_specs)
+
+
+# The LLM router's single delegate for every knowledge base collection
+KNOWLEDGE_BASE_AGENT = "Knowledge Base Agent"
+
+
+def make_knowledge_base_agent():
+    """
+    One delegate for every knowledge base collection, searched together with a single query embedding.
+
+    The LLM router hands knowledge base questions to this agent instead of one
+    member per collection, so its team and routing prompt stay the same size
+    however many collections are ingested.
+    """
+    specs = knowledge_specs()
+    k = max((spec.k for spec in specs), default=4)
+    candidates = registry.federated_retriever(collections=[spec.name for spec in specs],
+                                              k=k * CONTEXT_FETCH_FACTOR)
+    return Agent(
+        name=KNOWLEDGE_BASE_AGENT,
+        role="""You are an experienced knowledge finder who answers questions from the team's internal knowledge bases.
+        You always work to ensure that the best and most accurate answer is found and wherever possible include
+        any citations or references included with the stored knowledge chunks.""",
+        instructions="""Use the knowledge bases to answer the question from the user. Return the output in a markdown format
+        and structured in well written english. If the knowledge bases have nothing relevant, say so instead of making up an answer.""",
+        model=Gemini(id="gemini-2.0-flash-lite"),
+        knowledge=LangChainKnowledgeBase(retriever=ContextBuilderRetriever(retriever=candidates, k=k)),
+        add_context=True,
+        search_knowledge=True,
+        markdown=True,
+        debug_mode=True,
+    )
 
-argocd_knowledge_agent = Agent(
-    name="Argocd Topics Knowledgebase RAG Agent",
-    role="""You are an experienced knowledge finder with a true passionate for finding the answers to questions from users.
-    As somebody with a data science background you are also very familiar with how vector databases are setup and how best to 
-    retrieved answers from those data sources. You will always work to ensure that the best and most accurate answer is 
-    found and wherever possible will include any citations or references included with those stored knowledge chunks. """,
-    instructions="""Use the Argocd knowledge base to answer questions from the user about Argocd. Use any tools or 
-    methods that will retrieve the most accurate answer to the question generated from the Argocd Knowledgebase. Return 
-    the output in a markdown format and structured in well written english. Treat this output professionally and with the utmost care.""",
-    model=Gemini(id="gemini-2.0-flash-lite"),
-    knowledge=argocd_knowledge_base,
-    add_context=True,
-    search_knowledge=True,
-    markdown=True,
-    debug_mode=True,
-)
 
 ##########################################
-web_search_agent = Agent(
-    name="Web Search Agent",
-    role=f"""You are a savvy technical researcher with smart skills to find any information on the Internet.
-         You will be asked to use those skills to find the relevant information on a topic. You are passionate about that topic
-         and will find the relevant information to share with the team. Use the available tools to find that information 
-         to get the latest news and do not return old or stale data. Provide citations and links where possible. You're part of the 
-         Mission Impossible Team with the responsibility to Search the web for the latest news and information.""",
-    tools=[DuckDuckGo()],
-    model=Gemini(id="gemini-2.0-flash-lite"),
-)
+def make_web_search_agent():
+    return Agent(
+        name="Web Search Agent",
+        role=f"""You are a savvy technical researcher with smart skills to find any information on the Internet.
+             You will be asked to use those skills to find the relevant information on a topic. You are passionate about that topic
+             and will find the relevant information to share with the team. Use the available tools to find that information 
+             to get the latest news and do not return old or stale data. Provide citations and links where possible. You're part of the 
+             Mission Impossible Team with the responsibility to Search the web for the latest news and information.""",
+        tools=[cache_tools(DuckDuckGo())],
+        model=Gemini(id="gemini-2.0-flash-lite"),
+    )
+
+
+def make_finance_agent():
+    return Agent(
+        name="Finance Agent",
+        role=f""" You are a stock expert and investment stud. You have a knack for finding the best stocks to invest in.
+        You will use your skills to find the relevant information on the latest stock prices, stock news, financials, and market trends.
+        You are passionate about stocks and will find the relevant information to share with the team. Use the available tools to find that information.
+        You are part of the Mission Impossible Team with the responsibility to find the latest stock prices and financial information. You are very
+        familiar with stock/financials. You will use the available tools to find the latest stock prices and financial information. You will not provide
+        old stale information because you know that could have negative consequences for the team. You will provide citations and links where possible.
+        You will return: stock price, analyst recommendation, company info, stock fundamentals, income statements, key financial ratios, company news, 
+        technical indicators, and historical prices. Your responsibility is to Handle financial queries, such as stock prices and market trends.""",
+        tools=[cache_tools(YFinanceTools(stock_price=True, analyst_recommendations=True, key_financial_ratios=True,
+                                         stock_fundamentals=True, income_statements=True, company_news=True,
+                                         technical_indicators=True, historical_prices=True, company_info=True))],
+        model=Gemini(id="gemini-2.0-flash-lite"),
+    )
+
+
+def make_content_writer_agent():
+    return Agent(
+        name="Expert Content Writer Agent",
+        role=f"""Generates engaging blogs, articles, and other written content on topic.""",
+        model=Gemini(id="gemini-2.0-flash-lite"),
+    )
+
+
+def make_confluence_agent():
+    # Chroma(collection_name=...) would quietly create an empty collection for a space that was never synced
+    synced = registry.collection_exists(CONFLUENCE_COLLECTION)
+    if not synced:
+        logger.warning(f"Confluence collection '{CONFLUENCE_COLLECTION}' not found (run confluence_loader.py); "
+                       f"the Confluence agent searches Confluence live only")
+    return Agent(
+        name="Confluence Knowledge Agent",
+        role="""You are a specialized Confluence knowledge assistant. Your primary role is to help users find 
+        relevant documentation and information stored in Confluence. You're equipped with tools to search 
+        Confluence content and retrieve specific documents when needed.""",
+        instructions=[
+            *(["First search your knowledge base, which holds the Confluence space synced by confluence_loader.py, and answer from it when it has relevant pages.",
+               "When the knowledge base has nothing relevant, use the search_confluence_docs tool to find relevant pages."]
+              if synced else ["Use the search_confluence_docs tool to find relevant pages."]),
+            "Always include the URLs to the Confluence pages in your responses so users can access them directly.",
+            "If the user asks for the full content, use the retrieve_confluence_page tool to get the full content of specific pages.",
+            "Format your responses in a clear, organized way with markdown.",
+            "If searching Confluence doesn't yield helpful results, acknowledge this and suggest alternatives or ask for more specific information.",
+            "When you provide information from Confluence, cite the source by including the page title and URL."
+        ],
+        # Synced pages are answered locally; the live tools cover pages that are not synced yet
+        knowledge=LangChainKnowledgeBase(retriever=create_chroma_retriever(CONFLUENCE_COLLECTION)) if synced else None,
+        add_context=synced,
+        search_knowledge=synced,
+        tools=[search_confluence_docs, retrieve_confluence_page],  # Using the new function name
+        show_tool_calls=True,
+        model=Gemini(id="gemini-2.0-flash-lite"),
+        markdown=True,
+        debug_mode=True,
+    )
 
-finance_agent = Agent(
-    name="Finance Agent",
-    role=f""" You are a stock expert and investment stud. You have a knack for finding the best stocks to invest in.
-    You will use your skills to find the relevant information on the latest stock prices, stock news, financials, and market trends.
-    You are passionate about stocks and will find the relevant information to share with the team. Use the available tools to find that information.
-    You are part of the Mission Impossible Team with the responsibility to find the latest stock prices and financial information. You are very
-    familiar with stock/financials. You will use the available tools to find the latest stock prices and financial information. You will not provide
-    old stale information because you know that could have negative consequences for the team. You will provide citations and links where possible.
-    You will return: stock price, analyst recommendation, company info, stock fundamentals, income statements, key financial ratios, company news, 
-    technical indicators, and historical prices. Your responsibility is to Handle financial queries, such as stock prices and market trends.""",
-    tools=[YFinanceTools(stock_price=True, analyst_recommendations=True, key_financial_ratios=True,
-                         stock_fundamentals=True, income_statements=True, company_news=True, technical_indicators=True,
-                         historical_prices=True, company_info=True)],
-    model=Gemini(id="gemini-2.0-flash-lite"),
-)
 
-content_writer_agent = Agent(
-    name="Expert Content Writer Agent",
-    role=f"""Generates engaging blogs, articles, and other written content on topic.""",
-    model=Gemini(id="gemini-2.0-flash-lite"),
+##############################
+def build_router_agent():
+    # Conversation history comes from the thread's session, not from the Agent's memory.
+    # Knowledge base collections share one delegate, so adding collections does not grow the routing prompt.
+    return Agent(
+        name="Router Agent",
+        role="Routes user queries to the appropriate agent.",
+        instructions=[
+            f"If the query is about internal documentation or a topic covered by the team's knowledge bases, route it to the {KNOWLEDGE_BASE_AGENT}.",
+            "If the query is about confluence documentation, confluence topics, or questions like 'where can I find information about X on confluence', route it to the Confluence Knowledge Agent.",
+
+            "If the query is about recent news, weather, travel, or information, route it to the Web Search Agent.",
+            "If the query is about financial stock, financial data, financial news, route it to the Finance Agent.",
+            "If the query is about writing or generating content, route it to the Content Writer Agent.",
+
+            "Absolutely - do not make anything up and do not provide old or stale information.",
+        ],
+        team=[make_knowledge_base_agent(), make_confluence_agent(),
+              make_web_search_agent(), make_finance_agent(), make_content_writer_agent()],
+        show_tool_calls=True,
+        model=OpenAIChat(id="gpt-4o"),
+        markdown=True,
+    )
+
+
+# Routers (with their own team members) are pooled so concurrent requests never share an Agent.
+# Every agent the pre-router can pick is pooled on its own too; knowledge base agents are added by load_knowledge_specs().
+registry.register_agent("router", build_router_agent)
+registry.register_agent("Confluence Knowledge Agent", make_confluence_agent)
+registry.register_agent("Web Search Agent", make_web_search_agent)
+registry.register_agent("Finance Agent", make_finance_agent)
+registry.register_agent("Expert Content Writer Agent", make_content_writer_agent)
+
+# Per-thread conversation memory for the router
+sessions = SessionStore(
+    max_sessions=SESSION_MAX_COUNT,
+    idle_ttl=SESSION_IDLE_TTL,
+    token_budget=SESSION_TOKEN_BUDGET
 )
 
-confluence_agent = Agent(
-    name="Confluence Knowledge Agent",
-    role="""You are a specialized Confluence knowledge assistant. Your primary role is to help users find 
-    relevant documentation and information stored in Confluence. You're equipped with tools to search 
-    Confluence content and retrieve specific documents when needed.""",
-    instructions=[
-        "When users ask about documentation or information, use the search_confluence_docs tool to find relevant pages.",
-        "Always include the URLs to the Confluence pages in your responses so users can access them directly.",
-        "If the user asks for the full content, use the retrieve_confluence_page tool to get the full content of specific pages.",
-        "Format your responses in a clear, organized way with markdown.",
-        "If searching Confluence doesn't yield helpful results, acknowledge this and suggest alternatives or ask for more specific information.",
-        "When you provide information from Confluence, cite the source by including the page title and URL."
-    ],
-    tools=[search_confluence_docs, retrieve_confluence_page],  # Using the new function name
-    show_tool_calls=True,
-    model=Gemini(id="gemini-2.0-flash-lite"),
-    markdown=True,
-    debug_mode=True,
-)
 
-##############################
-router_agent = Agent(
-    name="Router Agent",
-    role="Routes user queries to the appropriate agent.",
-    instructions=[
-        "If the query is about Leadership, leadership, or related topics, route it to the Leadership Topics Knowledgebase RAG Agent.",
-        "If the query is about ArgoCD, GitOps, or related topics, route it to the Argocd Topics Knowledgebase RAG Agent.",
-        "If the query is about confluence documentation, confluence topics, or questions like 'where can I find information about X on confluence', route it to the Confluence Knowledge Agent.",
-
-        "If the query is about recent news, weather, travel, or information, route it to the Web Search Agent.",
-        "If the query is about financial stock, financial data, financial news, route it to the Finance Agent.",
-        "If the query is about writing or generating content, route it to the Content Writer Agent.",
-
-        "Absolutely - do not make anything up and do not provide old or stale information.",
+def agent_collections():
+    # Collections each knowledge agent answers from, used to invalidate cached answers on re-ingest
+    specs = knowledge_specs()
+    collections = {spec.agent_name: [spec.name] for spec in specs}
+    collections[KNOWLEDGE_BASE_AGENT] = [spec.name for spec in specs]
+    collections["Confluence Knowledge Agent"] = [CONFLUENCE_COLLECTION]
+    return collections
+
+
+answer_cache = SemanticAnswerCache(registry.embeddings()) if ANSWER_CACHE_ENABLED else None
+
+# Example queries for the agents that have no collection to compute a centroid from
+ROUTE_SAMPLES = {
+    "Web Search Agent": [
+        "What is the latest news about the AI industry?",
+        "What's the weather forecast in New York this weekend?",
+        "Find recent articles about Kubernetes security vulnerabilities",
+        "What are the best places to travel in Japan in spring?",
     ],
-    team=[leadership_knowledge_agent, argocd_knowledge_agent, confluence_agent, web_search_agent, finance_agent,
-          content_writer_agent],
-    show_tool_calls=True,
-    add_history_to_messages=True,
-    num_history_responses=8,
-    model=OpenAIChat(id="gpt-4o"),
-    markdown=True,
-)
+    "Finance Agent": [
+        "What is the current stock price of NVDA?",
+        "Show me analyst recommendations for Apple stock",
+        "What are Microsoft's key financial ratios and fundamentals?",
+        "Give me the latest financial news and income statement for Tesla",
+    ],
+    "Expert Content Writer Agent": [
+        "Write a blog post about the benefits of remote work",
+        "Draft an article introducing our new product launch",
+        "Generate a short LinkedIn post announcing our team offsite",
+        "Write an engaging summary for a newsletter",
+    ],
+    "Confluence Knowledge Agent": [
+        "Where can I find the onboarding documentation on Confluence?",
+        "Search Confluence for the incident response runbook",
+        "Which Confluence page describes our deployment process?",
+        "Find the Confluence space for the platform team",
+    ],
+}
+
+pre_router = None
+if PRE_ROUTER_ENABLED:
+    pre_router = PreRouter(
+        registry.embeddings(),
+        min_similarity=PRE_ROUTER_MIN_SIMILARITY,
+        min_margin=PRE_ROUTER_MIN_MARGIN
+    )
+    # Knowledge base collections are added by load_knowledge_specs(), before the first route
+    for agent_name, samples in ROUTE_SAMPLES.items():
+        pre_router.add_samples(agent_name, samples)
+
+
+def routed_agents(router, agent_response):
+    # The router hands a query to a team member through a transfer_task_to_<agent_name> tool call
+    tool_names = {tool.get("tool_name") for tool in (getattr(agent_response, "tools", None) or [])}
+    return [
+        member.name for member in router.team
+        if f"transfer_task_to_{member.name.replace(' ', '_').lower()}" in tool_names
+    ]
+
+
+def _metric_total(value):
+    # phi reports per-message metrics as lists
+    if isinstance(value, (list, tuple)):
+        return sum(v for v in value if isinstance(v, (int, float)))
+    return value if isinstance(value, (int, float)) else None
+
+
+def response_metrics(agent_response):
+    """Token counts of a run, as span attributes."""
+    metrics = getattr(agent_response, "metrics", None) or {}
+    return {
+        key: _metric_total(metrics.get(key))
+        for key in ("input_tokens", "output_tokens", "total_tokens")
+        if metrics.get(key) is not None
+    }
+
+
+def trace_member_runs(agent_response):
+    # The router runs team members inside transfer_task_to_* tool calls; phi times each call
+    for tool in getattr(agent_response, "tools", None) or []:
+        tool_name = tool.get("tool_name") or ""
+        seconds = (tool.get("metrics") or {}).get("time")
+        if seconds is not None:
+            stage = "agent.member" if tool_name.startswith("transfer_task_to_") else "agent.tool"
+            tracing.record_span(stage, seconds, tool=tool_name)
+
+
+def run_streaming(agent, prompt, on_delta):
+    # Feed each content delta to on_delta as it arrives; the agent keeps the full response in run_response
+    parts = []
+    for chunk in agent.run(prompt, stream=True):
+        delta = getattr(chunk, "content", None)
+        if isinstance(delta, str) and delta:
+            parts.append(delta)
+            on_delta(delta)
+
+    agent_response = agent.run_response
+    if agent_response is not None and not isinstance(getattr(agent_response, "content", None), str):
+        agent_response.content = "".join(parts)
+    return agent_response
+
+
+def run_agents(clean_input, prompt, on_delta=None):
+    """
+    Answer a prompt, letting the pre-router skip the LLM router when the target agent is clear.
+
+    With on_delta, the answer is streamed and on_delta(text) is called for every chunk.
+
+    Returns:
+        tuple: (agent response, names of the agents that handled it)
+    """
+    # Collections are discovered (and registered with the pre-router) on the first request;
+    # answer_message has usually done it already
+    knowledge_specs()
+
+    target = None
+    if pre_router:
+        with tracing.span("pre_router") as route_span:
+            try:
+                target = pre_router.route(clean_input)
+            except Exception as e:
+                # The LLM router can always decide, so a pre-router failure is not fatal
+                logger.warning(f"Pre-router failed, falling back to the LLM router: {str(e)}")
+            route_span.set(target=target)
+
+    # A pre-routed query borrows just its agent; only the LLM router needs the whole team
+    with registry.acquire_agent(target or "router") as agent:
+        with tracing.span("agent.run", agent=agent.name, streamed=bool(on_delta),
+                          prompt_tokens=estimate_tokens(prompt)) as run_span:
+            if on_delta:
+                agent_response = run_streaming(agent, prompt, on_delta)
+            else:
+                agent_response = agent.run(prompt)
+            run_span.set(**response_metrics(agent_response))
+            trace_member_runs(agent_response)
+        return agent_response, [target] if target else routed_agents(agent, agent_response)
 
 
 ##################################################
@@ -195,6 +485,8 @@ def handle_message_events(event, say):
     thread_ts = event.get("thread_ts")  # Thread timestamp if message is in thread
     ts = event.get("ts")  # Message timestamp
 
+    bot_user_id = get_bot_user_id()
+
     # Skip messages from the bot itself to avoid loops
     if user == bot_user_id:
         return
@@ -202,61 +494,153 @@ def handle_message_events(event, say):
     # CASE 1: Direct mention in channel (starts a new thread)
     if not thread_ts and f"<@{bot_user_id}>" in text:
         # Create a new thread by using this message's ts
-        process_and_respond(text, channel, ts, say, is_new_thread=True)
+        dispatch(channel, ts, say, process_and_respond, text, channel, ts, say, is_new_thread=True)
         return
 
     # CASE 2: Message in an existing thread
     if thread_ts:
-        # Check if bot has participated in this thread before
-        try:
-            # Get conversation history for this thread
-            result = app.client.conversations_replies(
-                channel=channel,
-                ts=thread_ts,
-                limit=100  # Adjust based on your needs
-            )
-
-            # Check if bot has posted in this thread before
-            bot_in_thread = any(message.get("user") == bot_user_id for message in result["messages"])
-
-            if bot_in_thread:
+        known = participation.get(channel, thread_ts)
+        if known:
+            # Bot is part of this thread, respond without requiring mention
+            dispatch(channel, thread_ts, say, process_and_respond, text, channel, thread_ts, say)
+        elif known is None:
+            # Participation is not known yet, so stay quiet instead of replying "busy" to unrelated threads
+            dispatch(channel, thread_ts, None, respond_if_participating, text, channel, thread_ts, say)
+
+
+def dispatch(channel, thread_ts, busy_say, fn, *args, **kwargs):
+    # Hand the work to the worker pool so the listener returns right away; reply "busy" when it is full
+    if not dispatcher.submit(channel, fn, *args, **kwargs):
+        logger.warning(f"Dispatcher full ({dispatcher.depth} jobs), rejecting message in {channel}")
+        if busy_say:
+            tracked_say(busy_say, channel, thread_ts)(text=BUSY_MESSAGE, channel=channel, thread_ts=thread_ts)
+
+
+def tracked_say(say, channel, thread_ts):
+    # Every reply the bot posts marks the thread as one it participates in
+    def _say(**kwargs):
+        result = say(**kwargs)
+        participation.mark(channel, thread_ts)
+        return result
+    return _say
+
+
+def bot_in_thread(channel, thread_ts):
+    known = participation.get(channel, thread_ts)
+    tracing.set_attributes(participation_cache_hit=known is not None)
+    if known is not None:
+        return known
+
+    # Cold miss: page through the whole thread, not just the first 100 replies
+    cursor = None
+    while True:
+        with tracing.span("slack.conversations_replies"):
+            result = app.client.conversations_replies(channel=channel, ts=thread_ts, limit=200, cursor=cursor)
+        if any(message.get("user") == get_bot_user_id() for message in result["messages"]):
+            participation.mark(channel, thread_ts)
+            return True
+
+        cursor = (result.get("response_metadata") or {}).get("next_cursor")
+        if not cursor:
+            break
+
+    participation.mark_absent(channel, thread_ts)
+    return False
+
+
+def respond_if_participating(text, channel, thread_ts, say):
+    # Check if bot has participated in this thread before
+    try:
+        with tracing.span("slack.thread_message", channel=channel):
+            if bot_in_thread(channel, thread_ts):
                 # Bot is part of this thread, respond without requiring mention
                 process_and_respond(text, channel, thread_ts, say)
-        except Exception as e:
-            logger.error(f"Error checking thread participation: {str(e)}")
-            logger.error(traceback.format_exc())
+    except Exception as e:
+        logger.error(f"Error checking thread participation: {str(e)}")
+        logger.error(traceback.format_exc())
 
 
 def process_and_respond(text, channel, thread_ts, say, is_new_thread=False):
+    # One trace per answered message; every stage below is a child span
+    with tracing.span("slack.request", channel=channel, new_thread=is_new_thread):
+        answer_message(text, channel, thread_ts, say, is_new_thread)
+
+
+def answer_message(text, channel, thread_ts, say, is_new_thread=False):
+    say = tracked_say(say, channel, thread_ts)
+    stream = None
     try:
         # Remove bot mention if present
-        clean_input = text.replace(f"<@{bot_user_id}>", "").strip()
+        clean_input = text.replace(f"<@{get_bot_user_id()}>", "").strip()
+        session_key = f"{channel}:{thread_ts}"
+
+        # In streaming mode the answer is written into one message that is edited as it grows
+        if SLACK_STREAMING:
+            stream = StreamingMessage(
+                app.client, channel, thread_ts,
+                min_interval=SLACK_STREAM_INTERVAL,
+                min_chars=SLACK_STREAM_MIN_CHARS,
+                on_post=lambda ts: participation.mark(channel, thread_ts),
+                edit_bucket=stream_edit_bucket
+            )
 
         if is_new_thread:
-            # For new threads, acknowledge that we're processing
-            say(
-                text="Processing your request... I'll get back to you shortly.",
-                channel=channel,
-                thread_ts=thread_ts
-            )
+            # For new threads, acknowledge that we're processing (the acknowledgement becomes the answer when streaming)
+            if stream:
+                stream.start("Processing your request... I'll get back to you shortly.")
+            else:
+                say(
+                    text="Processing your request... I'll get back to you shortly.",
+                    channel=channel,
+                    thread_ts=thread_ts
+                )
 
         logger.info(f"Processing request in {'new' if is_new_thread else 'existing'} thread: '{clean_input}'")
 
-        # Get response from router agent
-        agent_response = router_agent.run(clean_input)
-
-        # Extract the string content from the RunResponse object
-        if hasattr(agent_response, 'content'):
-            response_text = agent_response.content
+        # Per-collection cache TTLs and routes must be registered before the cache is consulted
+        knowledge_specs()
+
+        # Only new threads use the answer cache; follow-ups depend on the thread's history
+        use_cache = answer_cache is not None and is_new_thread
+        cached = None
+        if use_cache:
+            with tracing.span("answer_cache.lookup") as lookup_span:
+                cached = answer_cache.lookup(clean_input)
+                lookup_span.set(hit=cached is not None)
+
+        if cached:
+            logger.info(f"Answer cache hit (similarity {cached['similarity']:.3f}, "
+                        f"age {cached['age_seconds']:.0f}s, agent {cached['agent'] or 'router'})")
+            response_text = cached["answer"]
         else:
-            response_text = str(agent_response)
-
-        # Send the response back to Slack in the thread
-        say(
-            text=response_text,
-            channel=channel,
-            thread_ts=thread_ts
-        )
+            # Get response from the routed agent, with this thread's history in front of the question
+            agent_response, agents = run_agents(clean_input, sessions.render(session_key, clean_input),
+                                                on_delta=stream.append if stream else None)
+
+            # Extract the string content from the RunResponse object
+            if hasattr(agent_response, 'content'):
+                response_text = agent_response.content
+            else:
+                response_text = str(agent_response)
+
+            if use_cache and response_text:
+                collection_by_agent = agent_collections()
+                collections = sorted({collection for agent in agents for collection in collection_by_agent.get(agent, [])})
+                answer_cache.store(clean_input, response_text, agents=agents, collections=collections)
+
+        sessions.add_turn(session_key, clean_input, response_text)
+
+        # Send the response back to Slack in the thread, split into several messages when it is too long
+        with tracing.span("slack.post", streamed=stream is not None, answer_tokens=estimate_tokens(response_text or "")):
+            if stream:
+                stream.finish(response_text)
+            else:
+                for part in split_message(response_text):
+                    say(
+                        text=part,
+                        channel=channel,
+                        thread_ts=thread_ts
+                    )
 
     except Exception as e:
         # Log the error for debugging
@@ -264,16 +648,45 @@ def process_and_respond(text, channel, thread_ts, say, is_new_thread=False):
         logger.error(traceback.format_exc())
 
         # Send a friendly error message to the user in the thread
+        error_text = f"Sorry, I encountered an error while processing your request: {str(e)}"
+        if stream is not None:
+            # Replace the processing notice (or the half-streamed answer) instead of leaving it up
+            partial = stream.text.strip()
+            if partial.count("```") % 2:
+                partial += "\n```"
+            try:
+                stream.finish(f"{partial}\n\n{error_text}" if partial else error_text)
+                return
+            except Exception as finish_error:
+                logger.error(f"Could not finish the streamed message: {str(finish_error)}")
         say(
-            text=f"Sorry, I encountered an error while processing your request: {str(e)}",
+            text=error_text,
             channel=channel,
             thread_ts=thread_ts
         )
 
 
 if __name__ == "__main__":
-    logger.info("Starting Socket Mode handler...")
+    # Turn SIGTERM into a normal exit so in-flight requests get drained below
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    logger.info(f"Startup took {time.perf_counter() - STARTED_AT:.2f}s, starting Socket Mode handler...")
     handler = SocketModeHandler(app, SLACK_APP_LEVEL_TOKEN)
-    handler.start()
+    try:
+        handler.start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        logger.info(f"Shutting down, draining {dispatcher.depth} in-flight requests...")
+        handler.close()
+        if not dispatcher.shutdown(timeout=SLACK_DRAIN_TIMEOUT):
+            logger.warning("Drain timed out, some requests were not answered")
+        participation.save()
+        close_client()
+        logger.info(f"Confluence page cache: {page_cache.stats()}")
+        logger.info(f"Tool result cache: {tool_cache.stats()}")
+        logger.info(f"Resource timings: {registry.timings()}")
+        if pre_router:
+            logger.info(f"Pre-router metrics: {pre_router.metrics()}")
 
 
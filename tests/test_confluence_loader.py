@@ -0,0 +1,160 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+pytest.importorskip("httpx")
+pytest.importorskip("chromadb")
+pytest.importorskip("langchain")
+pytest.importorskip("langchain_community")
+
+# Select the offline embeddings before dataloader picks its backend
+os.environ["EMBEDDING_BACKEND"] = "fake"
+
+import chromadb
+
+import confluence_loader
+import confluence_tool
+from embedding_writer import FakeEmbeddings
+
+SPACE = "ENG"
+# Results per listing page, whatever limit the client asks for, so a small space still spans several pages
+SERVER_PAGE_SIZE = 2
+
+
+class FakeConfluence:
+    """Pages of one space, served over the REST paths confluence_loader uses, with a log of requests."""
+
+    def __init__(self):
+        self.pages = {}
+        self.requests = []
+
+    def add(self, page_id, text, number=1):
+        self.pages[page_id] = {
+            "id": page_id,
+            "type": "page",
+            "title": f"Page {page_id}",
+            "space": {"key": SPACE},
+            "version": {"number": number, "when": f"2026-01-{number:02d}T00:00:00.000Z"},
+            "body": {"storage": {"value": f"<p>{text}</p>"}},
+            "_links": {"webui": f"/spaces/{SPACE}/pages/{page_id}"},
+        }
+
+    def listing(self, query):
+        start = int(query.get("start", ["0"])[0])
+        ids = sorted(self.pages)
+        results = [{key: value for key, value in self.pages[page_id].items() if key != "body"}
+                   for page_id in ids[start:start + SERVER_PAGE_SIZE]]
+        links = {}
+        if start + SERVER_PAGE_SIZE < len(ids):
+            links["next"] = f"/rest/api/content?spaceKey={SPACE}&expand=version&start={start + SERVER_PAGE_SIZE}"
+        return {"results": results, "size": len(results), "_links": links}
+
+    def body_fetches(self):
+        return sorted(path.rsplit("/", 1)[1] for path in self.requests if path.startswith("/rest/api/content/"))
+
+    def listing_requests(self):
+        return [path for path in self.requests if path == "/rest/api/content"]
+
+
+@pytest.fixture
+def confluence(monkeypatch):
+    fake = FakeConfluence()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            fake.requests.append(url.path)
+            if url.path == "/rest/api/content":
+                payload = fake.listing(parse_qs(url.query))
+            elif url.path.rsplit("/", 1)[1] in fake.pages:
+                payload = fake.pages[url.path.rsplit("/", 1)[1]]
+            else:
+                self.send_error(404)
+                return
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    monkeypatch.setattr(confluence_tool, "CONFLUENCE_URL", url)
+    monkeypatch.setattr(confluence_loader, "CONFLUENCE_URL", url)
+    monkeypatch.setattr(confluence_tool, "CONFLUENCE_USERNAME", "bot@example.com")
+    monkeypatch.setattr(confluence_tool, "CONFLUENCE_API_TOKEN", "token")
+    monkeypatch.setattr(confluence_tool, "CONFLUENCE_HTTP2", False)
+    confluence_tool.close_client()
+    yield fake
+    confluence_tool.close_client()
+    server.shutdown()
+    server.server_close()
+
+
+def chunks_by_page(persist_dir, collection_name="Confluence"):
+    collection = chromadb.PersistentClient(path=persist_dir).get_collection(collection_name)
+    records = collection.get(include=["documents", "metadatas"])
+    pages = {}
+    for text, metadata in zip(records["documents"], records["metadatas"]):
+        pages.setdefault(metadata["page_id"], []).append(text)
+    return pages
+
+
+def sync(persist_dir):
+    return confluence_loader.sync_space(SPACE, "Confluence", persist_dir=str(persist_dir), embeddings=FakeEmbeddings())
+
+
+def test_first_sync_follows_pagination(confluence, tmp_path, monkeypatch):
+    # A window smaller than the space, so fetching has to refill it as pages are split
+    monkeypatch.setattr(confluence_loader, "CONFLUENCE_FETCH_WINDOW", 2)
+    for i in range(1, 6):
+        confluence.add(str(i), f"original text of page {i}")
+
+    assert sync(tmp_path) is True
+
+    # Five pages at two per listing page take three listing requests
+    assert len(confluence.listing_requests()) == 3
+    assert confluence.body_fetches() == ["1", "2", "3", "4", "5"]
+    assert sorted(chunks_by_page(tmp_path)) == ["1", "2", "3", "4", "5"]
+
+
+def test_incremental_sync_fetches_only_changed_pages(confluence, tmp_path):
+    for i in range(1, 6):
+        confluence.add(str(i), f"original text of page {i}")
+    sync(tmp_path)
+
+    confluence.add("3", "rewritten text of page 3", number=2)
+    del confluence.pages["5"]
+    confluence.add("6", "text of a new page 6")
+    confluence.requests.clear()
+
+    assert sync(tmp_path) is True
+
+    # Only the page whose version.when changed and the new one are downloaded again
+    assert confluence.body_fetches() == ["3", "6"]
+    pages = chunks_by_page(tmp_path)
+    assert sorted(pages) == ["1", "2", "3", "4", "6"]
+    assert any("rewritten text of page 3" in text for text in pages["3"])
+    assert not any("original text of page 3" in text for text in pages["3"])
+
+
+def test_unchanged_space_is_not_fetched(confluence, tmp_path):
+    for i in range(1, 4):
+        confluence.add(str(i), f"original text of page {i}")
+    sync(tmp_path)
+    confluence.requests.clear()
+
+    assert sync(tmp_path) is False
+    assert confluence.body_fetches() == []
+    assert len(confluence.listing_requests()) == 2
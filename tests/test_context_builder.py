@@ -0,0 +1,41 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from context_builder import ContextBuilderRetriever, context_token_budget
+from embedding_writer import estimate_tokens
+
+
+class StaticRetriever(BaseRetriever):
+    docs: list
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.docs
+
+
+def epub_chunks(count, size=1500):
+    # Distinct words, so no chunk overlaps or near-duplicates another
+    return [Document(page_content=" ".join(f"w{i}x{j}" for j in range(size // 8)).ljust(size, "."),
+                     metadata={"source": f"book{i}.epub"}) for i in range(count)]
+
+
+def test_default_budget_holds_k_chunks(monkeypatch):
+    monkeypatch.delenv("CONTEXT_TOKEN_BUDGET", raising=False)
+    assert context_token_budget(k=4, chunk_size=1500) >= 1500
+
+    docs = epub_chunks(4)
+    context = ContextBuilderRetriever(retriever=StaticRetriever(docs=docs), k=4).invoke("q")
+    # As much text as the raw top-k chunks: all four fit whole, citation lines included
+    assert [doc.page_content.split("\n", 1)[1] for doc in context] == [doc.page_content for doc in docs]
+
+
+def test_budget_is_read_on_every_query(monkeypatch):
+    retriever = ContextBuilderRetriever(retriever=StaticRetriever(docs=epub_chunks(4)), k=4)
+    monkeypatch.setenv("CONTEXT_TOKEN_BUDGET", "400")
+    assert sum(estimate_tokens(doc.page_content) for doc in retriever.invoke("q")) <= 400
+
+    monkeypatch.setenv("CONTEXT_TOKEN_BUDGET", "0")
+    assert len(retriever.invoke("q")) == 4
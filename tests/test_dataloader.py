@@ -0,0 +1,97 @@
+import os
+import shutil
+
+import pytest
+
+pytest.importorskip("chromadb")
+pytest.importorskip("langchain_community")
+pytest.importorskip("pypdf")
+
+# Select the offline embeddings before dataloader picks its backend
+os.environ["EMBEDDING_BACKEND"] = "fake"
+
+import chromadb
+
+import dataloader
+from embedding_writer import FakeEmbeddings
+from ingest_manifest import Manifest
+
+DOCS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "docs", "Leadership")
+PDF = "Colin-Powell-Leadership.pdf"
+COLLECTION = "Leadership"
+
+
+class CrashingEmbeddings(FakeEmbeddings):
+    """Embeds the first `calls_before_crash` batches, then fails every call like a dead backend."""
+
+    def __init__(self, calls_before_crash):
+        super().__init__()
+        self.calls_before_crash = calls_before_crash
+
+    def embed_documents(self, texts):
+        if self.calls >= self.calls_before_crash:
+            raise RuntimeError("backend went away")
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def small_batches(monkeypatch):
+    # One batch at a time, so the crash leaves a known prefix of the file committed
+    monkeypatch.setattr(dataloader, "EMBED_BATCH_SIZE", 4)
+    monkeypatch.setattr(dataloader, "EMBED_CONCURRENCY", 1)
+    monkeypatch.setattr(dataloader, "INGEST_WORKERS", 1)
+
+
+def test_resume_after_crash_in_legacy_collection_keeps_every_chunk(small_batches, tmp_path):
+    docs_path = tmp_path / "docs"
+    docs_path.mkdir()
+    shutil.copy(os.path.join(DOCS, PDF), docs_path / PDF)
+    persist_dir = str(tmp_path / "chroma")
+
+    # A collection ingested before manifests existed: random chunk IDs, found only by source
+    collection = chromadb.PersistentClient(path=persist_dir).create_collection(COLLECTION, embedding_function=None)
+    collection.add(ids=["legacy-1"], documents=["old chunk"], embeddings=FakeEmbeddings().embed_documents(["old"]),
+                   metadatas=[{"source": str(docs_path / PDF)}])
+
+    with pytest.raises(RuntimeError):
+        dataloader.sync_collection(COLLECTION, str(docs_path), persist_dir=persist_dir,
+                                   embeddings=CrashingEmbeddings(calls_before_crash=2))
+    # The crash left part of the file written and checkpointed, and the file unrecorded
+    manifest = Manifest.load(persist_dir, COLLECTION)
+    assert PDF not in manifest.files and manifest.legacy_cleanup_pending
+    assert os.path.exists(manifest.path + ".writer.log")
+
+    assert dataloader.sync_collection(COLLECTION, str(docs_path), persist_dir=persist_dir,
+                                      embeddings=FakeEmbeddings()) is True
+
+    manifest = Manifest.load(persist_dir, COLLECTION)
+    recorded = manifest.chunk_ids(PDF)
+    stored = chromadb.PersistentClient(path=persist_dir).get_collection(COLLECTION).get()["ids"]
+    assert recorded and sorted(stored) == sorted(recorded)
+    assert not manifest.legacy_cleanup_pending
+    assert not os.path.exists(manifest.path + ".writer.log")
+
+
+def test_changed_chunk_settings_resplit_unchanged_files(small_batches, tmp_path):
+    docs_path = tmp_path / "docs"
+    docs_path.mkdir()
+    shutil.copy(os.path.join(DOCS, PDF), docs_path / PDF)
+    persist_dir = str(tmp_path / "chroma")
+
+    def sync(chunk_settings=dataloader.CHUNK_SETTINGS):
+        return dataloader.sync_collection(COLLECTION, str(docs_path), persist_dir=persist_dir,
+                                          embeddings=FakeEmbeddings(), chunk_settings=chunk_settings)
+
+    assert sync() is True
+    default_ids = Manifest.load(persist_dir, COLLECTION).chunk_ids(PDF)
+
+    # An override in collections.json applies to a file that is already ingested
+    smaller = {**dataloader.CHUNK_SETTINGS, "pdf": {"chunk_size": 400, "chunk_overlap": 50}}
+    assert sync(smaller) is True
+    manifest = Manifest.load(persist_dir, COLLECTION)
+    assert manifest.files[PDF]["chunking"] == smaller["pdf"]
+    assert len(manifest.chunk_ids(PDF)) > len(default_ids)
+    stored = chromadb.PersistentClient(path=persist_dir).get_collection(COLLECTION).get()["ids"]
+    assert sorted(stored) == sorted(manifest.chunk_ids(PDF))
+
+    assert sync(smaller) is False
@@ -0,0 +1,124 @@
+import threading
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from langchain_core.documents import Document
+
+from embedding_writer import EmbeddingWriter, FakeEmbeddings
+
+
+class MemorySink:
+    """Stands in for ChromaSink and records every upsert."""
+
+    def __init__(self):
+        self.batches = []
+        self.rows = {}
+        self._lock = threading.Lock()
+
+    def upsert(self, ids, texts, metadatas, vectors):
+        with self._lock:
+            self.batches.append(list(ids))
+            self.rows.update(zip(ids, texts))
+
+
+class RateLimitError(Exception):
+    """Looks like a 429 to rate_limit.is_rate_limit_error, and asks for no wait."""
+
+    class response:
+        status_code = 429
+        headers = {"retry-after": "0"}
+
+
+class FlakyEmbeddings(FakeEmbeddings):
+    """Answers the first `rate_limited` calls with a 429, then embeds normally."""
+
+    def __init__(self, rate_limited):
+        super().__init__()
+        self.rate_limited = rate_limited
+        self.attempts = 0
+
+    def embed_documents(self, texts):
+        self.attempts += 1
+        if self.attempts <= self.rate_limited:
+            raise RateLimitError("429 Too Many Requests")
+        return super().embed_documents(texts)
+
+
+class CrashingEmbeddings(FakeEmbeddings):
+    """Embeds `calls_before_crash` batches, then fails every call."""
+
+    def __init__(self, calls_before_crash):
+        super().__init__()
+        self.calls_before_crash = calls_before_crash
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        if self.calls >= self.calls_before_crash:
+            raise RuntimeError("backend went away")
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+def chunks(source, count):
+    ids = [f"{source}-{i}" for i in range(count)]
+    docs = [Document(page_content=f"chunk {i} of {source}", metadata={"source": source}) for i in range(count)]
+    return ids, docs
+
+
+def test_batches_are_bounded_and_sources_reported_once_committed():
+    sink = MemorySink()
+    committed = []
+    with EmbeddingWriter(sink, FakeEmbeddings(), batch_size=4, max_concurrency=2,
+                         on_source_committed=committed.append) as writer:
+        for source, count in (("a", 10), ("b", 3)):
+            writer.add_source(source, *chunks(source, count))
+
+    assert all(len(batch) <= 4 for batch in sink.batches)
+    assert len(sink.rows) == 13
+    assert sorted(committed) == ["a", "b"]
+
+
+def test_rate_limit_errors_are_retried():
+    sink = MemorySink()
+    backend = FlakyEmbeddings(rate_limited=2)
+    with EmbeddingWriter(sink, backend, batch_size=8, max_concurrency=1) as writer:
+        writer.add_source("a", *chunks("a", 5))
+
+    assert writer.stats["retries"] == 2
+    assert backend.attempts == 3
+    assert len(sink.rows) == 5
+
+
+def test_resume_after_crash_embeds_only_uncommitted_chunks(tmp_path):
+    checkpoint = str(tmp_path / "writer.log")
+    ids, docs = chunks("a", 10)
+
+    crashing = CrashingEmbeddings(calls_before_crash=2)
+    with pytest.raises(RuntimeError):
+        with EmbeddingWriter(MemorySink(), crashing, batch_size=3, max_concurrency=1,
+                             checkpoint_path=checkpoint) as writer:
+            writer.add_source("a", ids, docs)
+    assert len(crashing.embedded) == 6
+
+    sink = MemorySink()
+    backend = CrashingEmbeddings(calls_before_crash=100)
+    with EmbeddingWriter(sink, backend, batch_size=3, max_concurrency=1, checkpoint_path=checkpoint) as writer:
+        writer.add_source("a", ids, docs)
+
+    # Nothing committed before the crash is embedded again
+    assert not set(backend.embedded) & set(crashing.embedded)
+    assert sorted(backend.embedded + crashing.embedded) == sorted(doc.page_content for doc in docs)
+    assert writer.stats["skipped"] == 6
+
+
+def test_close_removes_the_checkpoint(tmp_path):
+    checkpoint = tmp_path / "writer.log"
+    # Sources are reported after their IDs reach the checkpoint
+    seen = []
+    with EmbeddingWriter(MemorySink(), FakeEmbeddings(), batch_size=2, checkpoint_path=str(checkpoint),
+                         on_source_committed=lambda source: seen.append(checkpoint.exists())) as writer:
+        writer.add_source("a", *chunks("a", 5))
+    assert seen == [True]
+    assert not checkpoint.exists()
@@ -0,0 +1,25 @@
+from html_text import html_excerpt, html_to_markdown
+
+
+def test_void_tags_in_skipped_elements_do_not_swallow_the_rest():
+    html = '<html><head><meta charset="utf-8"><title>x</title></head><body><p>visible text</p></body></html>'
+    assert html_to_markdown(html) == "visible text"
+
+
+def test_line_break_inside_macro_parameter():
+    html = '<p>a<br>b</p><ac:parameter ac:name="x">p<br>q</ac:parameter><p>lost?</p>'
+    assert html_to_markdown(html) == "a\nb\n\nlost?"
+
+
+def test_task_list_drops_ids_and_statuses():
+    html = ("<ac:task-list>"
+            "<ac:task><ac:task-id>1</ac:task-id><ac:task-status>complete</ac:task-status>"
+            "<ac:task-body>Ship it</ac:task-body></ac:task>"
+            "<ac:task><ac:task-id>2</ac:task-id><ac:task-status>incomplete</ac:task-status>"
+            "<ac:task-body>Write docs</ac:task-body></ac:task>"
+            "</ac:task-list><p>after</p>")
+    assert html_to_markdown(html) == "- Ship it\n- Write docs\n\nafter"
+
+
+def test_excerpt_stops_at_max_length():
+    assert html_excerpt("<p>" + "word " * 100 + "</p>", max_length=20) == "word word word word ..."
@@ -0,0 +1,23 @@
+from thread_tracker import ThreadParticipationCache
+
+
+def test_mark_absent_does_not_override_a_fresh_mark():
+    cache = ThreadParticipationCache()
+    cache.mark("C1", "100.1")
+    # A cold-miss lookup that started before the post finishes afterwards
+    cache.mark_absent("C1", "100.1")
+    assert cache.get("C1", "100.1") is True
+
+
+def test_mark_absent_replaces_an_expired_mark():
+    cache = ThreadParticipationCache(ttl=0)
+    cache.mark("C1", "100.1")
+    cache.mark_absent("C1", "100.1")
+    assert cache.get("C1", "100.1") is False
+
+
+def test_mark_overrides_absent():
+    cache = ThreadParticipationCache()
+    cache.mark_absent("C1", "100.1")
+    cache.mark("C1", "100.1")
+    assert cache.get("C1", "100.1") is True
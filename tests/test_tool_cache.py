@@ -0,0 +1,123 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from tool_cache import ToolResultCache
+
+
+class SlowPriceTool:
+    """Stands in for a yfinance lookup; every call blocks until release() so callers overlap."""
+
+    def __init__(self):
+        self.calls = []
+        self.started = threading.Event()
+        self._release = threading.Event()
+
+    def __call__(self, symbol: str) -> str:
+        self.calls.append(symbol)
+        self.started.set()
+        assert self._release.wait(5)
+        return f"{symbol.upper()}: 123.45"
+
+    def release(self):
+        self._release.set()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_identical_concurrent_calls_run_the_tool_once():
+    cache = ToolResultCache(requests_per_minute={})
+    tool = SlowPriceTool()
+    price = cache.wrap("get_current_stock_price", tool)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(price, symbol) for symbol in ["AAPL", "aapl", " AAPL", "AAPL"] * 2]
+        # Every caller is either the one fetching or waiting on it before the fetch returns
+        wait_for(lambda: cache.stats()["coalesced"] == 7)
+        tool.release()
+        results = {future.result() for future in futures}
+
+    assert tool.calls == ["AAPL"]
+    assert results == {"AAPL: 123.45"}
+    assert price("AAPL") == "AAPL: 123.45"
+    assert len(tool.calls) == 1 and cache.stats()["hits"] == 1
+
+
+def test_entries_expire_after_their_ttl():
+    cache = ToolResultCache(ttls={"get_current_stock_price": 0.05}, requests_per_minute={})
+    tool = SlowPriceTool()
+    tool.release()
+    price = cache.wrap("get_current_stock_price", tool)
+
+    price("AAPL")
+    price("AAPL")
+    assert len(tool.calls) == 1
+
+    time.sleep(0.1)
+    price("AAPL")
+    assert len(tool.calls) == 2
+
+
+def test_errors_are_not_cached():
+    cache = ToolResultCache(requests_per_minute={})
+    calls = []
+
+    def get_company_info(symbol: str) -> str:
+        calls.append(symbol)
+        return f"Could not fetch company info for {symbol}"
+
+    def get_company_news(symbol: str) -> str:
+        calls.append(symbol)
+        raise RuntimeError("backend went away")
+
+    info = cache.wrap("get_company_info", get_company_info)
+    news = cache.wrap("get_company_news", get_company_news)
+    info("MSFT")
+    info("MSFT")
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            news("MSFT")
+
+    assert len(calls) == 4
+    assert cache.stats()["entries"] == 0
+
+
+def test_followers_are_released_when_the_leader_is_interrupted():
+    cache = ToolResultCache(requests_per_minute={})
+    leader_started, interrupt = threading.Event(), threading.Event()
+
+    def get_current_stock_price(symbol: str) -> str:
+        leader_started.set()
+        assert interrupt.wait(5)
+        raise KeyboardInterrupt
+
+    price = cache.wrap("get_current_stock_price", get_current_stock_price)
+    outcomes = []
+
+    def call():
+        try:
+            outcomes.append(price("AAPL"))
+        except BaseException as e:
+            outcomes.append(type(e))
+
+    # Daemon threads, so a follower left waiting fails the test instead of hanging it
+    leader = threading.Thread(target=call, daemon=True)
+    leader.start()
+    assert leader_started.wait(5)
+    follower = threading.Thread(target=call, daemon=True)
+    follower.start()
+    wait_for(lambda: cache.stats()["coalesced"] == 1)
+    interrupt.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert not follower.is_alive()
+    assert outcomes == [KeyboardInterrupt, KeyboardInterrupt]
+    assert cache.stats()["in_flight"] == 0
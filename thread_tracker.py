@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+
+
+class ThreadParticipationCache:
+    """
+    Remembers which (channel, thread_ts) pairs the bot has replied in.
+
+    get() answers True or False from memory, or None when the thread is unknown
+    and the caller has to ask the Slack API. Positive entries live for ttl
+    seconds, negative ones for negative_ttl, and the least recently used
+    entries are dropped past max_entries. When a path is given, positive
+    entries are snapshotted to disk (at most every save_interval seconds) and
+    reloaded on start, so a restart does not turn every thread into a cold miss.
+    """
+
+    def __init__(self, ttl=7 * DAY, negative_ttl=300, max_entries=10000, path=None, save_interval=30):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.path = path
+        self.save_interval = save_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_save = 0.0
+        self._dirty = False
+        self._load()
+
+    @staticmethod
+    def _key(channel, thread_ts):
+        return f"{channel}:{thread_ts}"
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load thread participation cache from {self.path}: {str(e)}")
+            return
+
+        now = time.time()
+        for key, expires_at in sorted(data.items(), key=lambda item: item[1]):
+            if expires_at > now:
+                self._entries[key] = (True, expires_at)
+        self._trim()
+
+    def _trim(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, channel, thread_ts):
+        key = self._key(channel, thread_ts)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            participating, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return participating
+
+    def _set(self, channel, thread_ts, participating, ttl):
+        key = self._key(channel, thread_ts)
+        with self._lock:
+            now = time.time()
+            current = self._entries.get(key)
+            # A slow API lookup that started before the bot posted must not hide that post
+            if not participating and current is not None and current[0] and current[1] > now:
+                return
+            self._entries[key] = (participating, now + ttl)
+            self._entries.move_to_end(key)
+            self._trim()
+            self._dirty = self._dirty or participating
+
+    def mark(self, channel, thread_ts):
+        """Record that the bot posted in a thread."""
+        self._set(channel, thread_ts, True, self.ttl)
+        if time.time() - self._last_save >= self.save_interval:
+            self.save()
+
+    def mark_absent(self, channel, thread_ts):
+        """Record that the bot has not posted in a thread (after an API lookup); never overrides a live mark()."""
+        self._set(channel, thread_ts, False, self.negative_ttl)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {key: expires_at for key, (participating, expires_at) in self._entries.items() if participating}
+            self._dirty = False
+            self._last_save = time.time()
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,176 @@
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from rate_limit import TokenBucket
+import tracing
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+
+# How long a tool result stays valid, by phi function name: live prices for seconds,
+# news for minutes, fundamentals and company facts for hours
+TOOL_TTLS = {
+    "get_current_stock_price": 30,
+    "get_technical_indicators": 5 * MINUTE,
+    "get_historical_stock_prices": 15 * MINUTE,
+    "get_company_news": 10 * MINUTE,
+    "get_analyst_recommendations": 6 * HOUR,
+    "get_stock_fundamentals": 6 * HOUR,
+    "get_key_financial_ratios": 6 * HOUR,
+    "get_income_statements": 12 * HOUR,
+    "get_company_info": 12 * HOUR,
+    "duckduckgo_search": 10 * MINUTE,
+    "duckduckgo_news": 5 * MINUTE,
+}
+# Used for tools not listed above
+DEFAULT_TOOL_TTL = float(os.getenv("TOOL_CACHE_DEFAULT_TTL", "60"))
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "2000"))
+
+# Outgoing calls per minute, by phi toolkit name; results served from the cache do not count
+BACKEND_REQUESTS_PER_MINUTE = {
+    "duckduckgo": int(os.getenv("DUCKDUCKGO_REQUESTS_PER_MINUTE", "20")),
+    "yfinance_tools": int(os.getenv("YFINANCE_REQUESTS_PER_MINUTE", "60")),
+}
+
+# phi tools report most failures as a returned message instead of raising; those are not cached
+ERROR_PREFIXES = ("Error", "Could not")
+
+
+def _normalize(value):
+    # "aapl " and "AAPL", or two spellings of the same search, hit the same entry
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): _normalize(item) for key, item in value.items()}
+    return value
+
+
+def make_key(tool_name, fn, args, kwargs):
+    """Cache key from the tool name and its normalized arguments, with defaults filled in."""
+    try:
+        bound = inspect.signature(fn).bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+    except (TypeError, ValueError):
+        arguments = {"args": list(args), **kwargs}
+    return f"{tool_name}:{json.dumps(_normalize(arguments), sort_keys=True, default=str)}"
+
+
+class ToolResultCache:
+    """
+    Caches tool results, coalesces identical concurrent calls and rate-limits each backend.
+
+    A call whose key has an unexpired result returns it without touching the
+    backend. A call whose key is already being fetched by another thread waits
+    for that fetch and shares its result (or its exception). Only the thread
+    that actually calls the backend takes a token from that backend's bucket.
+    Error results and exceptions are never cached.
+    """
+
+    def __init__(self, ttls=None, default_ttl=DEFAULT_TOOL_TTL, max_entries=TOOL_CACHE_MAX_ENTRIES,
+                 requests_per_minute=None):
+        self.ttls = dict(TOOL_TTLS if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        # Bursts of up to ten seconds' worth of requests, then the steady rate
+        self._buckets = {
+            backend: TokenBucket.per_minute(rpm, burst=max(1, rpm // 6))
+            for backend, rpm in (BACKEND_REQUESTS_PER_MINUTE if requests_per_minute is None
+                                 else requests_per_minute).items()
+            if rpm > 0
+        }
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+    def ttl_for(self, tool_name):
+        return self.ttls.get(tool_name, self.default_ttl)
+
+    def call(self, tool_name, fn, args=(), kwargs=None, backend=None):
+        """Return fn(*args, **kwargs) from the cache, from an identical call in flight, or by calling it."""
+        kwargs = kwargs or {}
+        key = make_key(tool_name, fn, args, kwargs)
+        with tracing.span("tool.call", tool=tool_name, backend=backend) as tool_span:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > time.time():
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    tool_span.set(cache="hit")
+                    return entry[1]
+
+                future = self._in_flight.get(key)
+                leader = future is None
+                if leader:
+                    future = self._in_flight[key] = Future()
+                    self._stats["misses"] += 1
+                else:
+                    self._stats["coalesced"] += 1
+
+            if not leader:
+                tool_span.set(cache="coalesced")
+                return future.result()
+
+            tool_span.set(cache="miss")
+            try:
+                bucket = self._buckets.get(backend)
+                if bucket is not None:
+                    bucket.acquire()
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                # Followers wait on the future, so release them even on KeyboardInterrupt or cancellation
+                with self._lock:
+                    self._in_flight.pop(key, None)
+                    self._stats["errors"] += 1
+                future.set_exception(e)
+                raise
+
+            with self._lock:
+                self._in_flight.pop(key, None)
+                ttl = self.ttl_for(tool_name)
+                if ttl > 0 and not (isinstance(result, str) and result.startswith(ERROR_PREFIXES)):
+                    self._entries[key] = (time.time() + ttl, result)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            future.set_result(result)
+            return result
+
+    def wrap(self, tool_name, fn, backend=None):
+        """fn with every call going through the cache; keeps fn's signature for phi's schema and arguments."""
+        @functools.wraps(fn)
+        def cached(*args, **kwargs):
+            return self.call(tool_name, fn, args, kwargs, backend=backend)
+        return cached
+
+    def wrap_toolkit(self, toolkit):
+        """
+        Route every function of a phi Toolkit through the cache, in place.
+
+        The toolkit's name (e.g. "duckduckgo", "yfinance_tools") picks its rate limiter.
+
+        Returns:
+            the same toolkit
+        """
+        for name, function in toolkit.functions.items():
+            if function.entrypoint is not None:
+                function.entrypoint = self.wrap(name, function.entrypoint, backend=toolkit.name)
+        return toolkit
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries), "in_flight": len(self._in_flight)}
+
@@ -0,0 +1,250 @@
+import argparse
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Where finished spans go: TRACING_EXPORTER is "jsonl" (TRACING_PATH), "otel" (the globally configured
+# OpenTelemetry tracer) or "none". Both are read when the first span starts, not at import, so .env applies.
+DEFAULT_TRACING_EXPORTER = "none"
+DEFAULT_TRACING_PATH = "./cache/traces.jsonl"
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """One timed stage of a request. Attributes hold token counts, cache hits and similar facts."""
+
+    def __init__(self, name, parent=None, attributes=None, start=None):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.start = start if start is not None else time.time()
+        self.duration = None
+        self.error = None
+        # Used by the OpenTelemetry exporter to parent child spans
+        self.native = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": 1000 * self.duration if self.duration is not None else None,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class JsonlExporter:
+    """Appends one JSON line per finished span."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def on_start(self, span):
+        pass
+
+    def on_end(self, span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class OtelExporter:
+    """Mirrors spans into OpenTelemetry; the SDK and its exporter are configured by the application as usual."""
+
+    def __init__(self):
+        from opentelemetry import trace
+        self._trace = trace
+        self._tracer = trace.get_tracer("agentrag")
+
+    def on_start(self, span):
+        parent = span.parent
+        context = self._trace.set_span_in_context(parent.native) if parent is not None and parent.native else None
+        span.native = self._tracer.start_span(span.name, context=context, start_time=int(span.start * 1e9))
+
+    def on_end(self, span):
+        for key, value in span.attributes.items():
+            if value is not None:
+                span.native.set_attribute(key, value if isinstance(value, (str, bool, int, float)) else str(value))
+        if span.error:
+            span.native.set_attribute("error", span.error)
+        span.native.end(end_time=int((span.start + span.duration) * 1e9))
+
+
+def tracing_path():
+    return os.getenv("TRACING_PATH", DEFAULT_TRACING_PATH)
+
+
+def _make_exporter():
+    kind = os.getenv("TRACING_EXPORTER", DEFAULT_TRACING_EXPORTER).lower()
+    try:
+        if kind == "jsonl":
+            return JsonlExporter(tracing_path())
+        if kind == "otel":
+            return OtelExporter()
+    except ImportError:
+        logger.warning("TRACING_EXPORTER=otel needs the opentelemetry-api package, tracing is disabled")
+    return None
+
+
+_exporter = None
+_exporter_ready = False
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    """The exporter chosen by TRACING_EXPORTER, built on first use; None when tracing is disabled."""
+    global _exporter, _exporter_ready
+    if not _exporter_ready:
+        with _exporter_lock:
+            if not _exporter_ready:
+                _exporter = _make_exporter()
+                _exporter_ready = True
+    return _exporter
+
+
+def _export(method, span):
+    # Tracing must never break a request
+    try:
+        getattr(get_exporter(), method)(span)
+    except Exception as e:
+        logger.warning(f"Could not export span {span.name}: {str(e)}")
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time the enclosed block as a span, nested under the current span of this thread or task.
+
+    Yields an object with set(**attributes) for facts learned inside the block.
+    A no-op when tracing is disabled.
+    """
+    if get_exporter() is None:
+        yield _NOOP
+        return
+
+    parent = _current.get()
+    current = Span(name, parent, attributes)
+    _export("on_start", current)
+    token = _current.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except Exception as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        _current.reset(token)
+        _export("on_end", current)
+
+
+def record_span(name, seconds, **attributes):
+    """Record a stage that already finished, e.g. from timings a library reported, as a child of the current span."""
+    if get_exporter() is None:
+        return
+    parent = _current.get()
+    finished = Span(name, parent, attributes, start=time.time() - seconds)
+    _export("on_start", finished)
+    finished.duration = seconds
+    _export("on_end", finished)
+
+
+def set_attributes(**attributes):
+    """Add attributes to the current span, if there is one."""
+    current = _current.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    # Worker threads do not inherit context variables, so run each task in a copy of the caller's
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))]
+
+
+def summarize(path=None, since=None):
+    """
+    Latency per stage from a JSONL trace file.
+
+    Args:
+        path: file written by the jsonl exporter (TRACING_PATH by default)
+        since: only count spans that started after this epoch time
+
+    Returns:
+        dict: {span name: {"count", "p50_ms", "p95_ms", "max_ms", "total_ms", "errors"}}, slowest total first
+    """
+    durations = defaultdict(list)
+    errors = defaultdict(int)
+    with open(path or tracing_path(), "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record["duration_ms"] is None or (since and record["start"] < since):
+                continue
+            durations[record["name"]].append(record["duration_ms"])
+            if record.get("error"):
+                errors[record["name"]] += 1
+
+    report = {
+        name: {
+            "count": len(values),
+            "p50_ms": _percentile(values, 50),
+            "p95_ms": _percentile(values, 95),
+            "max_ms": max(values),
+            "total_ms": sum(values),
+            "errors": errors[name],
+        }
+        for name, values in durations.items()
+    }
+    return dict(sorted(report.items(), key=lambda item: item[1]["total_ms"], reverse=True))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize request traces written with TRACING_EXPORTER=jsonl")
+    parser.add_argument("path", nargs="?", help="trace file (defaults to TRACING_PATH)")
+    parser.add_argument("--hours", type=float, help="only spans from the last N hours")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+
+    since = time.time() - args.hours * 3600 if args.hours else None
+    report = summarize(args.path, since=since)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{'stage':<36} {'count':>7} {'p50 ms':>10} {'p95 ms':>10} {'max ms':>10} {'errors':>7}")
+        for name, stats in report.items():
+            print(f"{name:<36} {stats['count']:>7} {stats['p50_ms']:>10.1f} {stats['p95_ms']:>10.1f} "
+                  f"{stats['max_ms']:>10.1f} {stats['errors']:>7}")